@@ -0,0 +1,235 @@
+"""
+Benchmarks for building, composing and calling runners.
+
+These follow the conventions of `asv <https://asv.readthedocs.io/>`__:
+each class may have ``params`` and ``param_names``, ``setup`` and
+``teardown`` methods called with each combination of parameters and
+``time_*`` methods that are timed. They can be run with asv or, without any extra
+dependencies, with ``python -m benchmarks.run``.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import DEVNULL, check_call
+import sys
+
+from mush import Runner, attr, first, item, last, marker
+
+#: The numbers of callables in the synthetic runners.
+sizes = [10, 100, 1000, 10000]
+
+
+class Value(object):
+
+    def __init__(self):
+        self.x = dict(y=1)
+
+
+def make_types(n):
+    return [marker('Bench%i' % i) for i in range(n)]
+
+
+def make_callable(i):
+    def func(*args):
+        return Value()
+    func.__name__ = 'func%i' % i
+    return func
+
+
+def make_specs(n, fan_in, wrap=lambda type, i: type):
+    """
+    Return a list of ``(callable, returns, requirements)`` for a runner
+    of `n` callables, each requiring the types returned by up to
+    `fan_in` of the callables before it.
+    """
+    types = make_types(n)
+    specs = []
+    for i, type in enumerate(types):
+        requirements = [wrap(t, j) for j, t in
+                        enumerate(types[max(0, i - fan_in):i])]
+        specs.append((make_callable(i), type, requirements))
+    return specs
+
+
+def build(specs):
+    runner = Runner()
+    for obj, returns, requirements in specs:
+        runner.add_returning(obj, returns, *requirements)
+    return runner
+
+
+class Build(object):
+    "Adding callables to a runner."
+
+    params = [sizes, [1, 10]]
+    param_names = ['callables', 'fan_in']
+
+    def setup(self, n, fan_in):
+        self.specs = make_specs(n, fan_in)
+
+    def time_add(self, n, fan_in):
+        runner = Runner()
+        for obj, returns, requirements in self.specs:
+            runner.add(obj, *requirements)
+
+    def time_add_returning(self, n, fan_in):
+        build(self.specs)
+
+
+class Compose(object):
+    "Combining and copying runners."
+
+    params = [sizes]
+    param_names = ['callables']
+
+    def setup(self, n):
+        specs = make_specs(n, 2)
+        self.runner = build(specs[:n // 2])
+        self.other = build(specs[n // 2:])
+        self.original = specs[n // 4][0]
+
+    def time_clone(self, n):
+        self.runner.clone()
+
+    def time_add_runners(self, n):
+        self.runner + self.other
+
+    def time_extend(self, n):
+        Runner().extend(self.runner, self.other)
+
+    def time_replace(self, n):
+        self.runner.replace(self.original, self.original)
+
+
+class Call(object):
+    """
+    Calling runners, both once compiled and including compiling them,
+    with plans that call their steps in a loop and with plans that
+    generate source. :attr:`~mush.Runner.generate` should only be turned
+    on by default if the generated times here show a gain.
+    """
+
+    params = [sizes, [1, 10]]
+    param_names = ['callables', 'fan_in']
+
+    def setup(self, n, fan_in):
+        self.runner = build(make_specs(n, fan_in))
+        self.runner()
+        self.generated = self.runner.clone()
+        self.generated.generate = True
+        self.generated()
+
+    def time_call(self, n, fan_in):
+        self.runner()
+
+    def time_call_generated(self, n, fan_in):
+        self.generated()
+
+    def time_compile_and_call(self, n, fan_in):
+        self.runner.clone()()
+
+    def time_compile_and_call_generated(self, n, fan_in):
+        runner = self.runner.clone()
+        runner.generate = True
+        runner()
+
+
+class Dispatch(object):
+    """
+    Calling runners with an executor, where each step is submitted once
+    the steps before it that it depends on have finished.
+    """
+
+    params = [sizes, [1, 10]]
+    param_names = ['callables', 'fan_in']
+
+    def setup(self, n, fan_in):
+        self.runner = build(make_specs(n, fan_in))
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.runner(executor=self.executor)
+
+    def teardown(self, n, fan_in):
+        self.executor.shutdown()
+
+    def time_call(self, n, fan_in):
+        self.runner(executor=self.executor)
+
+
+def chain(type, i):
+    "Wrap a type in a chain of attribute and item lookups."
+    return attr(item(attr(type, 'x'), 'y'), 'real')
+
+
+def period(type, i):
+    "Alternate between the first and last periods for a type."
+    return (first, last)[i % 2](type)
+
+
+class Declarations(object):
+    "Runners using attr and item chains and first and last periods."
+
+    params = [[10, 100, 1000], ['chain', 'period']]
+    param_names = ['callables', 'declaration']
+
+    def setup(self, n, declaration):
+        self.specs = make_specs(n, 2, dict(chain=chain, period=period)[
+            declaration
+        ])
+        self.runner = build(self.specs)
+        self.runner()
+
+    def time_build(self, n, declaration):
+        build(self.specs)
+
+    def time_call(self, n, declaration):
+        self.runner()
+
+
+class Manager(object):
+
+    def __init__(self, *args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, obj, tb):
+        pass
+
+
+class ContextManagers(object):
+    "Runners where each callable returns a context manager to be nested."
+
+    params = [[1, 10, 100]]
+    param_names = ['managers']
+
+    def setup(self, n):
+        types = make_types(n)
+        self.runner = Runner()
+        for i, returned in enumerate(types):
+            manager = type('Manager%i' % i, (Manager, ), {})
+            self.runner.add(manager, *types[i-1:i])
+            self.runner.add_returning(make_callable(i), returned, manager)
+        self.runner()
+
+    def time_call(self, n):
+        self.runner()
+
+
+class Examples(object):
+    """
+    Starting up the example scripts, each in a new interpreter, up to
+    the point where they print their help.
+    """
+
+    params = [['clone', 'factory']]
+    param_names = ['example']
+
+    number = 1
+    repeat = 3
+
+    def time_startup(self, example):
+        check_call([sys.executable, '-c', (
+            'import sys\n'
+            'from mush.tests.example_with_mush_%s import main\n'
+            'sys.argv[1:] = ["--help"]\n'
+            'main()'
+        ) % example], stdout=DEVNULL)
@@ -0,0 +1,140 @@
+"""
+Run the benchmarks in :mod:`benchmarks.benchmarks` using :mod:`timeit`,
+saving the results as JSON and optionally comparing them with the
+results of an earlier run::
+
+  $ python -m benchmarks.run --output before.json
+  $ git checkout my-branch
+  $ python -m benchmarks.run --output after.json --compare before.json
+"""
+from argparse import ArgumentParser
+from itertools import product
+import json
+import os
+import platform
+import re
+from subprocess import check_output
+import sys
+from timeit import Timer
+
+from . import benchmarks
+
+results_dir = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def discover(pattern=None):
+    """
+    Yield the name, class, method name and parameters of each benchmark
+    whose name matches the supplied regular expression.
+    """
+    for class_name, cls in sorted(vars(benchmarks).items()):
+        if not isinstance(cls, type) or cls.__module__ != benchmarks.__name__:
+            continue
+        params = getattr(cls, 'params', [])
+        names = getattr(cls, 'param_names', [])
+        for method in sorted(vars(cls)):
+            if not method.startswith('time_'):
+                continue
+            for values in product(*params):
+                name = '%s.%s(%s)' % (class_name, method, ', '.join(
+                    '%s=%s' % pair for pair in zip(names, values)
+                ))
+                if pattern is None or re.search(pattern, name):
+                    yield name, cls, method, values
+
+
+def measure(cls, method, values, repeat, quick):
+    "Return the timings, in seconds per call, of one benchmark."
+    instance = cls()
+    setup = getattr(instance, 'setup', None)
+    if setup is not None:
+        setup(*values)
+    timer = Timer(lambda: getattr(instance, method)(*values))
+    try:
+        if quick:
+            number, repeat = 1, 1
+        else:
+            number = getattr(cls, 'number', None)
+            if number is None:
+                number, _ = timer.autorange()
+            repeat = getattr(cls, 'repeat', repeat)
+        times = sorted(t / number for t in timer.repeat(repeat, number))
+    finally:
+        teardown = getattr(instance, 'teardown', None)
+        if teardown is not None:
+            teardown(*values)
+    return dict(min=times[0], median=times[len(times) // 2],
+                number=number, repeat=repeat)
+
+
+def commit():
+    "Return the current git commit, if there is one."
+    try:
+        return check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(__file__),
+            stderr=open(os.devnull, 'w')
+        ).decode('ascii').strip()
+    except Exception:
+        return None
+
+
+def compare(results, path):
+    "Print how the supplied results compare with those saved in `path`."
+    with open(path) as file:
+        previous = json.load(file)['results']
+    print('\n%-60s %10s %10s %7s' % ('benchmark', 'before', 'after', 'ratio'))
+    for name, timing in results.items():
+        before = previous.get(name)
+        if before is None:
+            continue
+        ratio = timing['min'] / before['min']
+        flag = ' !' if ratio > 1.1 else ''
+        print('%-60s %9.3fms %9.3fms %7.2f%s' % (
+            name, before['min'] * 1000, timing['min'] * 1000, ratio, flag
+        ))
+
+
+def main(argv=None):
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--filter', help='Only run benchmarks matching this '
+                                         'regular expression')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of times to repeat each benchmark')
+    parser.add_argument('--quick', action='store_true',
+                        help='Call each benchmark only once')
+    parser.add_argument('--output', help='Where to save the results, '
+                                         'defaults to the current commit '
+                                         'in benchmarks/results/')
+    parser.add_argument('--compare', help='Results of an earlier run to '
+                                          'compare with')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, cls, method, values in discover(args.filter):
+        timing = measure(cls, method, values, args.repeat, args.quick)
+        results[name] = timing
+        print('%-60s %9.3fms' % (name, timing['min'] * 1000))
+
+    revision = commit()
+    output = args.output
+    if output is None:
+        if not os.path.exists(results_dir):
+            os.makedirs(results_dir)
+        output = os.path.join(results_dir, '%s.json' % (revision or 'latest'))
+    with open(output, 'w') as file:
+        json.dump(dict(
+            commit=revision,
+            python=platform.python_version(),
+            implementation=platform.python_implementation(),
+            machine=platform.machine(),
+            results=results,
+        ), file, indent=2, sort_keys=True)
+        file.write('\n')
+    print('\nSaved results to ' + output)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
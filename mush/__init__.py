@@ -1,9 +1,37 @@
-from collections import defaultdict, deque
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from functools import partial
+from heapq import heappop, heappush
+from itertools import count
+from keyword import iskeyword
+from logging import Logger, getLogger
+from operator import itemgetter
+from os import getpid
+from threading import Lock
+from weakref import WeakValueDictionary, ref
+import linecache
+import re
 import sys
 
+if sys.version_info[0] > 2:
+    from copyreg import pickle
+    from queue import Queue
+    from threading import get_ident
+    from time import monotonic, perf_counter as clock
+    def reraise(exc_info):
+        raise exc_info[1].with_traceback(exc_info[2])
+else:
+    from copy_reg import pickle
+    from Queue import Queue
+    from thread import get_ident
+    from time import time as monotonic, time as clock
+    exec('def reraise(exc_info):\n'
+         '    raise exc_info[0], exc_info[1], exc_info[2]\n')
+
 type_func = lambda obj: obj.__class__
 none_type = type_func(None)
 
+logger = getLogger(__name__)
+
 markers = {}
 
 class Marker(type):
@@ -17,13 +45,42 @@ def marker(name):
         markers[name] = Marker(name, (object,), {})
     return markers[name]
 
+# so that markers can be passed to and returned from other processes:
+pickle(Marker, lambda m: (marker, (m.__name__, )))
+
 not_specified = marker('not_specified')
 
 class Context(dict):
-    "Stores requirements, callables and resources for a particular run."
-    def __init__(self):
+    """
+    Stores requirements, callables and resources for a particular run.
+
+    Any objects passed will be added to the context as resources, so
+    that a context can be created ahead of a run and passed to
+    :meth:`Runner.__call__`.
+    """
+    def __init__(self, *objs):
         self.req_objs = []
         self.index = 0
+        #: The context managers that have been entered during the run,
+        #: innermost last.
+        self.managers = []
+        #: When a run is using an executor, the positions in
+        #: :attr:`req_objs` of the steps that have not yet been started.
+        self.pending = None
+        #: A mapping of types to the :class:`Step` for the :class:`lazy`
+        #: provider that should be called to produce them when needed.
+        self.providers = {}
+        #: A mapping of the :func:`id` of each entered context manager
+        #: to the object returned when it was entered.
+        self.entered = {}
+        #: The :class:`Hook` instances to notify when context managers
+        #: are entered or exited.
+        self.hooks = ()
+        #: When not ``None``, a list to which the type of each resource
+        #: is appended as it is added. See :class:`Schedule`.
+        self.added = None
+        for obj in objs:
+            self.add(obj)
 
     def add(self, it, type=None):
         """
@@ -41,12 +98,42 @@ class Context(dict):
                     type.__name__
                     ))
         self[type] = it
+        if self.added is not None:
+            self.added.append(type)
+
+    def enter(self, manager):
+        """
+        Enter a context manager, adding both it and the object returned
+        by its ``__enter__`` method to the context.
+
+        The manager is stored in :attr:`managers` so that it can be
+        exited when the run is complete.
+        """
+        self.add(manager)
+        obj = manager.__enter__()
+        self.managers.append(manager)
+        self.entered[id(manager)] = obj
+        for hook in self.hooks:
+            hook.enter(self, manager)
+        if obj not in (None, manager):
+            self.add(obj)
+
+    def exit(self, manager, exc_info=(None, None, None)):
+        """
+        Exit a context manager that has been entered, returning what its
+        ``__exit__`` method returns.
+        """
+        try:
+            return manager.__exit__(*exc_info)
+        finally:
+            for hook in self.hooks:
+                hook.exit(self, manager)
 
     def __iter__(self):
         """
-        When iterated over, the context will yield tuples containing
-        the requirements for a callable and the callable itself in the
-        form ``(requirements, object)``.
+        When iterated over, the context will yield the items in
+        :attr:`req_objs`, usually the :class:`Step` instances from a
+        :class:`Plan`, that have not yet been called.
 
         This can only be done once for a given context.
         A context that has been partially iterated over will remember
@@ -61,12 +148,23 @@ class Context(dict):
         """
         Get an object of the specified type from the context.
 
+        If there is no object of that type but there is a
+        :class:`lazy` provider for it, the provider will be called first.
+
         This will raise a :class:`KeyError` if no object of that type
         can be located.
         """
         if type is none_type:
             return None
         obj = super(Context, self).get(type, not_specified)
+        if obj is not_specified:
+            provider = self.providers.pop(type, None)
+            if provider is not None:
+                if self.hooks:
+                    call_step(provider, self, self.hooks)
+                else:
+                    provider(self)
+                obj = super(Context, self).get(type, not_specified)
         if obj is not_specified:
             raise KeyError('No %s in context' % type.__name__)
         return obj
@@ -83,12 +181,13 @@ class Requirements(object):
     arguments or keyword parameters the callable requires.
     """
 
-    #: An override for the type that this callable will return.
-    returns = not_specified
+    __slots__ = ('args', 'kw', 'returns', '__weakref__')
 
     def __init__(self, *args, **kw):
         self.args = args
         self.kw = kw
+        #: An override for the type that this callable will return.
+        self.returns = not_specified
 
     def __iter__(self):
         """
@@ -119,6 +218,28 @@ class Requirements(object):
 #: requires no resources.
 nothing = Requirements()
 
+# Identical requirements used by callables in runners are stored once:
+_interned = WeakValueDictionary()
+
+def _intern(args, kw, returns=not_specified):
+    """
+    Return :class:`Requirements` for the supplied arguments, re-using
+    identical requirements that are already in use where possible.
+    These must not be changed.
+    """
+    try:
+        key = args, tuple(sorted(kw.items())), returns
+        requirements = _interned.get(key)
+    except TypeError:
+        # something unhashable
+        key = requirements = None
+    if requirements is None:
+        requirements = Requirements(*args, **kw)
+        requirements.returns = returns
+        if key is not None:
+            _interned[key] = requirements
+    return requirements
+
 class requires(object):
     """
     A decorator used for marking a callable with the
@@ -161,6 +282,245 @@ class returns(object):
         obj.__returns__ = self.type
         return obj
 
+class Identity(object):
+    """
+    Used in place of an unhashable object in the key of a :class:`Cache`
+    so that it is compared by identity.
+    """
+    __slots__ = ('obj', )
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __hash__(self):
+        return id(self.obj)
+
+    def __eq__(self, other):
+        return type_func(other) is Identity and other.obj is self.obj
+
+    def __ne__(self, other):
+        return not self == other
+
+#: The statistics for a :class:`Cache` returned by :meth:`Cache.info`.
+CacheInfo = namedtuple('CacheInfo', 'hits misses max_size size')
+
+def cacheable(result):
+    """
+    Return whether the supplied result of calling a callable may be
+    stored and re-used. Context managers are not, as they are exited at
+    the end of each run.
+    """
+    return not (getattr(result, '__enter__', None) or
+                getattr(result, '__aenter__', None))
+
+class Cache(object):
+    """
+    The results of a callable with a :class:`scope`, keyed by the
+    arguments and keyword parameters it was called with.
+
+    :param max_size:
+      If passed, the least recently used result will be discarded
+      when more than this number are stored.
+    :param ttl:
+      If passed, results will be discarded once they have been
+      stored for this many seconds.
+    """
+
+    #: The clock used to work out how long results have been stored.
+    clock = staticmethod(monotonic)
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        #: The number of times a stored result has been found.
+        self.hits = 0
+        #: The number of times no stored result was found.
+        self.misses = 0
+
+    @staticmethod
+    def key(args, kw):
+        "Return the key used for the supplied arguments and parameters."
+        def part(value):
+            try:
+                hash(value)
+            except TypeError:
+                return Identity(value)
+            return value
+        return (tuple(part(a) for a in args),
+                tuple(sorted(((k, part(v)) for k, v in kw.items()),
+                             key=itemgetter(0))))
+
+    def get(self, key):
+        """
+        Return the result stored for the supplied key, or
+        ``not_specified`` if there is no result or it has expired.
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return not_specified
+            stored, result = entry
+            if self.ttl is not None and self.clock() - stored > self.ttl:
+                self.misses += 1
+                return not_specified
+            self.entries[key] = entry
+            self.hits += 1
+            return result
+
+    def set(self, key, result):
+        "Store the result for the supplied key."
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (self.clock(), result)
+            if self.max_size is not None:
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+
+    def clear(self):
+        "Discard all stored results."
+        with self.lock:
+            self.entries.clear()
+
+    def info(self):
+        "Return the :class:`CacheInfo` for this cache."
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.max_size,
+                             len(self.entries))
+
+    def __len__(self):
+        return len(self.entries)
+
+class Cached(object):
+    """
+    Wraps a callable so that its results are stored in, and obtained
+    from, the supplied :class:`Cache`.
+    """
+    def __init__(self, call, cache):
+        self.call = call
+        self.cache = cache
+
+    def __call__(self, *args, **kw):
+        key = self.cache.key(args, kw)
+        result = self.cache.get(key)
+        if result is not_specified:
+            result = self.call(*args, **kw)
+            if cacheable(result):
+                self.cache.set(key, result)
+        return result
+
+    def __repr__(self):
+        return '<Cached %r>' % self.call
+
+class scope(object):
+    """
+    A decorator to indicate how long the results of a callable
+    should be kept and re-used for when it is called with the same
+    resources.
+
+    :param name:
+      ``'call'``, the default for undecorated callables, means the
+      callable is called every time a runner is called.
+      ``'runner'`` means results are kept by each runner the callable
+      is added to. ``'process'`` means results are kept for as long as
+      the callable exists, regardless of which runner calls it.
+    :param max_size:
+      The number of results to keep, as for :class:`Cache`. As with
+      :func:`functools.lru_cache`, this defaults to 128 and ``None``
+      means there is no limit.
+    :param ttl: See :class:`Cache`.
+
+    Resources are compared using their ``__eq__`` and ``__hash__``
+    methods, or by identity if they cannot be hashed, so a result is
+    only re-used for resources created again on each call if they
+    define those methods to compare their values.
+    """
+    names = ('call', 'runner', 'process')
+
+    def __init__(self, name, max_size=128, ttl=None):
+        if name not in self.names:
+            raise ValueError('%r is not a valid scope' % name)
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        #: A mapping of each callable with the ``process`` scope to the
+        #: :class:`Cache` of its results.
+        self.caches = {}
+
+    def __call__(self, obj):
+        obj.__scope__ = self
+        return obj
+
+    def cache_for(self, obj, caches):
+        """
+        Return the :class:`Cache` to use for the supplied callable,
+        given the mapping of caches for the runner it is in, or
+        ``None`` if its results should not be kept.
+        """
+        if self.name == 'process':
+            caches = self.caches
+        elif self.name != 'runner':
+            return None
+        cache = caches.get(obj)
+        if cache is None:
+            cache = caches.setdefault(obj, Cache(self.max_size, self.ttl))
+        return cache
+
+def memoize(max_size=128, ttl=None):
+    """
+    A decorator to indicate that a callable always returns the same
+    result when called with the same resources, so each runner it is
+    added to can keep its results and re-use them on later calls.
+
+    This is the same as using the ``'runner'`` :class:`scope`, so
+    results are only re-used for resources that compare equal, as
+    described there. Results that are context managers are never kept.
+
+    :param max_size: See :class:`scope`.
+    :param ttl: See :class:`Cache`.
+    """
+    return scope('runner', max_size, ttl)
+
+class lazy(object):
+    """
+    A decorator to indicate that a callable should only be called
+    when the type it provides is required by another callable, rather
+    than in the order in which it was added to a runner.
+
+    :param type:
+      The type the callable provides. If not passed, this will be the
+      type specified using :class:`returns` or
+      :meth:`Runner.add_returning` or, if the callable is a class, the
+      class itself.
+    """
+    def __init__(self, type=not_specified):
+        self.type = type
+
+    def __call__(self, obj):
+        obj.__lazy__ = self
+        return obj
+
+def _state(obj):
+    """
+    Return the class of the supplied :class:`when` or :class:`how` along
+    with the values of all of its attributes, including those added by
+    subclasses, for comparing and hashing it.
+    """
+    state = [type_func(obj)]
+    for cls in reversed(type_func(obj).__mro__):
+        slots = cls.__dict__.get('__slots__', ())
+        if isinstance(slots, str):
+            slots = (slots, )
+        for name in slots:
+            if name not in ('__dict__', '__weakref__'):
+                state.append(getattr(obj, name, not_specified))
+    attributes = getattr(obj, '__dict__', None)
+    if attributes:
+        state.append(tuple(sorted(attributes.items())))
+    return tuple(state)
+
 class when(object):
     """
     The base class for type decorators that indicate when a callable
@@ -168,8 +528,17 @@ class when(object):
 
     :param type: The type to be decorated.
     """
+    __slots__ = ('type', )
+
     def __init__(self, type=none_type):
         self.type = type
+    def __eq__(self, other):
+        return type_func(other) is type_func(self) and (
+            _state(other) == _state(self))
+    def __ne__(self, other):
+        return not self == other
+    def __hash__(self):
+        return hash(_state(self))
     def __repr__(self):
         return '%s(%s)' % (self.__class__.__name__, self.type.__name__)
     @property
@@ -181,12 +550,14 @@ class first(when):
     A :class:`when` that indicates the callable requires first use
     of the decorated type.
     """
+    __slots__ = ()
 
 class last(when):
     """
     A :class:`when` that indicates the callable requires last use
     of the decorated type.
     """
+    __slots__ = ()
 
 class how(object):
     """
@@ -196,6 +567,7 @@ class how(object):
     :param type: The type to be decorated.
     :param name: The part of the type required by the callable.
     """
+    __slots__ = ('type', 'names')
     type_pattern = '%(type)s'
     name_pattern = ''
 
@@ -203,6 +575,16 @@ class how(object):
         self.type = type
         self.names = names
 
+    def __eq__(self, other):
+        return type_func(other) is type_func(self) and (
+            _state(other) == _state(self))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(_state(self))
+
     def __repr__(self):
         txt = self.type_pattern % dict(type=self.type.__name__)
         for name in self.names:
@@ -218,6 +600,7 @@ class attr(how):
     A :class:`how` that indicates the callable requires the named
     attribute from the decorated type.
     """
+    __slots__ = ()
     name_pattern = '.%(name)s'
     def op(self, o):
         for name in self.names:
@@ -229,6 +612,7 @@ class item(how):
     A :class:`how` that indicates the callable requires the named
     item from the decorated type.
     """
+    __slots__ = ()
     name_pattern = '[%(name)r]'
     def op(self, o):
         for name in self.names:
@@ -240,6 +624,7 @@ class ignore(how):
     A :class:`how` that indicates the callable should not be passed
     an object of the decorated type.
     """
+    __slots__ = ()
     type_pattern = 'ignore(%(type)s)'
     @staticmethod
     def op(o):
@@ -259,7 +644,8 @@ class Periods(object):
     A collection of lists used to store the callables that require a
     particular resource type.
     """
-    
+    __slots__ = ('first', 'normal', 'last')
+
     def __init__(self):
         #: The callables that require first use of a particular resource.
         self.first = []
@@ -281,11 +667,1247 @@ class Periods(object):
         for obj in self.last:
             yield obj
 
+    def copy(self):
+        "Return a copy of these periods that can be changed separately."
+        periods = Periods()
+        periods.first = list(self.first)
+        periods.normal = list(self.normal)
+        periods.last = list(self.last)
+        return periods
+
     def __repr__(self):
         return '<Periods first:%r normal:%r last:%r>' % (
             self.first, self.normal, self.last
             )
 
+class Hook(object):
+    """
+    The base class for objects that are notified as the callables in a
+    :class:`Runner` are called. Add instances to :attr:`Runner.hooks`
+    and override the methods for the notifications needed.
+
+    Each method is passed the :class:`Context` for the run.
+    """
+
+    def start(self, context):
+        "Called when a run starts."
+
+    def before(self, context, step, args, kw):
+        """
+        Called before the callable for a :class:`Step` is called, with
+        the arguments and keyword parameters it will be called with.
+        """
+
+    def after(self, context, step, result, call):
+        """
+        Called after the callable for a :class:`Step` has returned, with
+        what it returned and the :class:`Timed` call, which records how
+        long it took.
+        """
+
+    def error(self, context, step, exception, call):
+        """
+        Called if the callable for a :class:`Step` raises an exception,
+        with the exception and the :class:`Timed` call, which records
+        how long it took.
+        """
+
+    def enter(self, context, manager):
+        "Called once a context manager has been entered."
+
+    def exit(self, context, manager):
+        "Called once a context manager has been exited."
+
+    def finish(self, context, exception):
+        """
+        Called when a run has finished, along with the exception being
+        raised, if there is one.
+        """
+
+class Timed(object):
+    """
+    Wraps a callable so that when, where and for how long it was called
+    are recorded.
+    """
+    #: The :func:`clock <time.perf_counter>` time, in seconds, at which
+    #: the callable was called.
+    start = None
+    #: The number of seconds the call took.
+    elapsed = None
+    #: The identifier of the thread in which the callable was called.
+    thread = None
+    #: The identifier of the process in which the callable was called.
+    process = None
+
+    def __init__(self, call):
+        self.call = call
+
+    def __call__(self, *args, **kw):
+        self.thread = get_ident()
+        self.process = getpid()
+        self.start = clock()
+        try:
+            return self.call(*args, **kw)
+        finally:
+            self.elapsed = clock() - self.start
+
+class Step(object):
+    """
+    A callable from a :class:`Runner` along with the sources of its
+    arguments and the handling of its return value, all resolved once
+    when the runner is compiled.
+
+    :param requirements: The clean :class:`Requirements` for the callable.
+    :param original: The :class:`Requirements` the callable was added with.
+    :param obj: The callable itself.
+    :param caches:
+      The mapping of callables to their :class:`Cache` for the runner
+      the callable is in. See :class:`scope`.
+    """
+
+    def __init__(self, requirements, original, obj, caches=None):
+        self.requirements = requirements
+        self.obj = obj
+        self.returns = requirements.returns
+        #: The type passed to :class:`lazy` for a provider, used when
+        #: adding a result that is not a context manager and has no
+        #: other type specified.
+        self.provides = None
+        #: What to call with the resolved arguments and parameters.
+        #: This is usually the callable itself, but callables marked
+        #: with :class:`~mush.processes.in_process` are instead passed
+        #: to the pool they should be called in and those with a
+        #: :class:`scope` are wrapped so their results can be re-used.
+        self.call = obj
+        pool = getattr(obj, '__in_process__', None)
+        if pool is not None:
+            self.call = partial(pool, obj)
+        scope = getattr(obj, '__scope__', None)
+        if scope is not None:
+            cache = scope.cache_for(obj, {} if caches is None else caches)
+            if cache is not None:
+                self.call = Cached(self.call, cache)
+        #: A mapping of each type the callable requires to the name of
+        #: the period in which it requires it. Every callable is treated
+        #: as requiring ``NoneType`` in the ``normal`` period unless it
+        #: explicitly requires it in another period.
+        self.periods = {none_type: 'normal'}
+        for _, type in original:
+            period = 'normal'
+            while isinstance(type, (when, how)):
+                if isinstance(type, when):
+                    period = type.__class__.__name__
+                type = type.type
+            self.periods[type] = period
+        #: A sequence of ``(keyword_name, type, ops)`` tuples, where
+        #: ``ops`` are the :class:`how` operations to apply, innermost
+        #: first, to the resource of ``type`` obtained from the context.
+        self.sources = []
+        for name, type in requirements:
+            ops = deque()
+            while isinstance(type, (when, how)):
+                if isinstance(type, how):
+                    ops.appendleft(type.op)
+                type = type.type
+            self.sources.append((name, type, tuple(ops)))
+        self.sources = tuple(self.sources)
+
+    def resolve(self, context):
+        """
+        Return the positional arguments and keyword parameters with
+        which to call the callable, obtained from the supplied
+        :class:`Context`.
+        """
+        args = []
+        kw = {}
+        for name, type, ops in self.sources:
+            try:
+                o = context.get(type)
+            except KeyError as e:
+                raise KeyError('%s attempting to call %r' % (e, self.obj))
+
+            for op in ops:
+                o = op(o)
+
+            if o is nothing:
+                pass
+            elif name is None:
+                args.append(o)
+            else:
+                kw[name] = o
+
+        return args, kw
+
+    def __call__(self, context):
+        """
+        Call the callable with the resources it requires from the
+        supplied :class:`Context` and add the result to the context.
+        """
+        args, kw = self.resolve(context)
+        self.handle(context, self.call(*args, **kw))
+
+    def handle(self, context, result):
+        """
+        Add the result of calling this step to the supplied
+        :class:`Context`, taking into account any special return types.
+        """
+        if self.returns is not not_specified:
+            context.add(result, self.returns)
+        elif result is not None:
+            if type_func(result) in (tuple, list):
+                for obj in result:
+                    context.add(obj)
+            elif type_func(result) is dict:
+                for type, obj in result.items():
+                    context.add(obj, type)
+            elif getattr(result, '__enter__', None):
+                context.enter(result)
+            else:
+                context.add(result, self.provides)
+
+    def __repr__(self):
+        return '<Step: %r requires %r>' % (self.obj, self.requirements)
+
+
+def call_step(step, context, hooks):
+    """
+    Call the supplied :class:`Step` using the supplied :class:`Context`,
+    notifying the supplied :class:`Hook` instances. This is used for
+    both the steps of a :class:`Plan` and :class:`lazy` providers.
+    """
+    args, kw = step.resolve(context)
+    for hook in hooks:
+        hook.before(context, step, args, kw)
+    call = Timed(step.call)
+    try:
+        result = call(*args, **kw)
+    except BaseException as e:
+        for hook in hooks:
+            hook.error(context, step, e, call)
+        raise
+    for hook in hooks:
+        hook.after(context, step, result, call)
+    step.handle(context, result)
+
+
+class Schedule(object):
+    """
+    Keeps track of which of the steps of a :class:`Plan` that remain in
+    a :class:`Context` can be started, when steps may finish in any
+    order. See :meth:`Plan.dispatch`.
+
+    A step can be started once all of the steps it :attr:`depends
+    <Plan.dependencies>` on have finished and all the resources it
+    requires are in the context, or once it is the lowest step that has
+    not finished. So that only the steps affected by a step finishing
+    are looked at again, the number of unfinished steps each step
+    depends on is kept, along with a mapping of types to the steps
+    waiting for them to be added to the context.
+    """
+
+    def __init__(self, plan, context):
+        self.steps = plan.steps
+        self.context = context
+        if context.pending is None:
+            context.pending = list(range(len(self.steps)))
+        self.pending = context.pending
+        #: The positions of the steps that have finished.
+        self.finished = set(range(len(self.steps))).difference(self.pending)
+        self.started = set()
+        self.lowest = 0
+        self.successors = defaultdict(list)
+        self.remaining = {}
+        self.blocked = set()
+        self.waiting = defaultdict(list)
+        self.ready = []
+        dependencies = plan.dependencies
+        for position in self.pending:
+            remaining = 0
+            for other in dependencies[position]:
+                if other not in self.finished:
+                    self.successors[other].append(position)
+                    remaining += 1
+            self.remaining[position] = remaining
+        self._advance()
+        context.added = []
+        for position in self.pending:
+            if not self.remaining[position]:
+                self._unblock(position)
+
+    def _unblock(self, position):
+        # all of the steps the step depends on have finished:
+        type = Plan.missing(self.context, self.steps[position].periods)
+        if type is None or position == self.lowest:
+            heappush(self.ready, position)
+        else:
+            self.blocked.add(position)
+            self.waiting[type].append(position)
+
+    def _advance(self):
+        while self.lowest < len(self.steps) and self.lowest in self.finished:
+            self.lowest += 1
+        if self.lowest in self.blocked:
+            self.blocked.remove(self.lowest)
+            heappush(self.ready, self.lowest)
+
+    def _update(self):
+        added = self.context.added
+        while added:
+            for position in self.waiting.pop(added.pop(), ()):
+                if position in self.blocked:
+                    self.blocked.remove(position)
+                    self._unblock(position)
+
+    def __iter__(self):
+        """
+        Yield the positions of the steps that can be started, lowest
+        first, until there are none left. Each position yielded is
+        treated as having been started.
+        """
+        self._update()
+        while self.ready:
+            position = heappop(self.ready)
+            self.started.add(position)
+            yield position
+            # lazy providers may have added resources:
+            self._update()
+
+    def cancel(self, position):
+        "Record that the step at the supplied position was not called."
+        self.started.discard(position)
+
+    def finish(self, position):
+        """
+        Record that the step at the supplied position has finished.
+        The resources it returns should then be added to the context.
+        """
+        self.finished.add(position)
+        for other in self.successors.pop(position, ()):
+            self.remaining[other] -= 1
+            if not self.remaining[other]:
+                self._unblock(other)
+        self._advance()
+
+    def close(self):
+        """
+        Leave only the positions of the steps that have not been started
+        in :attr:`Context.pending`.
+        """
+        self.pending[:] = [position for position in self.pending
+                           if position not in self.started and
+                           position not in self.finished]
+        self.context.added = None
+
+class Plan(object):
+    """
+    The compiled form of a :class:`Runner`, consisting of a flat
+    sequence of :class:`Step` instances in the order in which they
+    should be called.
+    """
+
+    #: Whether this plan is a :class:`GeneratedPlan`.
+    generated = False
+
+    def __init__(self, runner):
+        steps = []
+        #: A mapping of types to the :class:`Step` for the :class:`lazy`
+        #: provider of each one.
+        self.providers = {}
+        for entry in runner:
+            step = Step(*entry, caches=runner.caches)
+            provider = getattr(step.obj, '__lazy__', None)
+            if provider is None:
+                steps.append(step)
+                continue
+            provides = provider.type
+            if provides is not_specified:
+                provides = step.returns
+            else:
+                # context managers returned are still entered:
+                step.provides = provides
+            if provides is not_specified and isinstance(step.obj, type):
+                provides = step.obj
+            if provides is not_specified:
+                raise TypeError(
+                    'No type specified for lazy provider %r' % step.obj
+                    )
+            self.providers[provides] = step
+        self.steps = tuple(steps)
+        self._dependencies = None
+        #: The :class:`PartialPlan` instances created from this plan,
+        #: keyed by the types they produce and the types available
+        #: when they start.
+        self.partials = {}
+        #: The :class:`Hook` instances to notify as steps are called.
+        self.hooks = tuple(runner.hooks)
+        #: Whether resources are removed from the context once the last
+        #: step using them has finished. See :attr:`Runner.release`.
+        self.releasing = runner.release
+        if self.releasing:
+            self._liveness()
+        #: Whether steps requiring the same type in the ``normal``
+        #: period are called in order. See :attr:`Runner.ordered`.
+        self.ordered = runner.ordered
+
+    @staticmethod
+    def products(step, produced):
+        """
+        Return the types the supplied :class:`Step` is known to produce,
+        or ``None`` if they are not known.
+
+        The types are known if the callable has had its return type
+        specified, if it is a class that is not a context manager or if
+        they have been learnt, as recorded in the supplied `produced`
+        mapping of callables to the types they added to the context.
+        """
+        if step.returns is not not_specified:
+            return (step.returns, )
+        learnt = produced.get(step.obj)
+        if learnt is not None:
+            return learnt
+        if isinstance(step.obj, type) and not hasattr(step.obj, '__enter__'):
+            return (step.obj, )
+
+    def needed(self, types, available, produced):
+        """
+        Return the positions of the steps needed to produce the supplied
+        types, given the types that are already available and the
+        mapping of learnt products described in :meth:`products`.
+
+        A step is needed if it produces a type that is needed, or if it
+        requires a needed type in the ``first`` period. A step whose
+        products are not known is needed if a type that is needed has
+        no known producer. Each type a needed step requires, including
+        those only required using :func:`after`, is then also needed, as
+        is each type required by the :class:`lazy` provider of a type
+        that is needed.
+        """
+        products = [self.products(step, produced) for step in self.steps]
+        known = set(self.providers)
+        for types_ in products:
+            if types_ is not None:
+                known.update(types_)
+        wanted = set()
+        def want(types):
+            for type in types:
+                if type is none_type or type in available or type in wanted:
+                    continue
+                wanted.add(type)
+                provider = self.providers.get(type)
+                if provider is not None:
+                    want(provider.periods)
+        want(types)
+        positions = []
+        for position in reversed(range(len(self.steps))):
+            step = self.steps[position]
+            types_ = products[position]
+            if types_ is None:
+                need = bool(wanted - known)
+            else:
+                need = bool(wanted.intersection(types_))
+            need = need or any(
+                type in wanted for type, period in step.periods.items()
+                if period == 'first'
+            )
+            if need:
+                positions.append(position)
+                want(step.periods)
+        positions.reverse()
+        return positions
+
+    def affected(self, types, products):
+        """
+        Return the positions of the steps that depend on the supplied
+        types, either directly or through the types produced by other
+        steps that depend on them.
+
+        `products` should contain, for each step, the types that it added
+        to the context when last called. Steps using a :class:`lazy`
+        provider that requires an affected type are also affected.
+        """
+        changed = set(types)
+        positions = []
+        for position, step in enumerate(self.steps):
+            if changed.isdisjoint(self.uses(step)):
+                continue
+            positions.append(position)
+            changed.update(products[position])
+        return positions
+
+    @property
+    def dependencies(self):
+        """
+        For each step, a tuple of the positions of the earlier steps
+        that must have finished before it can be called. Steps that
+        must have finished before those are not included.
+
+        A step depends on an earlier step when both require the same
+        type and at least one of them does not require it in the
+        ``normal`` period. This means that callables requiring a
+        resource in the ``first`` period are finished before those
+        using it normally start, and callables requiring it in the
+        ``last`` period, including those using :func:`after`, wait for
+        all of those.
+
+        Steps that both require a type in the ``normal`` period also
+        depend on each other unless :attr:`ordered` is false, in which
+        case they may be called at the same time.
+
+        Every step also depends on the last step before it that
+        :meth:`enters` a context manager, so that the manager is wrapped
+        around all the steps after it, as it would be if the steps were
+        called one at a time.
+        """
+        if self._dependencies is None:
+            dependencies = []
+            users = defaultdict(list)
+            manager = None
+            for position, step in enumerate(self.steps):
+                depends = set()
+                if manager is not None:
+                    depends.add(manager)
+                for type, period in step.periods.items():
+                    if self.ordered and type is not none_type:
+                        # each step using the type depends on the one
+                        # before it, so only that one is needed:
+                        if users[type]:
+                            depends.add(users[type][-1][0])
+                    else:
+                        for other, other_period in users[type]:
+                            if period != 'normal' or other_period != 'normal':
+                                depends.add(other)
+                    users[type].append((position, period))
+                dependencies.append(tuple(sorted(depends)))
+                if self.enters(step):
+                    manager = position
+            self._dependencies = tuple(dependencies)
+        return self._dependencies
+
+    @staticmethod
+    def enters(step):
+        """
+        Whether the supplied :class:`Step` is known to return a context
+        manager, either synchronous or asynchronous, that will be
+        entered. This is the case when the callable is such a context
+        manager class and no other return type has been specified.
+        """
+        obj = step.obj
+        return (step.returns is not_specified and isinstance(obj, type) and
+                (hasattr(obj, '__enter__') or hasattr(obj, '__aenter__')))
+
+    def uses(self, step):
+        """
+        Return the types used by the supplied :class:`Step`, including
+        those required by the :class:`lazy` providers of those types.
+        """
+        types = set()
+        stack = list(step.periods)
+        while stack:
+            type = stack.pop()
+            if type is none_type or type in types:
+                continue
+            types.add(type)
+            provider = self.providers.get(type)
+            if provider is not None:
+                stack.extend(provider.periods)
+        return types
+
+    def _liveness(self):
+        users = defaultdict(list)
+        for position, step in enumerate(self.steps):
+            for type in self.uses(step):
+                users[type].append(position)
+        #: A mapping of each type used by a step to the positions of
+        #: the steps that use it.
+        self.users = dict(users)
+        releases = [[] for _ in self.steps]
+        for type, positions in users.items():
+            releases[positions[-1]].append(type)
+        for position, step in enumerate(self.steps):
+            if step.returns is not not_specified and step.returns not in users:
+                releases[position].append(step.returns)
+        #: For each step, the types that can be released once it has
+        #: finished when the steps are called one at a time.
+        self.releases = tuple(tuple(types) for types in releases)
+
+    def release(self, context, types):
+        """
+        Remove the supplied types from the supplied :class:`Context`.
+        """
+        for type in types:
+            dict.pop(context, type, None)
+
+    @staticmethod
+    def exitable(context):
+        """
+        Remove and return the innermost context manager entered in the
+        supplied :class:`Context` if both it and the object returned
+        when it was entered have been released, otherwise return
+        ``None``.
+
+        Only the innermost manager can be exited early, so that context
+        managers are still exited in the reverse order to which they
+        were entered.
+        """
+        if context.managers:
+            manager = context.managers[-1]
+            obj = context.entered.get(id(manager))
+            if type_func(manager) in context or (
+                    obj is not None and type_func(obj) in context):
+                return None
+            del context.entered[id(manager)]
+            return context.managers.pop()
+
+    def release_after(self, context, position):
+        """
+        Release the types whose last use was by the step at the supplied
+        position, exiting any context managers that can now be exited.
+        """
+        self.release(context, self.releases[position])
+        manager = self.exitable(context)
+        while manager is not None:
+            context.exit(manager)
+            manager = self.exitable(context)
+
+    def call(self, step, context):
+        """
+        Call the supplied :class:`Step` using the supplied
+        :class:`Context`, notifying :attr:`hooks`.
+        """
+        call_step(step, context, self.hooks)
+
+    def execute(self, context):
+        "Call the steps remaining in the supplied :class:`Context`."
+        for step in context:
+            if self.hooks:
+                self.call(step, context)
+            else:
+                step(context)
+            if self.releasing:
+                self.release_after(context, context.index - 1)
+
+    def prepare(self, context):
+        """
+        Set up the supplied :class:`Context` to call this plan, unless
+        it has already been used to start calling a plan.
+        """
+        if not context.req_objs:
+            context.req_objs = self.steps
+            context.hooks = self.hooks
+            if self.providers:
+                context.providers = dict(self.providers)
+
+    def notify(self, context, step, future, call):
+        """
+        Notify :attr:`hooks` that the supplied future for the
+        :class:`Timed` call of the supplied :class:`Step` has finished.
+        """
+        exception = future.exception()
+        for hook in self.hooks:
+            if exception is None:
+                hook.after(context, step, future.result(), call)
+            else:
+                hook.error(context, step, exception, call)
+
+    def released(self, position, finished):
+        """
+        Return the types that can be released once the step at the
+        supplied position has finished, given the positions of all the
+        steps that have finished. This is used when steps may finish in
+        any order. See :meth:`dispatch`.
+        """
+        step = self.steps[position]
+        types = [type for type in self.uses(step)
+                 if finished.issuperset(self.users[type])]
+        if step.returns is not not_specified and step.returns not in self.users:
+            types.append(step.returns)
+        return types
+
+    def release_finished(self, context, position, finished):
+        """
+        Release the types returned by :meth:`released`, exiting any
+        context managers that can now be exited.
+        """
+        self.release(context, self.released(position, finished))
+        manager = self.exitable(context)
+        while manager is not None:
+            context.exit(manager)
+            manager = self.exitable(context)
+
+    @classmethod
+    def missing(cls, context, types):
+        """
+        Return one of the supplied types that is not in the supplied
+        :class:`Context` and cannot be provided by a :class:`lazy`
+        provider whose own requirements are available, or ``None`` if
+        all of them are available.
+        """
+        for type in types:
+            if type is none_type or type in context:
+                continue
+            provider = context.providers.get(type)
+            if provider is None:
+                return type
+            missing = cls.missing(context, provider.periods)
+            if missing is not None:
+                return missing
+        return None
+
+    def dispatch(self, context, executor):
+        """
+        Call the steps remaining in the supplied :class:`Context` using
+        the supplied executor, which should provide the
+        :class:`concurrent.futures.Executor` interface.
+
+        A step is submitted to the executor once all of the steps it
+        :attr:`depends <dependencies>` on have finished and all the
+        resources it requires are in the context. A step whose
+        resources are still missing once all the steps before it have
+        finished is submitted anyway, so that the error is the same as
+        if the steps were called one at a time.
+
+        Resources are obtained from, and results added to, the context
+        in the calling thread. If a callable raises an exception, no
+        further steps are submitted and, once the steps already
+        submitted have finished, the first exception is raised.
+        """
+        steps = self.steps
+        schedule = Schedule(self, context)
+        running = {}
+        timed = {}
+        completed = Queue()
+        exc_info = None
+
+        try:
+            while True:
+                if exc_info is None:
+                    for position in schedule:
+                        step = steps[position]
+                        try:
+                            args, kw = step.resolve(context)
+                            call = step.call
+                            if self.hooks:
+                                for hook in self.hooks:
+                                    hook.before(context, step, args, kw)
+                                call = timed[position] = Timed(call)
+                            future = executor.submit(call, *args, **kw)
+                        except BaseException:
+                            exc_info = sys.exc_info()
+                            for other in running:
+                                other.cancel()
+                            break
+                        running[future] = position
+                        future.add_done_callback(completed.put)
+
+                if not running:
+                    break
+
+                future = completed.get()
+                position = running.pop(future)
+                if future.cancelled():
+                    schedule.cancel(position)
+                    continue
+                schedule.finish(position)
+                try:
+                    if self.hooks:
+                        self.notify(context, steps[position], future,
+                                    timed.pop(position))
+                    steps[position].handle(context, future.result())
+                    if self.releasing:
+                        self.release_finished(context, position,
+                                              schedule.finished)
+                except BaseException:
+                    if exc_info is None:
+                        exc_info = sys.exc_info()
+                        for other in running:
+                            other.cancel()
+        finally:
+            schedule.close()
+
+        if exc_info is not None:
+            reraise(exc_info)
+        context.index = len(steps)
+
+    def __call__(self, context, executor=None):
+        """
+        Call the steps remaining in the supplied :class:`Context`,
+        using the executor if one is supplied. See :meth:`dispatch`.
+
+        Context managers returned by steps are entered as they are
+        returned and, once no steps remain, are exited in the reverse
+        order. If an exception is raised, each manager is exited with
+        it in turn until one suppresses it, at which point any steps
+        remaining are called before the rest of the managers are exited.
+        This is the same as if each manager had been used in a ``with``
+        statement wrapping the steps after it, but without needing a
+        Python stack frame for each one.
+        """
+        for hook in self.hooks:
+            hook.start(context)
+        managers = context.managers
+        exc_info = None
+        while True:
+            if exc_info is None:
+                try:
+                    if executor is None:
+                        self.execute(context)
+                    else:
+                        self.dispatch(context, executor)
+                except BaseException:
+                    exc_info = sys.exc_info()
+            if not managers:
+                break
+            manager = managers.pop()
+            try:
+                if exc_info is None:
+                    context.exit(manager)
+                elif context.exit(manager, exc_info):
+                    exc_info = None
+            except BaseException:
+                previous, exc_info = exc_info, sys.exc_info()
+                if previous is not None and exc_info[1] is not previous[1]:
+                    exc_info[1].__context__ = previous[1]
+        for hook in self.hooks:
+            hook.finish(context, None if exc_info is None else exc_info[1])
+        if exc_info is not None:
+            reraise(exc_info)
+
+identifier = re.compile(r'[A-Za-z_][A-Za-z0-9_]*\Z')
+
+def is_identifier(name):
+    "Return ``True`` if `name` can be used literally in generated source."
+    return bool(isinstance(name, str) and
+                identifier.match(name) and
+                not iskeyword(name))
+
+def call_without_nothing(obj, args, kw):
+    """
+    Call `obj` with the supplied positional `args` and ``(name, value)``
+    pairs in `kw`, leaving out any that are :obj:`nothing`.
+    """
+    return obj(*[a for a in args if a is not nothing],
+               **dict((k, v) for k, v in kw if v is not nothing))
+
+plan_ids = count()
+
+#: Weak references to each :class:`GeneratedPlan` whose source is in
+#: :mod:`linecache`, keyed by the filename used for that source.
+plan_sources = {}
+
+def forget_source(filename, reference=None):
+    "Remove the source of a :class:`GeneratedPlan` from :mod:`linecache`."
+    linecache.cache.pop(filename, None)
+    plan_sources.pop(filename, None)
+
+class GeneratedPlan(Plan):
+    """
+    A :class:`Plan` that generates the source of a single, straight-line
+    function that calls each of its steps in turn.
+
+    Resources are looked up into local variables, :class:`attr` and
+    :class:`item` operations are done inline and the special return
+    types are handled by branching directly in the generated code.
+    The generated source can be found in the :attr:`source` attribute
+    and will be shown in tracebacks.
+    """
+
+    generated = True
+
+    def __init__(self, runner):
+        super(GeneratedPlan, self).__init__(runner)
+        namespace = dict(
+            nothing=nothing,
+            call_without_nothing=call_without_nothing,
+            )
+        lines = ['def run(context, start):',
+                 '    get = context.get',
+                 '    add = context.add',
+                 '    enter = context.enter']
+        if self.releasing:
+            namespace['release_after'] = self.release_after
+        for index, step in enumerate(self.steps):
+            lines.extend(self._step_source(index, step, namespace))
+            if self.releasing and self.releases[index]:
+                lines.append('        release_after(context, %i)' % index)
+        lines.append('    return')
+
+        #: The source of the generated function.
+        self.source = '\n'.join(lines) + '\n'
+        filename = '<mush plan %i>' % next(plan_ids)
+        exec(compile(self.source, filename, 'exec'), namespace)
+        linecache.cache[filename] = (
+            len(self.source), None, self.source.splitlines(True), filename
+            )
+        # so that the source is only kept while the plan can be used:
+        plan_sources[filename] = ref(self, partial(forget_source, filename))
+        self.function = namespace['run']
+
+    @staticmethod
+    def _step_source(index, step, namespace):
+        def name(prefix, obj):
+            key = '%s%i_%i' % (prefix, index, len(namespace))
+            namespace[key] = obj
+            return key
+
+        obj = name('obj', step.obj)
+        lines = [
+            'if start <= %i:' % index,
+            '    context.index = %i' % (index + 1),
+            ]
+        args = []
+        kw = []
+        for source, (keyword, type, ops) in enumerate(step.sources):
+            var = 'a%i' % source
+            lines.extend((
+                '    try:',
+                '        %s = get(%s)' % (var, name('type', type)),
+                '    except KeyError as e:',
+                "        raise KeyError('%%s attempting to call %%r' %% "
+                "(e, %s))" % obj,
+                ))
+            expr = var
+            for op in ops:
+                how_ = getattr(op, '__self__', None)
+                if isinstance(how_, attr) and type_func(how_).op == attr.op:
+                    for n in how_.names:
+                        if is_identifier(n):
+                            expr += '.' + n
+                        else:
+                            expr = 'getattr(%s, %s)' % (expr, name('name', n))
+                elif isinstance(how_, item) and type_func(how_).op == item.op:
+                    for n in how_.names:
+                        expr += '[%s]' % name('name', n)
+                elif op == ignore.op:
+                    if expr != var:
+                        lines.append('    ' + expr)
+                    expr = 'nothing'
+                else:
+                    expr = '%s(%s)' % (name('op', op), expr)
+            if expr == 'nothing':
+                continue
+            if expr != var:
+                lines.append('    %s = %s' % (var, expr))
+            if keyword is None:
+                args.append(var)
+            else:
+                kw.append((keyword, var))
+
+        target = name('call', step.call)
+        if args or kw:
+            parts = list(args)
+            extra = []
+            for keyword, var in kw:
+                if is_identifier(keyword):
+                    parts.append('%s=%s' % (keyword, var))
+                else:
+                    extra.append('%s: %s' % (name('name', keyword), var))
+            if extra:
+                parts.append('**{%s}' % ', '.join(extra))
+            lines.extend((
+                '    if %s:' % ' or '.join(
+                    '%s is nothing' % var for var in args + [v for _, v in kw]
+                    ),
+                '        result = call_without_nothing(%s, (%s), (%s))' % (
+                    target,
+                    ''.join(var + ', ' for var in args),
+                    ''.join('(%s, %s), ' % (name('name', k), v)
+                            for k, v in kw),
+                    ),
+                '    else:',
+                '        result = %s(%s)' % (target, ', '.join(parts)),
+                ))
+        else:
+            lines.append('    result = %s()' % target)
+
+        if step.returns is not not_specified:
+            lines.append('    add(result, %s)' % name('returns', step.returns))
+        else:
+            lines.extend((
+                '    if result is not None:',
+                '        kind = result.__class__',
+                '        if kind is tuple or kind is list:',
+                '            for o in result:',
+                '                add(o)',
+                '        elif kind is dict:',
+                '            for t, o in result.items():',
+                '                add(o, t)',
+                "        elif getattr(result, '__enter__', None):",
+                '            enter(result)',
+                '        else:',
+                '            add(result)',
+                ))
+        return ['    ' + line for line in lines]
+
+    def execute(self, context):
+        self.function(context, context.index)
+
+class PartialPlan(Plan):
+    """
+    A :class:`Plan` containing only the steps of another plan that are
+    needed to produce some types. See :meth:`Runner.run_for`.
+
+    While called one at a time, the types added to the context by each
+    step whose products are not known are recorded in the supplied
+    `produced` mapping, so that plans created later can leave out
+    those steps when they are not needed.
+    """
+
+    def __init__(self, plan, positions, produced):
+        self.steps = tuple(plan.steps[position] for position in positions)
+        self._dependencies = None
+        self.providers = plan.providers
+        self.partials = plan.partials
+        self.hooks = plan.hooks
+        self.ordered = plan.ordered
+        # the resources asked for are returned, so must be kept:
+        self.releasing = False
+        self.produced = produced
+        self.learning = frozenset(
+            step.obj for step in self.steps
+            if self.products(step, produced) is None
+        )
+
+    def execute(self, context):
+        for step in context:
+            learning = step.obj in self.learning
+            if learning:
+                before = set(context.keys())
+            if self.hooks:
+                self.call(step, context)
+            else:
+                step(context)
+            if not learning:
+                continue
+            # resources from lazy providers are not produced by the step:
+            self.produced[step.obj] = tuple(
+                type for type in set(context.keys()) - before
+                if type not in self.providers
+            )
+            # plans created from now on can use what has been learnt:
+            self.partials.clear()
+
+class ResumedPlan(Plan):
+    """
+    A :class:`Plan` that continues calling the steps of another plan
+    from where a :class:`~mush.checkpoints.Checkpoint` was taken. See
+    :meth:`Runner.resume`.
+
+    Before the remaining steps are called, the steps at the supplied
+    `managers` positions are called again so that the context managers
+    they returned, which wrapped the remaining steps when the
+    checkpoint was taken, are entered once more.
+    """
+
+    def __init__(self, plan, index, managers):
+        self.steps = plan.steps
+        self._dependencies = plan._dependencies
+        self.providers = plan.providers
+        self.partials = plan.partials
+        self.hooks = plan.hooks
+        self.ordered = plan.ordered
+        self.releasing = plan.releasing
+        if self.releasing:
+            self.users = plan.users
+            self.releases = plan.releases
+        #: The number of steps that had been called when the checkpoint
+        #: was taken.
+        self.index = index
+        self.managers = tuple(managers)
+
+    def reenter(self, context):
+        """
+        Call the steps that returned context managers, unless this has
+        already been done for the supplied :class:`Context`.
+        """
+        if context.index >= self.index:
+            return
+        try:
+            for position in self.managers:
+                # so that hooks see the position of the step being called:
+                context.index = position + 1
+                step = self.steps[position]
+                if self.hooks:
+                    self.call(step, context)
+                else:
+                    step(context)
+        finally:
+            context.index = self.index
+
+    def execute(self, context):
+        self.reenter(context)
+        Plan.execute(self, context)
+
+    def dispatch(self, context, executor):
+        if context.pending is None:
+            self.reenter(context)
+            context.pending = list(range(self.index, len(self.steps)))
+        Plan.dispatch(self, context, executor)
+
+class Session(object):
+    """
+    A call of a :class:`Runner` that is kept alive once all of its
+    callables have been called, so that when a resource it was seeded
+    with changes, only the callables that depend on that resource need
+    to be called again. See :meth:`Runner.session`.
+
+    Callables are called one at a time and resources are never
+    released. Context managers returned by callables stay entered until
+    the session is closed, unless the callable that returned them is
+    called again, in which case the old manager is exited first.
+
+    If a callable raises an exception when called again, it and the
+    callables that were still to be called are called again by the
+    next :meth:`refresh`, along with any that depend on the types
+    passed to it.
+    """
+
+    def __init__(self, runner, context=None):
+        self.plan = runner.compile()
+        if context is None:
+            context = Context()
+        #: The :class:`Context` holding the resources of this session.
+        self.context = context
+        self.plan.prepare(context)
+        #: For each step, the types it added to the context and the
+        #: context managers it entered when it was last called.
+        self.products = [() for _ in self.plan.steps]
+        self.managers = [() for _ in self.plan.steps]
+        #: The positions of the steps that still need to be called
+        #: because an exception was raised when calling them again.
+        self.dirty = set()
+        self.closed = False
+        for hook in self.plan.hooks:
+            hook.start(context)
+        try:
+            self._call(range(len(self.plan.steps)))
+        except BaseException:
+            self.close(sys.exc_info())
+            raise
+
+    def _call(self, positions):
+        context = self.context
+        hooks = self.plan.hooks
+        positions = list(positions)
+        for index, position in enumerate(positions):
+            step = self.plan.steps[position]
+            before = set(context.keys())
+            entered = len(context.managers)
+            try:
+                if hooks:
+                    self.plan.call(step, context)
+                else:
+                    step(context)
+            except BaseException:
+                # this step and those not yet called are called by the
+                # next refresh(), which also removes what this one added:
+                self.dirty = set(positions[index:])
+                self.products[position] = tuple(
+                    set(self.products[position]).union(
+                        self._added(before)
+                    ))
+                raise
+            else:
+                self.products[position] = self._added(before)
+            finally:
+                self.managers[position] = tuple(context.managers[entered:])
+        self.dirty = set()
+        context.index = len(self.plan.steps)
+
+    def _added(self, before):
+        "Return the types added to the context since it held `before`."
+        # resources from lazy providers are handled in refresh():
+        return tuple(
+            type for type in set(self.context.keys()) - before
+            if type not in self.plan.providers
+        )
+
+    def update(self, obj, type=None):
+        """
+        Replace the resource of the supplied type, or the type of the
+        supplied object if no type is passed, and call again the
+        callables that depend on it. See :meth:`refresh`.
+        """
+        type = type or type_func(obj)
+        dict.pop(self.context, type, None)
+        self.context.add(obj, type)
+        return self.refresh(type)
+
+    def refresh(self, *types):
+        """
+        Call again the callables that depend on the supplied types, along
+        with those that depend on what those callables produce, and
+        return how many were called.
+
+        The resources produced by those callables are removed from the
+        context first, and any context managers they returned are
+        exited, innermost first. Everything else is left untouched.
+        """
+        if self.closed:
+            raise RuntimeError('Session has been closed')
+        plan = self.plan
+        context = self.context
+        positions = plan.affected(types, self.products)
+        if self.dirty:
+            positions = sorted(self.dirty.union(positions))
+        changed = set(types)
+        for position in positions:
+            changed.update(self.products[position])
+
+        stale = set()
+        for position in positions:
+            stale.update(id(manager) for manager in self.managers[position])
+        for manager in reversed(context.managers[:]):
+            if id(manager) in stale:
+                context.managers.remove(manager)
+                del context.entered[id(manager)]
+                context.exit(manager)
+
+        for position in positions:
+            for type in self.products[position]:
+                dict.pop(context, type, None)
+        for type, provider in plan.providers.items():
+            if not changed.isdisjoint(plan.uses(provider)):
+                dict.pop(context, type, None)
+                context.providers[type] = provider
+
+        self._call(positions)
+        return len(positions)
+
+    def close(self, exc_info=(None, None, None)):
+        """
+        Exit the context managers that are still entered, innermost
+        first, and notify any :class:`Hook` instances that the session
+        has finished.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        context = self.context
+        while context.managers:
+            manager = context.managers.pop()
+            del context.entered[id(manager)]
+            try:
+                if exc_info[0] is None:
+                    context.exit(manager)
+                elif context.exit(manager, exc_info):
+                    exc_info = (None, None, None)
+            except BaseException:
+                previous, exc_info = exc_info, sys.exc_info()
+                if previous[1] is not None and exc_info[1] is not previous[1]:
+                    exc_info[1].__context__ = previous[1]
+        for hook in self.plan.hooks:
+            hook.finish(context, exc_info[1])
+        if exc_info[0] is not None:
+            reraise(exc_info)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, obj, tb):
+        # close() re-raises the exception unless a manager suppressed it:
+        self.close((type, obj, tb))
+        return True
+
 class Runner(object):
     """
     Used to run callables in the order in which they require
@@ -294,39 +1916,247 @@ class Runner(object):
 
     :param objs: The callables to add to the runner as it is created.
     :param debug:
-       If passed, debug information will be written whenever an object
-       is added to the runner. If ``True``, it will be written to
-       :obj:`~sys.stderr`. A file-like object can also be passed, in
-       which case the information will be written to that object.
+       If passed, where each callable is placed will be logged whenever
+       one is added to the runner. If ``True``, this is logged to the
+       ``mush`` :class:`~logging.Logger` at ``DEBUG`` level. Another
+       :class:`~logging.Logger` can also be passed, or a file-like
+       object, in which case the information will be written to that
+       object. See :meth:`explain` for the full call order.
     """
     
+    #: Whether the :class:`Plan` for this runner should be generated
+    #: as Python source. Generating and compiling the source is slow, so
+    #: this is only worth doing for runners that are called many times
+    #: without being changed or cloned. See ``benchmarks/``.
+    generate = False
+
+    #: Whether each resource should be removed from the context once the
+    #: last callable requiring it has finished, so that it can be
+    #: garbage collected. Context managers are also exited early once
+    #: they, and the objects they returned when entered, have been
+    #: removed, provided they are the innermost context manager.
+    release = False
+
+    #: Whether callables requiring the same resource in the ``normal``
+    #: period should still be called one after another, in the order in
+    #: which they were added, when an executor is used. This can be
+    #: turned off for runners whose callables only read the resources
+    #: they share, so that those callables can be called at the same time.
+    #: Clones keep this setting, while runners added together or
+    #: extended with other runners are only ordered if all of them are.
+    ordered = True
+
     def __init__(self, *objs, **debug):
         self.debug = debug.pop('debug', False)
         self.types = [none_type]
+        #: A mapping of each type in :attr:`types` to its position
+        #: in that list.
+        self.type_index = {none_type: 0}
         self.callables = defaultdict(Periods)
+        #: A mapping of callables with a ``runner`` :class:`scope` to
+        #: the :class:`Cache` of their results.
+        self.caches = {}
+        #: The :class:`Hook` instances to notify when this runner is
+        #: called. When there are none, nothing is done that would slow
+        #: down calling the runner.
+        self.hooks = []
+        #: A mapping of callables to the types they were found to add
+        #: to the context when called by :meth:`run_for`.
+        self.produced = {}
+        self._plan = None
+        # Runners share their types and periods when cloned or added
+        # together, and only copy them when they are changed:
+        self._shared = False
+        self._owned = None
+        # A mapping of the id of each callable to where it is in the
+        # periods, built when first needed by replace():
+        self._locations = None
         self.extend(*objs)
 
-    def _debug(self, message, *args):
-        if getattr(self.debug, 'write', None):
-            debug = self.debug
+    def _added(self, obj, period_name, order_type, clean):
+        "Log where a callable has been placed."
+        message = 'Added %r to %r period for %r with %r'
+        args = obj, period_name, order_type, clean
+        debug = self.debug
+        if getattr(debug, 'write', None):
+            debug.write(message % args + '\n')
         else:
-            debug = sys.stderr
-        debug.write(message % args + '\n')
+            log = debug if isinstance(debug, Logger) else logger
+            log.debug(message, *args, extra=dict(
+                callable=obj, period=period_name, type=order_type,
+                requirements=clean
+            ))
 
-    def _merge(self, other):
-        self.types = list(other.types)
+    def explain(self):
+        """
+        Return a description of the order in which the callables in
+        this runner will be called, listing them under the type and
+        period that determine when each one is called.
+        """
+        lines = []
+        for key in self.types:
+            lines.append('For %r:' % (key, ))
+            periods = self.callables.get(key, Periods())
+            for period in 'first', 'normal', 'last':
+                for req, _, obj in getattr(periods, period):
+                    lines.append('%8s: %r requires %r' % (period, obj, req))
+        return '\n'.join(lines)
+
+    def _register(self, type):
+        """
+        Return the position of the supplied type in the order of types
+        used by this runner, adding it to the end of that order if it
+        is not yet present.
+        """
+        position = self.type_index.get(type)
+        if position is None:
+            self._own()
+            position = self.type_index[type] = len(self.types)
+            self.types.append(type)
+        return position
+
+    def _own(self):
+        """
+        Copy the order of types and mapping of types to periods if they
+        are shared with another runner, so that they can be changed.
+        The periods themselves are only copied by :meth:`_periods`.
+        """
+        if self._shared:
+            self.types = list(self.types)
+            self.type_index = dict(self.type_index)
+            self.callables = defaultdict(Periods, self.callables)
+            self._shared = False
+
+    def _disown(self, type):
+        "Note that the periods for the supplied type are now shared."
+        if self._owned is None:
+            self._owned = set(self.callables)
+        self._owned.discard(type)
+
+    def _periods(self, type):
+        """
+        Return the :class:`Periods` for the supplied type, copying them
+        first if they are shared with another runner.
+        """
+        self._own()
+        periods = self.callables[type]
+        if self._owned is not None and type not in self._owned:
+            periods = self.callables[type] = periods.copy()
+            self._owned.add(type)
+        return periods
+
+    def _share(self, other):
+        "Share the types and periods of another runner with this one."
+        self.types = other.types
+        self.type_index = other.type_index
+        self.callables = other.callables
+        self._shared = other._shared = True
+        self._owned = set()
+        other._owned = set()
+        self._locations = None
+
+    def _splice(self, other):
+        """
+        Add the types and callables of another runner to the end of
+        those in this runner, using the periods they are already in.
+        """
+        self._locations = None
+        if len(self.types) == 1 and not self.callables:
+            self._share(other)
+            return
+        for type in other.types:
+            self._register(type)
         for type, source in other.callables.items():
-            target = self.callables[type]
-            for name, contents in vars(source).items():
-                getattr(target, name).extend(contents)
+            if type in self.callables:
+                target = self._periods(type)
+                target.first.extend(source.first)
+                target.normal.extend(source.normal)
+                target.last.extend(source.last)
+            else:
+                self._own()
+                self.callables[type] = source
+                self._disown(type)
+                other._disown(type)
+
+    def _splicable(self, other):
+        """
+        Return whether the callables of another runner would end up in
+        the same periods, in the same order, and with the types in the
+        same order, if they were added to this runner one by one.
+        This is worked out by locating each callable, as
+        :meth:`add_returning` would, without changing this runner.
+        """
+        type_index = self.type_index
+        added = {}
+        for order_type in other.types:
+            periods = other.callables.get(order_type)
+            if periods is None:
+                continue
+            for period in 'first', 'normal', 'last':
+                for _, requirements, _ in getattr(periods, period):
+                    period_name = 'normal'
+                    position = 0
+                    for _, type in requirements:
+                        req_period = 'normal'
+                        while isinstance(type, (when, how)):
+                            if isinstance(type, when):
+                                req_period = type.__class__.__name__
+                            type = type.type
+                        req_position = type_index.get(type)
+                        if req_position is None:
+                            req_position = added.get(type)
+                        if req_position is None:
+                            req_position = added[type] = (
+                                len(type_index) + len(added)
+                            )
+                        if req_position >= position:
+                            period_name = req_period
+                            position = req_position
+                    expected = type_index.get(order_type)
+                    if expected is None:
+                        expected = added.get(order_type)
+                    if position != expected or period_name != period:
+                        return False
+        return list(added) == [
+            type for type in other.types if type not in type_index
+        ]
+
+    def _merge(self, other):
+        self._splice(other)
+        for hook in other.hooks:
+            if hook not in self.hooks:
+                self.hooks.append(hook)
         self.debug = self.debug or other.debug
-        
+        self.generate = self.generate or other.generate
+        self.release = self.release or other.release
+        # only callables that can overlap in both runners may do so:
+        self.ordered = self.ordered and other.ordered
+        self._plan = None
+
     def clone(self):
-        "Return a copy of this runner."
-        c = Runner()
+        """
+        Return a copy of this runner.
+
+        The copy shares its contents with this runner until either of
+        them is changed, so cloning is quick however large the runner.
+        """
+        c = self.__class__()
         c._merge(self)
         return c
 
+    @classmethod
+    def concat(cls, *runners):
+        """
+        Return a new runner containing the callables from all the
+        supplied runners, in the same order as adding them together
+        with ``+`` would give, but without creating all the runners in
+        between.
+        """
+        runner = cls()
+        for other in runners:
+            runner._merge(other)
+        return runner
+
     def __add__(self, other):
         """
         Concatenate two runners, returning a new runner.
@@ -336,24 +2166,22 @@ class Runner(object):
         and then in order from the runner on the right-hand side of
         the expression.
         """
-        runner = Runner()
+        runner = self.__class__()
         for r in self, other:
             runner._merge(r)
         return runner
 
-    def add_returning(self, obj, returns, *args, **kw):
+    @staticmethod
+    def _prepare(obj, returns, args, kw):
         """
-        Add a callable to the runner and specify that it should
-        be treated as returning the type specified in ``returns``,
-        regardless of the actual type returned by calling ``obj``.
+        Work out the requirements of a callable being added.
 
-        If either ``args`` or ``kw`` are specified, they will be used
-        to create the :class:`Requirements` in this runner for the
-        callable added in favour of any decoration done with
-        :class:`requires`.
+        This returns the clean and original requirements along with a
+        sequence of ``(type, period_name)`` tuples, one for each
+        requirement, which are used to place the callable.
         """
         if args or kw:
-            requirements = Requirements(*args, **kw)
+            requirements = _intern(args, kw)
         else:
             requirements = getattr(obj, '__requires__', nothing)
 
@@ -362,9 +2190,8 @@ class Runner(object):
 
         clean_args = []
         clean_kw = {}
+        order = []
 
-        period_name = 'normal'
-        type_index = 0
         for name, wrapped_type in requirements:
             req_period = 'normal'
             type = wrapped_type
@@ -372,15 +2199,9 @@ class Runner(object):
                 if isinstance(type, when):
                     req_period = type.__class__.__name__
                 type = type.type
-                
-            if type not in self.types:
-                self.types.append(type)
 
-            req_type_index = self.types.index(type)
-            if req_type_index >= type_index:
-                period_name = req_period
-                type_index = req_type_index
-                
+            order.append((type, req_period))
+
             if type is none_type:
                 continue
                 
@@ -389,26 +2210,60 @@ class Runner(object):
             else:
                 clean_kw[name]=wrapped_type
 
-        order_type = self.types[type_index]
-        period = getattr(self.callables[order_type], period_name)
+        clean = _intern(tuple(clean_args), clean_kw, returns)
+        return clean, requirements, order
 
-        clean = Requirements(*clean_args, **clean_kw)
-        clean.returns = returns
+    def _locate(self, order):
+        """
+        Return the position, in the order of types used by this runner,
+        of the type a prepared callable should be placed under, along
+        with the name of the period it belongs in. All the types in the
+        supplied `order` must already be registered.
+        """
+        type_index = self.type_index
+        period_name = 'normal'
+        position = 0
+        for type, req_period in order:
+            req_position = type_index[type]
+            if req_position >= position:
+                period_name = req_period
+                position = req_position
+        return position, period_name
 
+    def _place(self, clean, requirements, obj, position, period_name):
+        """
+        Add a prepared callable to the named period of the type at the
+        supplied position, returning that type.
+        """
+        order_type = self.types[position]
+        period = getattr(self._periods(order_type), period_name)
         period.append((clean, requirements, obj))
+        if self._locations is not None:
+            self._locations[id(obj)].append(
+                (order_type, period_name, len(period) - 1)
+            )
+        return order_type
+
+    def add_returning(self, obj, returns, *args, **kw):
+        """
+        Add a callable to the runner and specify that it should
+        be treated as returning the type specified in ``returns``,
+        regardless of the actual type returned by calling ``obj``.
+
+        If either ``args`` or ``kw`` are specified, they will be used
+        to create the :class:`Requirements` in this runner for the
+        callable added in favour of any decoration done with
+        :class:`requires`.
+        """
+        clean, requirements, order = self._prepare(obj, returns, args, kw)
+        for type, _ in order:
+            self._register(type)
+        position, period_name = self._locate(order)
+        order_type = self._place(clean, requirements, obj,
+                                 position, period_name)
+        self._plan = None
         if self.debug:
-            self._debug('Added %r to %r period for %r with %r',
-                        obj, period_name, order_type, clean)
-            self._debug('Current call order:')
-            for key in self.types:
-                self._debug('For %r:', key)
-                periods = self.callables[key]
-                for period in 'first', 'normal', 'last':
-                    callables = getattr(periods, period)
-                    for req, _, obj in callables:
-                        self._debug('%8s: %r requires %r',
-                                    period, obj, req)
-            self._debug('')
+            self._added(obj, period_name, order_type, clean)
 
     def add(self, obj, *args, **kw):
         """
@@ -422,9 +2277,12 @@ class Runner(object):
         return self.add_returning(obj, not_specified, *args, **kw)
 
     def __iter__(self):
+        callables = self.callables
         for key in self.types:
-            for req_obj in self.callables[key]:
-                yield req_obj
+            periods = callables.get(key)
+            if periods is not None:
+                for req_obj in periods:
+                    yield req_obj
         
     def extend(self, *objs):
         """
@@ -435,25 +2293,126 @@ class Runner(object):
         """
         for obj in objs:
             if isinstance(obj, Runner):
-                for _, reqs, o in obj:
-                    self.add(o, *reqs.args, **reqs.kw)
+                self.ordered = self.ordered and obj.ordered
+                if self.debug or not self._splicable(obj):
+                    for clean, reqs, o in obj:
+                        self.add_returning(o, clean.returns,
+                                           *reqs.args, **reqs.kw)
+                else:
+                    self._splice(obj)
+                    self._plan = None
             else:
                 self.add(obj)
 
+    def _where(self):
+        """
+        Return a mapping of the :func:`id` of each callable in this
+        runner to a list of ``(type, period_name, index)`` tuples giving
+        where it is in the periods, building it if needed.
+        """
+        locations = self._locations
+        if locations is None:
+            locations = self._locations = defaultdict(list)
+            for type, periods in self.callables.items():
+                for name in 'first', 'normal', 'last':
+                    for i, (_, _, obj) in enumerate(getattr(periods, name)):
+                        locations[id(obj)].append((type, name, i))
+        return locations
+
+    def _replace(self, replacements):
+        locations = self._where()
+        found = [(locations.pop(id(original), None), replacement)
+                 for original, replacement in replacements]
+        for where, replacement in found:
+            if not where:
+                continue
+            for type, name, i in where:
+                period = getattr(self._periods(type), name)
+                clean, req, _ = period[i]
+                period[i] = (clean, req, replacement)
+            locations[id(replacement)].extend(where)
+        self._plan = None
+
     def replace(self, original, replacement):
         """
         Replace all instances of one callable with another.
 
         No changes in requirements or call ordering will be made.
         """
-        for period in self.callables.values():
-            for l in period.first, period.normal, period.last:
-                for i, req_obj in enumerate(l):
-                    clean, req, obj = req_obj
-                    if obj is original:
-                        l[i] = (clean, req, replacement)
-    
-    def __call__(self, context=None):
+        self._replace([(original, replacement)])
+
+    def replace_many(self, replacements):
+        """
+        Replace all instances of several callables in one go.
+
+        :param replacements:
+          A mapping of the callables to replace to their replacements.
+          All the replacements are made at the same time, so callables
+          can be swapped with each other.
+
+        No changes in requirements or call ordering will be made.
+        """
+        self._replace(replacements.items())
+
+    def _caches(self, objs):
+        """
+        Yield the supplied callables, or all the callables in this
+        runner if none are supplied, whose results are kept along with
+        the :class:`Cache` for them.
+        """
+        for obj in objs or [obj for _, _, obj in self]:
+            scope = getattr(obj, '__scope__', None)
+            if scope is not None:
+                cache = scope.cache_for(obj, self.caches)
+                if cache is not None:
+                    yield obj, cache
+
+    def cache_info(self):
+        """
+        Return a mapping of each callable in this runner whose results
+        are kept, because of its :class:`scope`, to the
+        :class:`CacheInfo` for those results.
+        """
+        return dict((obj, cache.info()) for obj, cache in self._caches(()))
+
+    def invalidate(self, *objs):
+        """
+        Discard the results kept for the supplied callables, or for all
+        the callables in this runner if none are supplied, so that they
+        are called again the next time they are needed.
+        """
+        for _, cache in self._caches(objs):
+            cache.clear()
+
+    def compile(self):
+        """
+        Return the :class:`Plan` used to call this runner.
+
+        The plan is created the first time it is needed and is then
+        re-used for every subsequent call until the runner is changed
+        by adding or replacing callables.
+
+        By default, the steps of a :class:`Plan` are called one after
+        another. If :attr:`generate` is true, a :class:`GeneratedPlan`
+        will be used instead, which costs more to create but may be
+        quicker to call for small runners that are called many times.
+        A :class:`Plan` is always used if there are any
+        :attr:`hooks`. A new plan is created if :attr:`release`,
+        :attr:`ordered` or :attr:`hooks` have been changed.
+        """
+        generate = self.generate and not self.hooks
+        if (self._plan is None or
+                self._plan.generated != generate or
+                self._plan.releasing != self.release or
+                self._plan.ordered != self.ordered or
+                self._plan.hooks != tuple(self.hooks)):
+            if generate:
+                self._plan = GeneratedPlan(self)
+            else:
+                self._plan = Plan(self)
+        return self._plan
+
+    def __call__(self, context=None, executor=None):
         """
         Execute the callables in this runner in the required order
         storing objects that are returned and providing them as
@@ -462,60 +2421,180 @@ class Runner(object):
         A runner may be called multiple times. Each time a new
         :class:`Context` will be created meaning that no required
         objects are kept between calls and all callables will be
-        called each time.
+        called each time, unless they have a :class:`scope`.
         
         :param context:
-          Used for passing a context when context managers are used.
-          You should never need to pass this parameter.
+          The :class:`Context` to use for this call. A new context,
+          containing resources that should be available to the
+          callables from the start, can be passed to seed the call.
+
+        :param executor:
+          An optional :class:`concurrent.futures.Executor`, such as a
+          :class:`~concurrent.futures.ThreadPoolExecutor`. If passed,
+          callables that do not depend on each other will be submitted
+          to it so that they can be called concurrently.
+          See :meth:`Plan.dispatch`.
         """
+        plan = self.compile()
         if context is None:
             context = Context()
-            for req, _, obj in self:
-                context.req_objs.append((req, obj))
-            
-        for requirements, obj in context:
+        plan.prepare(context)
+        plan(context, executor)
+
+    def compile_for(self, types, available=()):
+        """
+        Return the :class:`PartialPlan` used to produce the supplied
+        types when the types in `available` are already in the context.
 
-            args = []
-            kw = {}
-            for name, type in requirements:
+        The partial plan is created the first time it is needed and is
+        then re-used until the runner is changed or more is learnt about
+        the types its callables produce.
+        """
+        plan = self.compile()
+        key = frozenset(types), frozenset(available)
+        partial = plan.partials.get(key)
+        if partial is None:
+            positions = plan.needed(types, available, self.produced)
+            partial = plan.partials[key] = PartialPlan(
+                plan, positions, self.produced
+                )
+        return partial
+
+    def session(self, context=None):
+        """
+        Call the callables in this runner and return a :class:`Session`
+        that keeps the resulting resources, so that callables depending
+        on a resource can be called again when it changes by using
+        :meth:`Session.update`.
 
-                ops = deque()
-                while isinstance(type, (when, how)):
-                    if isinstance(type, how):
-                        ops.appendleft(type.op)
-                    type = type.type
+        The session should be closed with :meth:`Session.close`, or
+        used as a context manager, so that the context managers
+        returned by callables are exited.
 
-                try:
-                    o = context.get(type)
-                except KeyError as e:
-                    raise KeyError('%s attempting to call %r' % (e, obj))
+        :param context:
+          An optional :class:`Context` to seed the session with.
+          See :meth:`__call__`.
+        """
+        return Session(self, context)
 
-                for op in ops:
-                    o = op(o)
+    def resume(self, checkpoint, executor=None):
+        """
+        Continue a call of this runner from the supplied
+        :class:`~mush.checkpoints.Checkpoint`, taken by a
+        :class:`~mush.checkpoints.Checkpointer` during an earlier call
+        that failed.
+
+        The resources kept in the checkpoint are added to a new
+        :class:`Context`, the callables whose context managers were
+        entered when the checkpoint was taken are called again, and then
+        the callables that had not been called are called in turn.
+
+        :param executor:
+          An optional executor. See :meth:`__call__`.
+        """
+        plan = self.compile()
+        if checkpoint.steps != len(plan.steps):
+            raise ValueError(
+                'Checkpoint is for a runner with %i callables, not %i' % (
+                    checkpoint.steps, len(plan.steps)
+                ))
+        context = Context()
+        for type, obj in checkpoint.resources().items():
+            context.add(obj, type)
+        plan = ResumedPlan(plan, checkpoint.index, checkpoint.managers)
+        plan.prepare(context)
+        plan(context, executor)
+
+    def run_for(self, *types, **kw):
+        """
+        Call only the callables in this runner that are needed to
+        produce the supplied types and return the resources produced.
+        If one type is passed, its resource is returned, otherwise a
+        tuple of the resources is returned in the order the types were
+        passed.
+
+        Which callables produce which types is worked out from the
+        types specified using :func:`returns` or
+        :meth:`add_returning`, and from classes that are added as
+        callables. Callables whose return types are not known are
+        called if a type is needed that has no known producer, and the
+        types they add to the context are recorded so that they are only
+        called when needed in future.
 
-                if o is nothing:
-                    pass
-                elif name is None:
-                    args.append(o)
-                else:
-                    kw[name] = o
-
-            result = obj(*args, **kw)
-
-            if requirements.returns is not not_specified:
-                context.add(result, requirements.returns)
-            elif result is not None:
-                if type_func(result) in (tuple, list):
-                    for obj in result:
-                        context.add(obj)
-                elif type_func(result) is dict:
-                    for type, obj in result.items():
-                        context.add(obj, type)
-                elif getattr(result, '__enter__', None):
-                    context.add(result)
-                    with result as obj:
-                        if obj not in (None, result):
-                            context.add(obj)
-                        self(context)
-                else:
-                    context.add(result)
+        :param context:
+          An optional :class:`Context` containing resources that are
+          already available. See :meth:`__call__`.
+
+        :param executor:
+          An optional executor. See :meth:`__call__`.
+        """
+        context = kw.pop('context', None)
+        executor = kw.pop('executor', None)
+        if context is None:
+            context = Context()
+        plan = self.compile_for(types, tuple(context.keys()))
+        plan.prepare(context)
+        plan(context, executor)
+        results = tuple(context.get(type) for type in types)
+        if len(results) == 1:
+            return results[0]
+        return results
+
+
+class Builder(object):
+    """
+    Used to add many callables to a :class:`Runner` in one go.
+
+    Callables are collected by :meth:`add`, :meth:`add_returning` and
+    :meth:`extend` but are only placed in the runner when
+    :meth:`finalize` is called. At that point, the types they require
+    are all registered in one pass, after which where each callable
+    belongs is worked out from the positions of those types without
+    registering them again, giving the same order as if they had been
+    added to the runner one at a time.
+
+    :param runner:
+      The runner to add callables to. If not supplied, a new
+      :class:`Runner` will be created.
+    """
+
+    def __init__(self, runner=None):
+        self.runner = Runner() if runner is None else runner
+        self.pending = []
+
+    def add_returning(self, obj, returns, *args, **kw):
+        "Collect a callable as :meth:`Runner.add_returning` would add it."
+        self.pending.append(self.runner._prepare(obj, returns, args, kw)
+                            + (obj,))
+
+    def add(self, obj, *args, **kw):
+        "Collect a callable as :meth:`Runner.add` would add it."
+        self.add_returning(obj, not_specified, *args, **kw)
+
+    def extend(self, *objs):
+        "Collect callables as :meth:`Runner.extend` would add them."
+        for obj in objs:
+            if isinstance(obj, Runner):
+                for clean, reqs, o in obj:
+                    self.add_returning(o, clean.returns,
+                                       *reqs.args, **reqs.kw)
+            else:
+                self.add(obj)
+
+    def finalize(self):
+        """
+        Place all the collected callables in the runner and return it.
+        """
+        runner = self.runner
+        pending, self.pending = self.pending, []
+        for _, _, order, _ in pending:
+            for type, _ in order:
+                runner._register(type)
+        for clean, requirements, order, obj in pending:
+            position, period_name = runner._locate(order)
+            order_type = runner._place(clean, requirements, obj,
+                                       position, period_name)
+            if runner.debug:
+                runner._added(obj, period_name, order_type, clean)
+        runner._plan = None
+        return runner
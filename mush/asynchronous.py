@@ -0,0 +1,270 @@
+"""
+Support for using a :class:`~mush.Runner` from :mod:`asyncio` code.
+"""
+import asyncio
+from functools import partial
+from inspect import isawaitable
+import sys
+
+from . import (
+    Cached, Context, Runner, Schedule, Timed, cacheable, clock, get_ident,
+    getpid, not_specified, type_func
+)
+
+
+async def enter(context, manager):
+    """
+    Enter an asynchronous context manager, adding both it and the object
+    returned by its ``__aenter__`` method to the supplied
+    :class:`~mush.Context`.
+    """
+    context.add(manager)
+    obj = await manager.__aenter__()
+    context.managers.append(manager)
+    context.entered[id(manager)] = obj
+    for hook in context.hooks:
+        hook.enter(context, manager)
+    if obj not in (None, manager):
+        context.add(obj)
+
+
+async def exit(context, manager, exc_info=(None, None, None)):
+    """
+    Exit a context manager, asynchronous or otherwise, that has been
+    entered, returning what its exit method returns.
+    """
+    try:
+        if getattr(manager, '__aexit__', None):
+            return await manager.__aexit__(*exc_info)
+        return manager.__exit__(*exc_info)
+    finally:
+        for hook in context.hooks:
+            hook.exit(context, manager)
+
+
+async def call(context, step, args, kw, executor, hooks=()):
+    """
+    Call the callable for the supplied :class:`~mush.Step`, awaiting its
+    result if needed. If the callable has a :class:`~mush.scope`, it is
+    the awaited result that is stored.
+
+    Callables marked with :class:`~mush.processes.in_process` are
+    submitted to their pool and the result awaited, so that the event
+    loop is not blocked while they run in another process.
+
+    Any :class:`~mush.Hook` instances supplied are notified, with the
+    time taken including any time spent awaiting the result.
+    """
+    for hook in hooks:
+        hook.before(context, step, args, kw)
+    timed = Timed(None)
+    timed.thread = get_ident()
+    timed.process = getpid()
+    timed.start = clock()
+    try:
+        result = await _call(step, args, kw, executor)
+    except BaseException as e:
+        timed.elapsed = clock() - timed.start
+        for hook in hooks:
+            hook.error(context, step, e, timed)
+        raise
+    timed.elapsed = clock() - timed.start
+    for hook in hooks:
+        hook.after(context, step, result, timed)
+    return result
+
+
+async def _call(step, args, kw, executor):
+    target = step.call
+    cached = isinstance(target, Cached)
+    if cached:
+        cache, target = target.cache, target.call
+        key = cache.key(args, kw)
+        result = cache.get(key)
+        if result is not not_specified:
+            return result
+    pool = getattr(step.obj, '__in_process__', None)
+    if pool is not None:
+        # waiting on the pool's future rather than calling the pool
+        # means the event loop isn't blocked until the result is ready:
+        result = await asyncio.wrap_future(pool.submit(step.obj, *args, **kw))
+    elif executor is None or asyncio.iscoroutinefunction(step.obj):
+        result = target(*args, **kw)
+    else:
+        loop = asyncio.get_event_loop()
+        result = await loop.run_in_executor(
+            executor, partial(target, *args, **kw)
+        )
+    if isawaitable(result):
+        result = await result
+    if cached and cacheable(result):
+        cache.set(key, result)
+    return result
+
+
+async def handle(step, context, result):
+    """
+    Add the result of a step to the supplied :class:`~mush.Context`,
+    entering it if it is an asynchronous context manager.
+    """
+    if (step.returns is not_specified and
+            result is not None and
+            type_func(result) not in (tuple, list, dict) and
+            getattr(result, '__aenter__', None)):
+        await enter(context, result)
+    else:
+        step.handle(context, result)
+
+
+async def provide(context, step, executor):
+    """
+    Call, and await, the :class:`~mush.lazy` providers of any types the
+    supplied :class:`~mush.Step` requires that are not yet in the
+    supplied :class:`~mush.Context`.
+    """
+    for type in step.periods:
+        if type in context:
+            continue
+        provider = context.providers.pop(type, None)
+        if provider is not None:
+            await provide(context, provider, executor)
+            args, kw = provider.resolve(context)
+            await handle(provider, context, await call(
+                context, provider, args, kw, executor, context.hooks
+            ))
+
+
+async def release(plan, context, position, finished):
+    """
+    Release the types that are no longer needed once the step at the
+    supplied position has finished, exiting any context managers,
+    asynchronous or otherwise, that can now be exited.
+    See :attr:`mush.Runner.release`.
+    """
+    plan.release(context, plan.released(position, finished))
+    manager = plan.exitable(context)
+    while manager is not None:
+        await exit(context, manager)
+        manager = plan.exitable(context)
+
+
+async def execute(plan, context, executor):
+    """
+    Call the steps of the supplied :class:`~mush.Plan` that remain in
+    the supplied :class:`~mush.Context`, starting each one as a task as
+    soon as the :class:`~mush.Schedule` says it can be started.
+    """
+    steps = plan.steps
+    schedule = Schedule(plan, context)
+    running = {}
+    error = None
+
+    try:
+        while True:
+            if error is None:
+                for position in schedule:
+                    step = steps[position]
+                    try:
+                        await provide(context, step, executor)
+                        args, kw = step.resolve(context)
+                    except BaseException as e:
+                        error = e
+                        for other in running:
+                            other.cancel()
+                        break
+                    task = asyncio.ensure_future(
+                        call(context, step, args, kw, executor, plan.hooks)
+                    )
+                    running[task] = position
+
+            if not running:
+                break
+
+            try:
+                done, _ = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED
+                )
+            except BaseException:
+                for task in running:
+                    task.cancel()
+                raise
+            for task in sorted(done, key=running.get):
+                position = running.pop(task)
+                if task.cancelled():
+                    schedule.cancel(position)
+                    continue
+                schedule.finish(position)
+                try:
+                    await handle(steps[position], context, task.result())
+                    if plan.releasing:
+                        await release(plan, context, position,
+                                      schedule.finished)
+                except BaseException as e:
+                    if error is None:
+                        error = e
+                        for other in running:
+                            other.cancel()
+    finally:
+        schedule.close()
+
+    if error is not None:
+        raise error
+    context.index = len(steps)
+
+
+class AsyncRunner(Runner):
+    """
+    A :class:`~mush.Runner` that must be awaited when called, for use
+    from :mod:`asyncio` code.
+
+    Callables are called in the same order as for a
+    :class:`~mush.Runner` but coroutine functions, or any callable that
+    returns an awaitable, may be used and their results will be awaited.
+    Callables that do not depend on each other are run concurrently.
+
+    Asynchronous context managers returned by callables are entered and
+    exited with the same nesting as normal context managers.
+    """
+
+    async def __call__(self, context=None, executor=None):
+        """
+        Execute the callables in this runner in the required order, as
+        for :meth:`mush.Runner.__call__`.
+
+        :param executor:
+          An optional :class:`concurrent.futures.Executor`, such as a
+          :class:`~concurrent.futures.ThreadPoolExecutor`. If passed,
+          callables that are not coroutine functions will be called in
+          it, so that callables that block do not stop the event loop.
+        """
+        plan = self.compile()
+        if context is None:
+            context = Context()
+        plan.prepare(context)
+        for hook in plan.hooks:
+            hook.start(context)
+        managers = context.managers
+        exc_info = None
+        while True:
+            if exc_info is None:
+                try:
+                    await execute(plan, context, executor)
+                except BaseException:
+                    exc_info = sys.exc_info()
+            if not managers:
+                break
+            manager = managers.pop()
+            try:
+                suppressed = await exit(
+                    context, manager, exc_info or (None, None, None)
+                )
+                if exc_info is not None and suppressed:
+                    exc_info = None
+            except BaseException:
+                previous, exc_info = exc_info, sys.exc_info()
+                if previous is not None and exc_info[1] is not previous[1]:
+                    exc_info[1].__context__ = previous[1]
+        for hook in plan.hooks:
+            hook.finish(context, None if exc_info is None else exc_info[1])
+        if exc_info is not None:
+            raise exc_info[1].with_traceback(exc_info[2])
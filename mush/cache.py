@@ -0,0 +1,313 @@
+"""
+Support for keeping the results of callables on disk, so that later
+runs of a script can skip callables whose code and resources have not
+changed.
+"""
+from hashlib import sha256
+from inspect import getsource
+import os
+import pickle
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from types import BuiltinFunctionType, FunctionType
+
+from . import CacheInfo, not_specified, scope
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+def fingerprint(obj, version=None):
+    """
+    Return a string identifying the supplied callable that changes when
+    its source code, or the supplied version, changes.
+    """
+    name = '%s.%s' % (getattr(obj, '__module__', None),
+                      getattr(obj, '__qualname__', type(obj).__name__))
+    digest = sha256(repr(version).encode('utf-8'))
+    try:
+        digest.update(getsource(obj).encode('utf-8'))
+    except (OSError, TypeError):
+        code = getattr(obj, '__code__', None)
+        if code is not None:
+            digest.update(code.co_code)
+            digest.update(repr(code.co_consts).encode('utf-8'))
+    return '%s-%s' % (name, digest.hexdigest()[:16])
+
+
+def field(digest, tag, data=b''):
+    """
+    Add the supplied tag and data to the supplied digest, prefixed with
+    the length of the data so that different fields can never run into
+    each other.
+    """
+    data = memoryview(data).cast('B')
+    digest.update(('%s:%i:' % (tag, data.nbytes)).encode('ascii'))
+    digest.update(data)
+
+
+class DiskCache(object):
+    """
+    A directory in which the results of callables decorated with
+    :class:`on_disk` are kept.
+
+    Results are stored under a fingerprint of the callable and of the
+    resources it was called with, which must be the same in every
+    process. Resources are fingerprinted using their contents if they
+    support the buffer protocol and by their values if they are strings,
+    numbers, containers or other objects that can be pickled, with the
+    items of sets and dictionaries fingerprinted in an order that does
+    not depend on hashing. If a resource can't be fingerprinted, the
+    callable is always called. :class:`os.PathLike` resources, such as
+    :class:`pathlib.Path` instances, are fingerprinted using the
+    modification time and size of the file they refer to.
+
+    :class:`numpy.ndarray` results are memory-mapped from disk when
+    re-used, and :class:`bytes` results are read directly from disk.
+    Other results are pickled, so only directories that can be trusted
+    should be used.
+
+    :param path:
+      The directory to use, which will be created if needed.
+    :param hash_files:
+      If ``True``, the contents of files are hashed when fingerprinting
+      :class:`os.PathLike` resources, rather than using their
+      modification time and size.
+    """
+
+    def __init__(self, path, hash_files=False):
+        self.path = path
+        self.hash_files = hash_files
+
+    def _unordered(self, digest, tag, values):
+        digests = sorted(self._digest(value) for value in values)
+        field(digest, tag, str(len(digests)).encode('ascii'))
+        for item in digests:
+            digest.update(item)
+
+    def _digest(self, value):
+        digest = sha256()
+        self._update(digest, value)
+        return digest.digest()
+
+    def _update(self, digest, value):
+        kind = type(value)
+        if isinstance(value, os.PathLike):
+            path = os.fspath(value)
+            field(digest, 'path', os.fsencode(path))
+            if self.hash_files:
+                contents = sha256()
+                with open(path, 'rb') as source:
+                    for block in iter(lambda: source.read(1 << 20), b''):
+                        contents.update(block)
+                field(digest, 'contents', contents.digest())
+            else:
+                stat = os.stat(path)
+                field(digest, 'stat', ('%i:%i' % (
+                    stat.st_mtime_ns, stat.st_size
+                )).encode('ascii'))
+        elif value is None or kind in (bool, int, float, complex):
+            field(digest, kind.__name__, repr(value).encode('ascii'))
+        elif kind is str:
+            field(digest, 'str', value.encode('utf-8', 'surrogatepass'))
+        elif kind in (tuple, list):
+            field(digest, kind.__name__, str(len(value)).encode('ascii'))
+            for item in value:
+                self._update(digest, item)
+        elif kind is dict:
+            self._unordered(digest, 'dict', value.items())
+        elif kind in (set, frozenset):
+            self._unordered(digest, kind.__name__, value)
+        elif isinstance(value, (type, FunctionType, BuiltinFunctionType)):
+            self._reference(digest, value)
+        else:
+            try:
+                view = memoryview(value)
+            except TypeError:
+                view = None
+            if view is None or not view.c_contiguous:
+                self._reduce(digest, value)
+            else:
+                field(digest, 'buffer', ('%s:%s:%s' % (
+                    kind.__name__, view.format, view.shape
+                )).encode('utf-8'))
+                field(digest, 'data', view)
+
+    def _reference(self, digest, obj):
+        # classes and functions are pickled by reference, which only
+        # works for those that can be imported:
+        name = '%s.%s' % (obj.__module__, obj.__qualname__)
+        if '<' in name:
+            raise TypeError('%r cannot be imported' % obj)
+        field(digest, 'reference', name.encode('utf-8'))
+
+    def _reduce(self, digest, value):
+        reduced = value.__reduce_ex__(4)
+        if isinstance(reduced, str):
+            field(digest, 'reference', ('%s.%s' % (
+                value.__module__, reduced
+            )).encode('utf-8'))
+            return
+        reduced = tuple(reduced) + (None, ) * (5 - len(reduced))
+        call, args, state, items, pairs = reduced[:5]
+        field(digest, 'object')
+        self._reference(digest, call)
+        self._update(digest, args)
+        self._update(digest, state)
+        self._update(digest, None if items is None else list(items))
+        self._update(digest, None if pairs is None else list(pairs))
+
+    def key(self, args, kw):
+        """
+        Return the fingerprint of the supplied arguments and keyword
+        parameters, or ``None`` if they can't be fingerprinted.
+        """
+        digest = sha256()
+        try:
+            for value in args:
+                self._update(digest, value)
+            for name, value in sorted(kw.items()):
+                field(digest, 'keyword', name.encode('utf-8'))
+                self._update(digest, value)
+        except (pickle.PicklingError, TypeError, AttributeError, OSError,
+                RecursionError):
+            return None
+        return digest.hexdigest()
+
+    def results(self, obj, version=None):
+        "Return the :class:`StoredResults` for the supplied callable."
+        return StoredResults(
+            self, os.path.join(self.path, fingerprint(obj, version))
+        )
+
+
+class StoredResults(object):
+    """
+    The results of one callable kept by a :class:`DiskCache`. This
+    provides the same methods as a :class:`~mush.Cache`.
+    """
+
+    #: The file extensions used for each way of storing results.
+    kinds = ('.npy', '.bytes', '.pickle')
+
+    def __init__(self, cache, path):
+        self.cache = cache
+        self.path = path
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, args, kw):
+        return self.cache.key(args, kw)
+
+    def _load(self, path, kind):
+        if kind == '.npy':
+            return numpy.load(path, mmap_mode='r').view(numpy.ndarray)
+        with open(path, 'rb') as source:
+            if kind == '.bytes':
+                return source.read()
+            return pickle.load(source)
+
+    def get(self, key):
+        """
+        Return the result stored for the supplied key, or
+        ``not_specified`` if there is no result.
+        """
+        if key is not None:
+            for kind in self.kinds:
+                if kind == '.npy' and numpy is None:
+                    continue
+                path = os.path.join(self.path, key + kind)
+                try:
+                    result = self._load(path, kind)
+                except (IOError, OSError):
+                    continue
+                with self.lock:
+                    self.hits += 1
+                return result
+        with self.lock:
+            self.misses += 1
+        return not_specified
+
+    def _dump(self, file, result):
+        if numpy is not None and type(result) is numpy.ndarray:
+            numpy.save(file, result, allow_pickle=False)
+            return '.npy'
+        if type(result) is bytes:
+            file.write(result)
+            return '.bytes'
+        pickle.dump(result, file, 4)
+        return '.pickle'
+
+    def set(self, key, result):
+        """
+        Store the result for the supplied key, unless the key is
+        ``None`` or the result can't be stored.
+        """
+        if key is None:
+            return
+        if not os.path.exists(self.path):
+            os.makedirs(self.path, exist_ok=True)
+        with NamedTemporaryFile(dir=self.path, delete=False) as file:
+            try:
+                kind = self._dump(file, result)
+            except (pickle.PicklingError, TypeError, AttributeError,
+                    ValueError):
+                kind = None
+        if kind is None:
+            os.remove(file.name)
+        else:
+            # so that a run that is interrupted never leaves part of a
+            # result behind:
+            os.replace(file.name, os.path.join(self.path, key + kind))
+
+    def _files(self):
+        try:
+            return [name for name in os.listdir(self.path)
+                    if name.endswith(self.kinds)]
+        except (IOError, OSError):
+            return []
+
+    def clear(self):
+        "Discard all stored results."
+        for name in self._files():
+            os.remove(os.path.join(self.path, name))
+
+    def info(self):
+        "Return the :class:`~mush.CacheInfo` for these results."
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, None, len(self))
+
+    def __len__(self):
+        return len(self._files())
+
+
+class on_disk(scope):
+    """
+    A decorator to indicate that the results of a callable should be
+    kept in a :class:`DiskCache`, so that it is only called again when
+    its source code or the resources it requires change, even in a new
+    process.
+
+    :param cache:
+      The :class:`DiskCache` to use.
+    :param version:
+      If passed, changing this will also cause the callable to be
+      called again, for example when something it uses has changed.
+    """
+
+    def __init__(self, cache, version=None):
+        self.name = 'disk'
+        self.cache = cache
+        self.version = version
+        self.results = {}
+
+    def cache_for(self, obj, caches):
+        results = self.results.get(obj)
+        if results is None:
+            results = self.results[obj] = self.cache.results(
+                obj, self.version
+            )
+        return results
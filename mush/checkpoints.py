@@ -0,0 +1,159 @@
+"""
+Support for taking checkpoints of the resources in a call of a
+:class:`~mush.Runner`, so that a call that fails part of the way through
+can be continued with :meth:`~mush.Runner.resume` without calling the
+callables before the checkpoint again.
+"""
+import os
+import pickle
+from tempfile import NamedTemporaryFile
+from threading import Lock
+
+from . import Hook
+
+
+class Checkpoint(object):
+    """
+    The state of a call of a :class:`~mush.Runner` once some of its
+    callables had been called, as needed by :meth:`~mush.Runner.resume`.
+
+    Checkpoints can be pickled, and :meth:`write` and :meth:`load` can
+    be used to keep them in a file.
+    """
+
+    def __init__(self, steps, index, managers, resources, skipped=()):
+        #: The number of callables in the runner being called.
+        self.steps = steps
+        #: The number of callables that had been called.
+        self.index = index
+        #: The positions of the callables that returned the context
+        #: managers that were entered.
+        self.managers = tuple(managers)
+        self._resources = tuple(resources)
+        #: The types of the resources that could not be kept as they
+        #: could not be pickled.
+        self.skipped = tuple(skipped)
+
+    def resources(self):
+        "Return a mapping of types to the resources that were kept."
+        return dict(pickle.loads(data) for data in self._resources)
+
+    def write(self, path):
+        """
+        Write this checkpoint to the supplied path, replacing any
+        checkpoint already there.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        with NamedTemporaryFile(dir=directory, delete=False) as file:
+            pickle.dump(self, file, 4)
+        os.replace(file.name, path)
+
+    @classmethod
+    def load(cls, path):
+        "Load a checkpoint written by :meth:`write`."
+        with open(path, 'rb') as source:
+            return pickle.load(source)
+
+    def __repr__(self):
+        return '<Checkpoint: %i of %i callables called>' % (
+            self.index, self.steps
+        )
+
+
+class Checkpointer(Hook):
+    """
+    A :class:`~mush.Hook` that takes a :class:`Checkpoint` of each run of
+    the runners it is added to after each of the supplied callables has
+    been called.
+
+    Resources that can't be pickled are not kept, nor are context
+    managers or the objects returned when they were entered. Instead,
+    the callables that returned them are called again when the run is
+    resumed. Checkpoints are only taken when callables are called one
+    at a time.
+
+    :param callables:
+      The callables after which a checkpoint should be taken. If none
+      are supplied, a checkpoint is taken after every callable.
+    :param path:
+      If supplied, each checkpoint will also be written to this path.
+    """
+
+    def __init__(self, *callables, **kw):
+        self.callables = frozenset(callables)
+        self.path = kw.pop('path', None)
+        #: The most recent :class:`Checkpoint` taken.
+        self.checkpoint = None
+        self.runs = {}
+        self.lock = Lock()
+
+    def start(self, context):
+        with self.lock:
+            self.runs[id(context)] = dict(managers={}, called=None,
+                                          pending=False)
+
+    def before(self, context, step, args, kw):
+        run = self.runs.get(id(context))
+        if run is not None and run['pending'] and context.pending is None:
+            run['pending'] = False
+            self.take(context, context.index - 1, run['managers'])
+
+    def after(self, context, step, result, call):
+        run = self.runs.get(id(context))
+        if run is not None:
+            if getattr(step.obj, '__lazy__', None) is not None:
+                # providers are called while resolving the requirements
+                # of the step at the current position:
+                return
+            run['called'] = context.index
+            if not self.callables or step.obj in self.callables:
+                run['pending'] = True
+
+    def enter(self, context, manager):
+        run = self.runs.get(id(context))
+        # managers entered before the step being called has returned
+        # come from lazy providers, which will be called again anyway:
+        if run is not None and run['called'] == context.index:
+            run['managers'][id(manager)] = context.index - 1
+
+    def exit(self, context, manager):
+        run = self.runs.get(id(context))
+        if run is not None:
+            run['managers'].pop(id(manager), None)
+
+    def finish(self, context, exception):
+        with self.lock:
+            self.runs.pop(id(context), None)
+
+    def take(self, context, index, positions):
+        """
+        Take a :class:`Checkpoint` of the supplied :class:`~mush.Context`
+        once `index` callables have been called, given a mapping of the
+        :func:`id` of each context manager entered to the position of the
+        callable that returned it.
+        """
+        excluded = set()
+        managers = []
+        for manager in context.managers:
+            excluded.add(type(manager))
+            obj = context.entered.get(id(manager))
+            if obj is not None:
+                excluded.add(type(obj))
+            position = positions.get(id(manager))
+            if position is not None:
+                managers.append(position)
+        resources = []
+        skipped = []
+        for type_, obj in context.items():
+            if type_ in excluded:
+                continue
+            try:
+                resources.append(pickle.dumps((type_, obj), 4))
+            except Exception:
+                skipped.append(type_)
+        checkpoint = Checkpoint(len(context.req_objs), index, managers,
+                                resources, skipped)
+        if self.path is not None:
+            checkpoint.write(self.path)
+        self.checkpoint = checkpoint
+        return checkpoint
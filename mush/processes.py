@@ -0,0 +1,139 @@
+"""
+Support for calling the callables in a :class:`~mush.Runner` in other
+processes.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count
+from threading import Lock
+import sys
+
+#: Whether :class:`~concurrent.futures.ProcessPoolExecutor` can replace
+#: its own worker processes after a number of tasks.
+native_recycling = sys.version_info[:2] >= (3, 11)
+
+
+class ProcessPool(object):
+    """
+    A pool of worker processes in which callables marked with
+    :class:`in_process` are called.
+
+    The worker processes are only started when the first callable is
+    called.
+
+    :param max_workers:
+      The number of worker processes to use, defaulting to the number
+      of CPUs.
+
+    :param max_tasks_per_child:
+      If passed, worker processes will be replaced with fresh ones once
+      they have been used for this many calls, containing any leaks in
+      long running processes. On Python versions before 3.11, the whole
+      pool is replaced once it has been used for this many calls per
+      worker process.
+
+    :param transport:
+      If passed, this is used to move resources to the worker processes
+      instead of pickling them, such as a
+      :class:`~mush.sharedmemory.SharedMemoryTransport`.
+    """
+
+    def __init__(self, max_workers=None, max_tasks_per_child=None,
+                 transport=None):
+        self.max_workers = max_workers or cpu_count()
+        self.max_tasks_per_child = max_tasks_per_child
+        self.transport = transport
+        self.executor = None
+        self.submitted = 0
+        self.lock = Lock()
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is not None and self.max_tasks_per_child:
+                limit = self.max_tasks_per_child * self.max_workers
+                if not native_recycling and self.submitted >= limit:
+                    self.executor.shutdown(wait=False)
+                    self.executor = None
+            if self.executor is None:
+                if self.max_tasks_per_child and native_recycling:
+                    self.executor = ProcessPoolExecutor(
+                        self.max_workers,
+                        max_tasks_per_child=self.max_tasks_per_child
+                    )
+                else:
+                    self.executor = ProcessPoolExecutor(self.max_workers)
+                self.submitted = 0
+            self.submitted += 1
+            return self.executor
+
+    def _submit(self, obj, args, kw):
+        transport = self.transport
+        if transport is None:
+            return self._executor().submit(obj, *args, **kw), None
+        args, kw, handles = transport.prepare(args, kw)
+        def release(future=None):
+            for handle in handles:
+                transport.release(handle)
+        try:
+            future = self._executor().submit(transport.call, obj, args, kw)
+        except:
+            release()
+            raise
+        return future, release
+
+    def submit(self, obj, *args, **kw):
+        """
+        Call the supplied callable in a worker process, returning a
+        :class:`~concurrent.futures.Future` for its result.
+
+        The callable, along with the arguments and parameters it is
+        called with, must be picklable, as must anything it returns.
+        """
+        future, release = self._submit(obj, args, kw)
+        if release is not None:
+            future.add_done_callback(release)
+        return future
+
+    def __call__(self, obj, *args, **kw):
+        """
+        Call the supplied callable in a worker process and return the
+        result.
+        """
+        future, release = self._submit(obj, args, kw)
+        try:
+            return future.result()
+        finally:
+            if release is not None:
+                release()
+
+    def shutdown(self, wait=True):
+        "Stop all the worker processes in this pool."
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait)
+                self.executor = None
+        if self.transport is not None:
+            self.transport.close()
+
+#: The :class:`ProcessPool` used when :class:`in_process` is not given one.
+default_pool = ProcessPool()
+
+
+class in_process(object):
+    """
+    A decorator used for marking a callable as needing to be called in
+    another process when used in a :class:`~mush.Runner`.
+
+    The resources it requires are pickled and passed to a worker
+    process where the callable is called. The result is then returned
+    to the process where the runner was called and handled as usual.
+
+    :param pool:
+      The :class:`ProcessPool` to use. If not passed,
+      :obj:`default_pool` will be used.
+    """
+    def __init__(self, pool=None):
+        self.pool = default_pool if pool is None else pool
+
+    def __call__(self, obj):
+        obj.__in_process__ = self.pool
+        return obj
@@ -0,0 +1,241 @@
+"""
+A :class:`~mush.Hook` for finding out how much memory each callable in
+a :class:`~mush.Runner` allocates, using :mod:`tracemalloc`.
+"""
+from collections import OrderedDict
+from gc import get_referents
+import json
+import sys
+from threading import Lock
+import tracemalloc
+from types import FunctionType, ModuleType
+
+from . import Hook, not_specified, type_func
+from .stats import name
+
+#: Objects of these types are not included in the size of a resource.
+shared_types = (type, ModuleType, FunctionType)
+
+# added in Python 3.9:
+reset_peak = getattr(tracemalloc, 'reset_peak', None)
+
+
+def sizeof(obj):
+    """
+    Return the number of bytes used by the supplied object and all the
+    objects it refers to, excluding classes, modules and functions.
+    """
+    seen = set()
+    size = 0
+    objs = [obj]
+    while objs:
+        found = []
+        for obj in objs:
+            if isinstance(obj, shared_types) or id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            size += sys.getsizeof(obj)
+            found.append(obj)
+        objs = get_referents(*found)
+    return size
+
+
+def resources(step, result):
+    """
+    Return a list of the types and resources that the supplied result of
+    calling a :class:`~mush.Step` will add to the context.
+    """
+    if step.returns is not not_specified:
+        return [(step.returns, result)]
+    if result is None:
+        return []
+    if type_func(result) in (tuple, list):
+        return [(type_func(obj), obj) for obj in result]
+    if type_func(result) is dict:
+        return list(result.items())
+    return [(type_func(result), result)]
+
+
+def label(type):
+    "Return a short name for the supplied resource type."
+    if isinstance(type, str):
+        return type
+    return name(type)
+
+
+class CallableProfile(object):
+    """
+    The memory use recorded for one callable, across all the times it
+    has been called. All sizes are in bytes.
+    """
+
+    def __init__(self, obj):
+        #: The callable this profile is for.
+        self.obj = obj
+        #: The number of times the callable was called.
+        self.calls = 0
+        #: The largest increase in allocated memory left once a call of
+        #: the callable had returned.
+        self.net = 0
+        #: The largest amount of memory allocated at any point during a
+        #: call of the callable.
+        self.peak = 0
+        #: A mapping of the name of each type of resource the callable
+        #: returned to the largest size seen for it.
+        self.resources = OrderedDict()
+        #: A mapping of ``(filename, line)`` for the places memory was
+        #: allocated during calls to a list of the total size and count
+        #: of those allocations.
+        self.sites = {}
+
+    def record(self, net, peak, sizes, sites):
+        self.calls += 1
+        self.net = max(self.net, net)
+        self.peak = max(self.peak, peak)
+        for type, size in sizes:
+            self.resources[type] = max(self.resources.get(type, 0), size)
+        for site, size, count in sites:
+            totals = self.sites.setdefault(site, [0, 0])
+            totals[0] += size
+            totals[1] += count
+
+    def top(self, limit):
+        "Return the places where the most memory was allocated."
+        return sorted(self.sites.items(),
+                      key=lambda item: (-item[1][0], item[0]))[:limit]
+
+    def __repr__(self):
+        return '<CallableProfile %s: %i calls>' % (name(self.obj), self.calls)
+
+
+class MemoryProfiler(Hook):
+    """
+    A :class:`~mush.Hook` that records, for each callable called by the
+    runners it is added to, how much memory it allocated, how large the
+    resources it returned are and where in the code the memory was
+    allocated.
+
+    :mod:`tracemalloc` is started for the duration of each run if it is
+    not already tracing. As it measures all the allocations made by a
+    process, runners being profiled should not be called concurrently
+    or with an executor. Before Python 3.9, the traces collected so far
+    are also discarded before each call, as that is the only way to
+    reset the peak memory use.
+
+    :param sites:
+      The number of places where the most memory was allocated to
+      report for each callable. Finding these requires a
+      :mod:`tracemalloc` snapshot to be taken around every call, so
+      pass ``0`` to make profiling quicker.
+    :param frames:
+      The number of frames to store for each allocation, if this hook
+      starts :mod:`tracemalloc`.
+    """
+
+    def __init__(self, sites=10, frames=1):
+        self.sites = sites
+        self.frames = frames
+        #: A mapping of callables to their :class:`CallableProfile`.
+        self.callables = OrderedDict()
+        self.calls = {}
+        self.started = 0
+        self.lock = Lock()
+
+    def start(self, context):
+        with self.lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                self.started = 1
+            elif self.started:
+                self.started += 1
+
+    def finish(self, context, exception):
+        with self.lock:
+            if self.started:
+                self.started -= 1
+                if not self.started:
+                    tracemalloc.stop()
+
+    def _snapshot(self):
+        if self.sites:
+            return tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ))
+
+    def before(self, context, step, args, kw):
+        if reset_peak is None:
+            # the peak can only be reset by discarding all the traces,
+            # after which those left were all made during the call:
+            tracemalloc.clear_traces()
+            snapshot = None
+        else:
+            snapshot = self._snapshot()
+            reset_peak()
+        self.calls[id(context), id(step)] = (
+            tracemalloc.get_traced_memory()[0], snapshot
+        )
+
+    def _sites(self, before):
+        after = self._snapshot()
+        if before is None:
+            changes = [(stat.traceback[0], stat.size, stat.count)
+                       for stat in after.statistics('lineno')]
+        else:
+            changes = [(stat.traceback[0], stat.size_diff, stat.count_diff)
+                       for stat in after.compare_to(before, 'lineno')]
+        return [((frame.filename, frame.lineno), size, count)
+                for frame, size, count in changes if size > 0]
+
+    def _record(self, context, step, result):
+        current, peak = tracemalloc.get_traced_memory()
+        start, before = self.calls.pop((id(context), id(step)))
+        sizes = [(label(type), sizeof(obj))
+                 for type, obj in resources(step, result)]
+        sites = self._sites(before) if self.sites else []
+        with self.lock:
+            profile = self.callables.get(step.obj)
+            if profile is None:
+                profile = self.callables[step.obj] = CallableProfile(step.obj)
+            profile.record(current - start, peak - start, sizes, sites)
+
+    def after(self, context, step, result, call):
+        self._record(context, step, result)
+
+    def error(self, context, step, exception, call):
+        self._record(context, step, None)
+
+    def reset(self):
+        "Discard all the memory use recorded so far."
+        with self.lock:
+            self.callables = OrderedDict()
+
+    def report(self):
+        """
+        Return the memory use recorded so far as a structure of lists and
+        dictionaries, with the callables in the order they were first
+        called, that can be serialized as JSON.
+        """
+        with self.lock:
+            profiles = list(self.callables.values())
+        return dict(callables=[dict(
+            callable=name(profile.obj),
+            calls=profile.calls,
+            net=profile.net,
+            peak=profile.peak,
+            resources=dict(profile.resources),
+            sites=[dict(file=file, line=line, size=size, count=count)
+                   for (file, line), (size, count) in profile.top(self.sites)],
+        ) for profile in profiles])
+
+    def write(self, target):
+        """
+        Write the :meth:`report` as JSON, with a stable layout that is
+        easy to compare between versions, to the supplied path or
+        file-like object.
+        """
+        if isinstance(target, str):
+            with open(target, 'w') as file:
+                return self.write(file)
+        json.dump(self.report(), target, indent=2, sort_keys=True)
+        target.write('\n')
@@ -0,0 +1,201 @@
+"""
+Support for passing large resources to other processes without pickling
+them, using :mod:`multiprocessing.shared_memory`.
+"""
+from multiprocessing import shared_memory
+from threading import Lock
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+def attach(name):
+    """
+    Attach to an existing shared memory segment. Where possible, this
+    is done without registering the segment with the resource tracker,
+    as it is the process that created the segment that unlinks it.
+    """
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:  # track was added in Python 3.13
+        return shared_memory.SharedMemory(name)
+
+
+class SharedBuffer(object):
+    """
+    A picklable handle for a resource that has been copied into a
+    shared memory segment.
+
+    In the process that receives it, :meth:`open` gives a view of the
+    resource that uses the shared memory directly.
+    """
+
+    def __init__(self, name, nbytes, format, shape, dtype=None):
+        self.name = name
+        self.nbytes = nbytes
+        self.format = format
+        self.shape = shape
+        self.dtype = dtype
+        self.segment = None
+
+    def __getstate__(self):
+        state = dict(vars(self))
+        state['segment'] = None
+        return state
+
+    def open(self):
+        """
+        Return a view of the resource. This is a :class:`numpy.ndarray`
+        if the resource was one, or a :class:`memoryview` otherwise.
+        """
+        self.segment = attach(self.name)
+        buffer = self.segment.buf[:self.nbytes].toreadonly()
+        if self.dtype is not None:
+            return numpy.ndarray(self.shape, self.dtype, buffer=buffer)
+        return buffer.cast(self.format, self.shape)
+
+    def close(self):
+        "Stop using the shared memory segment in this process."
+        if self.segment is not None:
+            try:
+                self.segment.close()
+            except BufferError:
+                # something is still using a view of the segment, so leave
+                # it mapped until that is garbage collected.
+                pass
+            self.segment = None
+
+    def __repr__(self):
+        return '<SharedBuffer %s: %i bytes>' % (self.name, self.nbytes)
+
+
+def call_shared(obj, args, kw):
+    """
+    Call `obj` in a worker process, replacing any :class:`SharedBuffer`
+    handles in `args` and `kw` with views of the resources they refer to.
+    """
+    handles = []
+    def view(value):
+        if isinstance(value, SharedBuffer):
+            handles.append(value)
+            return value.open()
+        return value
+    try:
+        return obj(*[view(a) for a in args],
+                   **dict((k, view(v)) for k, v in kw.items()))
+    finally:
+        del args, kw
+        for handle in handles:
+            handle.close()
+
+
+class SharedMemoryTransport(object):
+    """
+    Used by a :class:`~mush.processes.ProcessPool` to move resources
+    that support the buffer protocol, such as :class:`bytes`,
+    :class:`bytearray`, :class:`memoryview`, :class:`array.array` and
+    :class:`numpy.ndarray`, into shared memory rather than pickling them.
+
+    Callables in the worker process will be passed a read-only
+    :class:`memoryview` of the resource, or a :class:`numpy.ndarray` if
+    the resource was one, that uses the shared memory directly.
+
+    A resource passed to several callables at the same time is only
+    copied into shared memory once. Each segment is unlinked once the
+    last callable using it has finished, or when :meth:`close` is called.
+
+    :param threshold:
+      Resources smaller than this number of bytes are pickled as usual.
+    """
+
+    def __init__(self, threshold=64*1024):
+        self.threshold = threshold
+        #: A mapping of the :func:`id` of each resource in shared memory
+        #: to a list of the resource, its segment, its handle and the
+        #: number of callables using it.
+        self.segments = {}
+        self.lock = Lock()
+
+    def _view(self, obj):
+        if isinstance(obj, (SharedBuffer, str)):
+            return None
+        try:
+            view = memoryview(obj)
+        except TypeError:
+            return None
+        if view.nbytes < self.threshold or not view.c_contiguous:
+            return None
+        return view
+
+    def export(self, obj):
+        """
+        Return a :class:`SharedBuffer` handle for the supplied resource if
+        it should be moved using shared memory, or ``None`` otherwise.
+        """
+        view = self._view(obj)
+        if view is None:
+            return None
+        with self.lock:
+            entry = self.segments.get(id(obj))
+            if entry is None:
+                segment = shared_memory.SharedMemory(
+                    create=True, size=max(view.nbytes, 1)
+                )
+                segment.buf[:view.nbytes] = view.cast('B')
+                dtype = None
+                if numpy is not None and isinstance(obj, numpy.ndarray):
+                    dtype = obj.dtype.str
+                handle = SharedBuffer(segment.name, view.nbytes,
+                                      view.format, view.shape, dtype)
+                entry = self.segments[id(obj)] = [obj, segment, handle, 0]
+            entry[3] += 1
+            return entry[2]
+
+    def release(self, handle):
+        """
+        Indicate that a callable has finished with the resource for the
+        supplied handle, unlinking its segment if no other callables
+        are using it.
+        """
+        with self.lock:
+            for key, entry in self.segments.items():
+                if entry[2] is handle:
+                    entry[3] -= 1
+                    if not entry[3]:
+                        del self.segments[key]
+                        self._unlink(entry[1])
+                    return
+
+    def prepare(self, args, kw):
+        """
+        Replace resources in the supplied `args` and `kw` with handles
+        where they should be moved using shared memory, returning the new
+        `args` and `kw` along with a list of the handles used.
+        """
+        handles = []
+        def replace(value):
+            handle = self.export(value)
+            if handle is None:
+                return value
+            handles.append(handle)
+            return handle
+        args = tuple(replace(a) for a in args)
+        kw = dict((k, replace(v)) for k, v in kw.items())
+        return args, kw, handles
+
+    #: The function used to call a callable in a worker process.
+    call = staticmethod(call_shared)
+
+    @staticmethod
+    def _unlink(segment):
+        segment.close()
+        segment.unlink()
+
+    def close(self):
+        "Unlink all shared memory segments created by this transport."
+        with self.lock:
+            segments, self.segments = self.segments, {}
+        for entry in segments.values():
+            self._unlink(entry[1])
@@ -0,0 +1,173 @@
+"""
+A :class:`~mush.Hook` for collecting the number of times each callable
+in a :class:`~mush.Runner` is called and how long those calls take.
+"""
+from collections import Counter
+from math import ceil
+from random import Random
+from threading import Lock
+
+from . import Hook
+
+
+def name(obj):
+    "Return a short name for the supplied callable."
+    for attr in '__qualname__', '__name__':
+        value = getattr(obj, attr, None)
+        if isinstance(value, str):
+            return value
+    return repr(obj)
+
+
+class CallableStats(object):
+    """
+    The statistics collected for one callable.
+
+    To keep memory use bounded over any number of calls, the
+    percentiles are worked out from a random sample of at most `size`
+    of the times taken.
+    """
+
+    def __init__(self, obj, size, random):
+        #: The callable these statistics are for.
+        self.obj = obj
+        #: The number of times the callable was called.
+        self.count = 0
+        #: The number of times the callable raised an exception.
+        self.errors = 0
+        #: The total number of seconds taken by all calls.
+        self.total = 0.0
+        #: The longest a single call took, in seconds.
+        self.max = 0.0
+        #: The number of times each type was returned by the callable.
+        self.results = Counter()
+        self.samples = []
+        self.size = size
+        self.random = random
+
+    def record(self, elapsed, result_type=None):
+        "Record a call that took the supplied number of seconds."
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        if result_type is not None:
+            self.results[result_type] += 1
+        if len(self.samples) < self.size:
+            self.samples.append(elapsed)
+        else:
+            position = self.random.randrange(self.count)
+            if position < self.size:
+                self.samples[position] = elapsed
+
+    def percentile(self, percent):
+        """
+        Return the number of seconds that the supplied percentage of
+        calls took no longer than, or ``None`` if there have been no
+        calls.
+        """
+        if not self.samples:
+            return None
+        samples = sorted(self.samples)
+        position = int(ceil(percent / 100.0 * len(samples))) - 1
+        return samples[max(position, 0)]
+
+    @property
+    def mean(self):
+        "The mean number of seconds taken by a call."
+        if self.count:
+            return self.total / self.count
+
+    @property
+    def p50(self):
+        return self.percentile(50)
+
+    @property
+    def p95(self):
+        return self.percentile(95)
+
+    @property
+    def p99(self):
+        return self.percentile(99)
+
+    def __repr__(self):
+        return '<CallableStats %s: %i calls>' % (name(self.obj), self.count)
+
+
+class Stats(Hook):
+    """
+    A :class:`~mush.Hook` that collects :class:`CallableStats` for each
+    callable in the runners it is added to, across every call of those
+    runners. It is safe to use with runners called from several
+    threads or with an executor.
+
+    :param size:
+      The maximum number of times to keep for each callable when
+      working out percentiles.
+    :param seed:
+      An optional seed for the random sampling of times.
+    """
+
+    def __init__(self, size=1000, seed=None):
+        self.size = size
+        self.random = Random(seed)
+        #: A mapping of callables to their :class:`CallableStats`.
+        self.callables = {}
+        #: The number of times runners have been called.
+        self.runs = 0
+        self.lock = Lock()
+
+    def _record(self, step, elapsed, result_type=None, error=False):
+        with self.lock:
+            stats = self.callables.get(step.obj)
+            if stats is None:
+                stats = self.callables[step.obj] = CallableStats(
+                    step.obj, self.size, self.random
+                )
+            stats.record(elapsed, result_type)
+            if error:
+                stats.errors += 1
+
+    def start(self, context):
+        with self.lock:
+            self.runs += 1
+
+    def after(self, context, step, result, call):
+        self._record(step, call.elapsed, type(result))
+
+    def error(self, context, step, exception, call):
+        self._record(step, call.elapsed, error=True)
+
+    def reset(self):
+        "Discard all the statistics collected so far."
+        with self.lock:
+            self.callables = {}
+            self.runs = 0
+
+    def report(self):
+        """
+        Return a textual table of the statistics collected so far,
+        with the callables that have taken the most time in total first
+        and times shown in milliseconds.
+        """
+        rows = [('callable', 'count', 'errors', 'total',
+                 'p50', 'p95', 'p99', 'max')]
+        with self.lock:
+            callables = sorted(self.callables.values(),
+                               key=lambda s: s.total, reverse=True)
+            for stats in callables:
+                rows.append((name(stats.obj), str(stats.count),
+                             str(stats.errors)) + tuple(
+                    '%.3f' % (value * 1000) for value in (
+                        stats.total, stats.p50, stats.p95, stats.p99,
+                        stats.max
+                    )))
+        widths = [max(len(row[i]) for row in rows)
+                  for i in range(len(rows[0]))]
+        lines = []
+        for row in rows:
+            lines.append('  '.join(
+                [row[0].ljust(widths[0])] +
+                [value.rjust(width)
+                 for value, width in zip(row[1:], widths[1:])]
+            ).rstrip())
+        return '\n'.join(lines)
@@ -0,0 +1,279 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Barrier
+from unittest import TestCase
+
+from mock import Mock, call
+from testfixtures import ShouldRaise, compare
+
+from mush import Context, requires, returns, after, ignore, scope, lazy
+from mush.asynchronous import AsyncRunner
+from mush.processes import in_process
+
+
+class T1(object): pass
+class T2(object): pass
+
+
+def run(runner, **kw):
+    return asyncio.run(runner(**kw))
+
+
+class AsyncRunnerTests(TestCase):
+
+    def test_coroutines(self):
+        m = Mock()
+        async def job1():
+            await asyncio.sleep(0)
+            m.job1()
+            return T1()
+        @requires(T1)
+        def job2(obj):
+            m.job2(type(obj))
+            return T2()
+        @requires(T2)
+        async def job3(obj):
+            m.job3(type(obj))
+        run(AsyncRunner(job1, job2, job3))
+        compare([call.job1(), call.job2(T1), call.job3(T2)], m.mock_calls)
+
+    def test_returns_awaitable(self):
+        m = Mock()
+        async def make():
+            return T1()
+        runner = AsyncRunner(lambda: make())
+        runner.add(m.job, T1)
+        run(runner)
+        compare(1, len(m.job.mock_calls))
+
+    def test_independent_concurrent(self):
+        # these would deadlock if awaited one after another
+        events = {}
+        async def job1():
+            events[1].set()
+            await asyncio.wait_for(events[2].wait(), 5)
+            return T1()
+        async def job2():
+            events[2].set()
+            await asyncio.wait_for(events[1].wait(), 5)
+            return T2()
+        m = Mock()
+        runner = AsyncRunner(job1, job2)
+        runner.add(m.job3, T1, T2)
+        async def main():
+            events[1] = asyncio.Event()
+            events[2] = asyncio.Event()
+            await runner()
+        asyncio.run(main())
+        compare(1, len(m.job3.mock_calls))
+
+    def test_executor(self):
+        # these would deadlock if called in the event loop
+        barrier = Barrier(2, timeout=5)
+        def job1():
+            barrier.wait()
+            return T1()
+        def job2():
+            barrier.wait()
+            return T2()
+        m = Mock()
+        runner = AsyncRunner(job1, job2)
+        runner.add(m.job3, T1, T2)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            run(runner, executor=executor)
+        compare(1, len(m.job3.mock_calls))
+
+    def test_in_process_does_not_block(self):
+        submitted = []
+        class Pool(object):
+            def submit(self, obj, *args, **kw):
+                future = Future()
+                submitted.append((future, obj))
+                return future
+            def __call__(self, obj, *args, **kw):
+                raise AssertionError('event loop blocked')  # pragma: no cover
+        @in_process(Pool())
+        def work():
+            return T1()
+        async def finish():
+            # the pool's result can only be set if the loop is running:
+            while not submitted:
+                await asyncio.sleep(0)
+            future, obj = submitted[0]
+            future.set_result(obj())
+        m = Mock()
+        runner = AsyncRunner(work, finish)
+        runner.add(m.job, T1)
+        run(runner)
+        compare(1, len(m.job.mock_calls))
+
+    def test_async_context_manager(self):
+        m = Mock()
+        class CM(object):
+            async def __aenter__(self):
+                m.enter()
+                return T1()
+            async def __aexit__(self, type, obj, tb):
+                m.exit(type)
+        @requires(CM, T1)
+        def job(cm, t1):
+            m.job(type(cm), type(t1))
+        runner = AsyncRunner(CM, job)
+        runner.add(m.after, after(T1))
+        run(runner)
+        compare([call.enter(), call.job(CM, T1), call.after(),
+                 call.exit(None)], m.mock_calls)
+
+    def test_context_manager_wraps_later_callables(self):
+        calls = []
+        class Transaction(object):
+            async def __aenter__(self):
+                await asyncio.sleep(0.01)
+                calls.append('begin')
+            async def __aexit__(self, type, obj, tb):
+                calls.append('commit')
+        async def write():
+            calls.append('write')
+        run(AsyncRunner(Transaction, write))
+        compare(calls, expected=['begin', 'write', 'commit'])
+
+    def test_nested_context_managers(self):
+        m = Mock()
+        class Async(object):
+            async def __aenter__(self):
+                m.enter_async()
+            async def __aexit__(self, type, obj, tb):
+                m.exit_async(type)
+        class Sync(object):
+            def __enter__(self):
+                m.enter_sync()
+            def __exit__(self, type, obj, tb):
+                m.exit_sync(type)
+        e = Exception('boom')
+        @requires(Async, Sync)
+        def bad(a, s):
+            raise e
+        runner = AsyncRunner(Async)
+        runner.add(Sync, ignore(Async))
+        runner.add(bad)
+        with ShouldRaise(e):
+            run(runner)
+        compare([call.enter_async(), call.enter_sync(),
+                 call.exit_sync(Exception), call.exit_async(Exception)],
+                m.mock_calls)
+
+    def test_suppressed_exception_continues(self):
+        m = Mock()
+        class CM(object):
+            async def __aenter__(self):
+                pass
+            async def __aexit__(self, type, obj, tb):
+                m.exit(type)
+                return True
+        @requires(CM)
+        async def bad(obj):
+            m.bad()
+            raise Exception()
+        runner = AsyncRunner(CM, bad)
+        runner.add(m.job, after(CM))
+        run(runner)
+        compare([call.bad(), call.exit(Exception), call.job()], m.mock_calls)
+
+    def test_exit_raises(self):
+        e1 = Exception('one')
+        e2 = Exception('two')
+        class CM(object):
+            async def __aenter__(self):
+                pass
+            async def __aexit__(self, type, obj, tb):
+                raise e2
+        @requires(CM)
+        def bad(obj):
+            raise e1
+        with ShouldRaise(e2) as s:
+            run(AsyncRunner(CM, bad))
+        self.assertTrue(s.raised.__context__ is e1)
+
+    def test_fail_fast(self):
+        m = Mock()
+        e = Exception('boom')
+        async def bad():
+            raise e
+        @requires(after(T1))
+        def not_called():
+            m.not_called() # pragma: no cover
+        with ShouldRaise(e):
+            run(AsyncRunner(bad, T1, not_called))
+        compare([], m.mock_calls)
+
+    def test_missing(self):
+        @requires(T1)
+        def job(obj):
+            pass # pragma: no cover
+        with ShouldRaise(KeyError):
+            run(AsyncRunner(job))
+
+    def test_returns(self):
+        m = Mock()
+        @returns('answer')
+        async def job():
+            return 42
+        runner = AsyncRunner(job)
+        runner.add(m.job, 'answer')
+        run(runner)
+        compare([call.job(42)], m.mock_calls)
+
+    def test_scope(self):
+        m = Mock()
+        @scope('runner')
+        async def make():
+            m.make()
+            return T1()
+        objs = []
+        runner = AsyncRunner(make)
+        runner.add(objs.append, T1)
+        run(runner)
+        run(runner)
+        compare([call.make()], m.mock_calls)
+        self.assertTrue(objs[0] is objs[1])
+
+    def test_lazy(self):
+        m = Mock()
+        @lazy()
+        @returns(T1)
+        async def make1():
+            m.make1()
+            return T1()
+        @lazy()
+        @requires(T1)
+        @returns(T2)
+        async def make2(obj):
+            m.make2()
+            return T2()
+        runner = AsyncRunner(make1, make2)
+        runner.add(m.job, T2)
+        run(runner)
+        compare(['make1', 'make2', 'job'], [c[0] for c in m.mock_calls])
+
+    def test_release(self):
+        m = Mock()
+        class CM(object):
+            async def __aenter__(self):
+                m.enter()
+                return 'resource'
+            async def __aexit__(self, type, obj, tb):
+                m.exit()
+        runner = AsyncRunner(CM)
+        runner.release = True
+        runner.add_returning(m.use, T1, str, after(CM))
+        runner.add(m.later, after(T1))
+        context = Context()
+        run(runner, context=context)
+        compare([call.enter(), call.use('resource'), call.exit(),
+                 call.later()], m.mock_calls)
+        compare(list(context.keys()), expected=[type(m.later.return_value)])
+
+    def test_clone(self):
+        runner = AsyncRunner(lambda: None)
+        self.assertTrue(isinstance(runner.clone(), AsyncRunner))
+        self.assertTrue(isinstance(runner + runner, AsyncRunner))
@@ -0,0 +1,224 @@
+import os
+from pathlib import Path
+from subprocess import check_output
+import sys
+from threading import Lock
+from unittest import TestCase, skipIf
+
+from mock import Mock, call
+from testfixtures import TempDirectory, compare
+
+import mush
+from mush import CacheInfo, Context, Runner, requires, returns
+from mush.cache import DiskCache, fingerprint, on_disk
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+
+class Config(dict):
+    pass
+
+
+class Report(str):
+    pass
+
+
+class DiskCacheTests(TestCase):
+
+    def setUp(self):
+        self.dir = TempDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.m = Mock()
+
+    def runner(self, obj, *args, **kw):
+        """
+        Return a runner as a script would build it, with its own
+        DiskCache, so that nothing is shared between calls.
+        """
+        cache = DiskCache(self.dir.getpath('cache'), **kw)
+        runner = Runner()
+        runner.add(on_disk(cache)(obj), *args)
+        return runner
+
+    def context(self, path):
+        context = Context()
+        context.add(Path(path), Path)
+        return context
+
+    def make_report(self):
+        m = self.m
+        @returns(Report)
+        @requires(Config)
+        def report(config):
+            m.report(config['colour'])
+            return Report(config['colour'] * 2)
+        return report
+
+    def test_skipped_when_unchanged(self):
+        report = self.make_report()
+        results = []
+        for colour in 'red', 'red', 'blue':
+            runner = self.runner(report)
+            runner.add(results.append, Report)
+            runner(Context(Config(colour=colour)))
+        compare([call.report('red'), call.report('blue')], self.m.mock_calls)
+        compare(['redred', 'redred', 'blueblue'], results)
+        self.assertTrue(type(results[1]) is Report)
+
+    def test_cache_info_and_invalidate(self):
+        report = self.make_report()
+        runner = self.runner(report)
+        runner(Context(Config(colour='red')))
+        runner(Context(Config(colour='red')))
+        compare(runner.cache_info(), expected={
+            report: CacheInfo(hits=1, misses=1, max_size=None, size=1)
+        })
+        runner.invalidate()
+        runner(Context(Config(colour='red')))
+        compare([call.report('red')] * 2, self.m.mock_calls)
+
+    def test_version(self):
+        m = self.m
+        cache = DiskCache(self.dir.getpath('cache'))
+        def job():
+            m.job()
+        for version in 1, 1, 2:
+            Runner(on_disk(cache, version=version)(job))()
+        compare([call.job(), call.job()], m.mock_calls)
+
+    def test_fingerprint(self):
+        def job1(): return 1
+        def job2(): return 2
+        self.assertFalse(fingerprint(job1) == fingerprint(job2))
+        self.assertFalse(fingerprint(job1) == fingerprint(job1, version=2))
+        compare(fingerprint(job1), expected=fingerprint(job1))
+        self.assertTrue(fingerprint(job1).startswith(
+            'mush.tests.test_cache.DiskCacheTests.test_fingerprint.'
+            '<locals>.job1-'
+        ))
+
+    def test_paths(self):
+        m = self.m
+        path = self.dir.write('input.txt', b'one')
+        def read(path):
+            m.read()
+            return path.read_bytes()
+        for _ in range(2):
+            self.runner(read, Path)(self.context(path))
+        compare([call.read()], m.mock_calls)
+        self.dir.write('input.txt', b'three')
+        self.runner(read, Path)(self.context(path))
+        compare([call.read()] * 2, m.mock_calls)
+
+    def test_paths_hashed(self):
+        m = self.m
+        path = self.dir.write('input.txt', b'one')
+        def read(path):
+            m.read()
+        for _ in range(2):
+            self.runner(read, Path, hash_files=True)(
+                self.context(path)
+            )
+            os.utime(path, (0, 0))
+        compare([call.read()], m.mock_calls)
+
+    def test_bytes(self):
+        m = self.m
+        results = []
+        def load():
+            m.load()
+            return b'x' * 1000
+        for _ in range(2):
+            runner = self.runner(load)
+            runner.add(results.append, bytes)
+            runner()
+        compare([call.load()], m.mock_calls)
+        compare(results, expected=[b'x' * 1000] * 2)
+
+    def test_buffer_resources(self):
+        m = self.m
+        def use(data):
+            m.use()
+        for data in b'abc', b'abc', bytearray(b'abc'):
+            self.runner(use, type(data))(Context(data))
+        compare([call.use(), call.use()], m.mock_calls)
+
+    @skipIf(numpy is None, 'numpy is not installed')
+    def test_numpy(self):  # pragma: no cover
+        m = self.m
+        results = []
+        def load():
+            m.load()
+            return numpy.arange(10)
+        for _ in range(2):
+            runner = self.runner(load)
+            runner.add(results.append, numpy.ndarray)
+            runner()
+        compare([call.load()], m.mock_calls)
+        self.assertTrue(type(results[1]) is numpy.ndarray)
+        self.assertFalse(results[1].flags.writeable)
+        compare(list(results[1]), expected=list(range(10)))
+
+    def test_key_same_in_every_process(self):
+        values = ("({'red', 'green', 'blue', 'cyan'}, "
+                  "{'colours': frozenset(['x', 'y', 'z']), 'size': 1.5})")
+        script = ('from mush.cache import DiskCache\n'
+                  'print(DiskCache(None).key(%s, {}))' % values)
+        root = os.path.dirname(os.path.dirname(mush.__file__))
+        keys = set()
+        for seed in '1', '2', '3':
+            keys.add(check_output(
+                [sys.executable, '-c', script],
+                env=dict(os.environ, PYTHONHASHSEED=seed, PYTHONPATH=root)
+            ).decode('ascii').strip())
+        compare(keys, expected={DiskCache(None).key(eval(values), {})})
+
+    def test_key_fields_delimited(self):
+        cache = DiskCache(None)
+        keys = [
+            cache.key(('ab', 'c'), {}),
+            cache.key(('a', 'bc'), {}),
+            cache.key((), dict(a='bc')),
+            cache.key((), dict(ab='c')),
+            cache.key((['a'], 'b'), {}),
+            cache.key((['a', 'b'], ), {}),
+            cache.key(({'a': 'b'}, ), {}),
+            cache.key(({'ab': ''}, ), {}),
+        ]
+        compare(len(set(keys)), expected=len(keys))
+
+    def test_unpicklable_resources(self):
+        m = self.m
+        def use(lock):
+            m.use()
+        lock = Lock()
+        for _ in range(2):
+            self.runner(use, type(lock))(Context(lock))
+        compare([call.use(), call.use()], m.mock_calls)
+
+    def test_unpicklable_result(self):
+        m = self.m
+        def make():
+            m.make()
+            return lambda: None
+        for _ in range(2):
+            self.runner(make)()
+        compare([call.make(), call.make()], m.mock_calls)
+        stored, = os.listdir(self.dir.getpath('cache'))
+        compare(os.listdir(self.dir.getpath(('cache', stored))), expected=[])
+
+    def test_context_managers_not_kept(self):
+        m = self.m
+        class Managed(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                pass
+        def make():
+            return Managed()
+        for _ in range(2):
+            self.runner(make)()
+        compare([call.enter(), call.enter()], m.mock_calls)
@@ -0,0 +1,240 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from mock import Mock, call
+from testfixtures import ShouldRaise, TempDirectory, compare
+
+from mush import Context, ResumedPlan, Runner, lazy, requires, returns
+from mush.checkpoints import Checkpoint, Checkpointer
+
+
+class Config(dict):
+    pass
+
+
+class Data(list):
+    pass
+
+
+class Result(str):
+    pass
+
+
+class TheError(Exception):
+    pass
+
+
+class Transaction(object):
+
+    m = None
+
+    def __init__(self, config):
+        self.name = config['db']
+
+    def __enter__(self):
+        self.m.enter(self.name)
+        return self
+
+    def __exit__(self, type, obj, tb):
+        self.m.exit(self.name, type)
+
+
+class CheckpointTests(TestCase):
+
+    def setUp(self):
+        self.m = m = Mock()
+        self.fail = True
+
+        @returns(Config)
+        def configure():
+            m.configure()
+            return Config(db='main')
+
+        @requires(Config)
+        @returns(Data)
+        def load(config):
+            m.load()
+            return Data([1, 2, 3])
+
+        @requires(Data, Transaction)
+        @returns(Result)
+        def process(data, transaction):
+            m.process(transaction.name)
+            if self.fail:
+                raise TheError()
+            return Result(sum(data))
+
+        @requires(Result)
+        def save(result):
+            m.save(result)
+
+        self.load = load
+        self.runner = Runner(configure, load)
+        self.runner.add(Transaction, Config)
+        self.runner.extend(process, save)
+        Transaction.m = m
+
+    def test_resume(self):
+        checkpointer = Checkpointer(self.load)
+        self.runner.hooks.append(checkpointer)
+        with ShouldRaise(TheError):
+            self.runner()
+        checkpoint = checkpointer.checkpoint
+        compare(repr(checkpoint),
+                expected='<Checkpoint: 2 of 5 callables called>')
+        compare(checkpoint.managers, expected=())
+        compare(checkpoint.resources(), expected={
+            Config: Config(db='main'), Data: Data([1, 2, 3])
+        })
+
+        self.m.reset_mock()
+        self.fail = False
+        self.runner.resume(checkpoint)
+        compare([
+            call.enter('main'),
+            call.process('main'),
+            call.save('6'),
+            call.exit('main', None),
+        ], self.m.mock_calls)
+
+    def test_managers_reentered(self):
+        checkpointer = Checkpointer()
+        self.runner.hooks.append(checkpointer)
+        with ShouldRaise(TheError):
+            self.runner()
+        checkpoint = checkpointer.checkpoint
+        compare(checkpoint.index, expected=3)
+        compare(checkpoint.managers, expected=(2, ))
+        compare(sorted(t.__name__ for t in checkpoint.resources()),
+                expected=['Config', 'Data'])
+
+        self.m.reset_mock()
+        self.fail = False
+        self.runner.resume(checkpoint)
+        compare([
+            call.enter('main'),
+            call.process('main'),
+            call.save('6'),
+            call.exit('main', None),
+        ], self.m.mock_calls)
+
+    def test_checkpoint_during_resumed_run(self):
+        checkpointer = Checkpointer()
+        self.runner.hooks.append(checkpointer)
+        with ShouldRaise(TheError):
+            self.runner()
+        with ShouldRaise(TheError):
+            self.runner.resume(checkpointer.checkpoint)
+        checkpoint = checkpointer.checkpoint
+        compare(checkpoint.index, expected=3)
+        compare(checkpoint.managers, expected=(2, ))
+
+    def test_resume_without_hooks(self):
+        checkpoint = Checkpointer().take(
+            Context(Config(db='other'), Data([1])), 3, {}
+        )
+        self.fail = False
+        for generate in True, False:
+            runner = self.runner.clone()
+            runner.generate = generate
+            runner.resume(Checkpoint(5, 3, (2, ), checkpoint._resources))
+        compare([
+            call.enter('other'),
+            call.process('other'),
+            call.save('1'),
+            call.exit('other', None),
+        ] * 2, self.m.mock_calls)
+
+    def test_resume_with_executor(self):
+        checkpointer = Checkpointer()
+        self.runner.hooks.append(checkpointer)
+        with ShouldRaise(TheError):
+            self.runner()
+        self.m.reset_mock()
+        self.fail = False
+        with ThreadPoolExecutor(2) as executor:
+            self.runner.resume(checkpointer.checkpoint, executor)
+        compare([
+            call.enter('main'),
+            call.process('main'),
+            call.save('6'),
+            call.exit('main', None),
+        ], self.m.mock_calls)
+
+    def test_not_taken_with_executor(self):
+        checkpointer = Checkpointer()
+        self.runner.hooks.append(checkpointer)
+        self.fail = False
+        with ThreadPoolExecutor(2) as executor:
+            self.runner(executor=executor)
+        compare(checkpointer.checkpoint, expected=None)
+
+    def test_write_and_load(self):
+        with TempDirectory() as dir:
+            path = dir.getpath('run.checkpoint')
+            checkpointer = Checkpointer(self.load, path=path)
+            self.runner.hooks.append(checkpointer)
+            with ShouldRaise(TheError):
+                self.runner()
+            checkpoint = Checkpoint.load(path)
+        compare(checkpoint.index, expected=2)
+        compare(checkpoint.resources(),
+                expected=checkpointer.checkpoint.resources())
+
+    def test_unpicklable_resources(self):
+        class Unpicklable(object):
+            pass
+        def make():
+            return Unpicklable()
+        def fail(obj):
+            raise TheError()
+        runner = Runner(make)
+        runner.add(fail, Unpicklable)
+        checkpointer = Checkpointer()
+        runner.hooks.append(checkpointer)
+        with ShouldRaise(TheError):
+            runner()
+        compare(checkpointer.checkpoint.skipped, expected=(Unpicklable, ))
+        compare(checkpointer.checkpoint.resources(), expected={})
+
+    def test_lazy_manager_not_recorded(self):
+        m = self.m
+
+        @lazy()
+        class Database(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit()
+
+        @requires(Database)
+        @returns(Result)
+        def query(db):
+            m.query()
+            return Result('x')
+
+        @requires(Result)
+        def boom(result):
+            raise TheError()
+
+        runner = Runner(Database, query, boom)
+        checkpointer = Checkpointer()
+        runner.hooks.append(checkpointer)
+        with ShouldRaise(TheError):
+            runner()
+        checkpoint = checkpointer.checkpoint
+        compare(checkpoint.index, expected=1)
+        compare(checkpoint.managers, expected=())
+        compare(checkpoint.resources(), expected={Result: 'x'})
+
+    def test_wrong_runner(self):
+        checkpoint = Checkpoint(2, 1, (), ())
+        with ShouldRaise(ValueError(
+            'Checkpoint is for a runner with 2 callables, not 5'
+        )):
+            self.runner.resume(checkpoint)
+
+    def test_resumed_plan(self):
+        plan = ResumedPlan(self.runner.compile(), 3, [2])
+        compare(plan.steps, expected=self.runner.compile().steps)
+        compare(plan.managers, expected=(2, ))
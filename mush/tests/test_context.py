@@ -90,6 +90,35 @@ class TestContext(TestCase):
         context.add(obj, Type)
         self.assertTrue(context.get(Type) is obj)
         
+    def test_enter(self):
+        class Manager(object):
+            def __enter__(self):
+                return obj
+            def __exit__(self, type, obj, tb):
+                pass # pragma: nocover
+        obj = TheType()
+        manager = Manager()
+        context = Context()
+        context.enter(manager)
+        self.assertTrue(context.get(Manager) is manager)
+        self.assertTrue(context.get(TheType) is obj)
+        self.assertEqual(context.managers, [manager])
+
+    def test_enter_returns_self(self):
+        class Manager(object):
+            def __enter__(self):
+                return self
+        manager = Manager()
+        context = Context()
+        context.enter(manager)
+        self.assertEqual(dict(context), {Manager: manager})
+
     def test_get_nonetype(self):
         self.assertTrue(Context().get(type(None)) is None)
 
+
+    def test_seeded(self):
+        obj = TheType()
+        context = Context(obj, 'foo')
+        self.assertEqual(dict(context), {TheType: obj, str: 'foo'})
+        self.assertEqual(context.req_objs, [])
@@ -0,0 +1,188 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from testfixtures import ShouldRaise, compare
+
+from mush import (
+    Runner, Hook, GeneratedPlan, lazy, requires, returns, marker
+)
+from mush.asynchronous import AsyncRunner
+
+Out = marker('Out')
+
+
+class Recorder(Hook):
+
+    def __init__(self):
+        self.calls = []
+
+    def start(self, context):
+        self.calls.append('start')
+
+    def before(self, context, step, args, kw):
+        self.calls.append(('before', step.obj, args, kw))
+
+    def after(self, context, step, result, call):
+        self.calls.append(('after', step.obj, result))
+        assert call.elapsed >= 0
+        assert call.start is not None
+        assert call.thread is not None
+        assert call.process is not None
+
+    def error(self, context, step, exception, call):
+        self.calls.append(('error', step.obj, exception))
+        assert call.elapsed >= 0
+
+    def enter(self, context, manager):
+        self.calls.append(('enter', manager))
+
+    def exit(self, context, manager):
+        self.calls.append(('exit', manager))
+
+    def finish(self, context, exception):
+        self.calls.append(('finish', exception))
+
+
+def job1():
+    return 1
+
+
+@requires(int)
+@returns(Out)
+def job2(value):
+    return value + 1
+
+
+class HookTests(TestCase):
+
+    def setUp(self):
+        self.hook = Recorder()
+
+    def call(self, runner):
+        runner()
+
+    def test_calls(self):
+        runner = Runner(job1, job2)
+        runner.hooks.append(self.hook)
+        self.call(runner)
+        compare([
+            'start',
+            ('before', job1, [], {}),
+            ('after', job1, 1),
+            ('before', job2, [1], {}),
+            ('after', job2, 2),
+            ('finish', None),
+        ], self.hook.calls)
+
+    def test_run_for(self):
+        runner = Runner(job1, job2)
+        runner.add_returning(lambda: 'unrelated', marker('Unrelated'))
+        runner.hooks.append(self.hook)
+        compare(runner.run_for(Out), expected=2)
+        compare([
+            'start',
+            ('before', job1, [], {}),
+            ('after', job1, 1),
+            ('before', job2, [1], {}),
+            ('after', job2, 2),
+            ('finish', None),
+        ], self.hook.calls)
+
+    def test_error(self):
+        e = Exception('boom')
+        def bad():
+            raise e
+        runner = Runner(bad)
+        runner.hooks.append(self.hook)
+        with ShouldRaise(e):
+            self.call(runner)
+        compare([
+            'start',
+            ('before', bad, [], {}),
+            ('error', bad, e),
+            ('finish', e),
+        ], self.hook.calls)
+
+    def test_context_managers(self):
+        class CM(object):
+            def __enter__(self):
+                return self
+            def __exit__(self, type, obj, tb):
+                pass
+        manager = CM()
+        def make():
+            return manager
+        runner = Runner(make)
+        runner.hooks.append(self.hook)
+        self.call(runner)
+        compare([
+            'start',
+            ('before', make, [], {}),
+            ('after', make, manager),
+            ('enter', manager),
+            ('exit', manager),
+            ('finish', None),
+        ], self.hook.calls)
+
+    def test_lazy_provider(self):
+        @lazy(int)
+        def provide():
+            return 1
+        runner = Runner(provide, job2)
+        runner.hooks.append(self.hook)
+        self.call(runner)
+        compare([
+            'start',
+            ('before', provide, [], {}),
+            ('after', provide, 1),
+            ('before', job2, [1], {}),
+            ('after', job2, 2),
+            ('finish', None),
+        ], self.hook.calls)
+
+    def test_base_does_nothing(self):
+        runner = Runner(job1, job2)
+        runner.hooks.append(Hook())
+        self.call(runner)
+
+
+class ExecutorHookTests(HookTests):
+
+    def call(self, runner):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            runner(executor=executor)
+
+
+class AsyncHookTests(HookTests):
+
+    def call(self, runner):
+        async_runner = AsyncRunner()
+        async_runner._merge(runner)
+        asyncio.run(async_runner())
+
+
+class CompileTests(TestCase):
+
+    def test_no_hooks_generated(self):
+        runner = Runner(job1)
+        runner.generate = True
+        self.assertTrue(isinstance(runner.compile(), GeneratedPlan))
+
+    def test_hooks_interpreted(self):
+        runner = Runner(job1)
+        runner.generate = True
+        runner.hooks.append(Hook())
+        plan = runner.compile()
+        self.assertFalse(isinstance(plan, GeneratedPlan))
+        compare(plan.hooks, expected=tuple(runner.hooks))
+        self.assertTrue(runner.compile() is plan)
+        runner.hooks[:] = []
+        self.assertTrue(isinstance(runner.compile(), GeneratedPlan))
+
+    def test_clone_keeps_hooks(self):
+        hook = Hook()
+        runner = Runner(job1)
+        runner.hooks.append(hook)
+        compare(runner.clone().hooks, expected=[hook])
+        compare((runner + runner).hooks, expected=[hook])
@@ -0,0 +1,162 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from mock import ANY, Mock, call
+from testfixtures import ShouldRaise, compare
+
+from mush import (
+    Runner, Context, lazy, requires, returns, attr, after, marker
+)
+
+
+class Config(object):
+    value = 'config'
+
+
+class Database(object):
+    pass
+
+
+DB = marker('DB')
+Report = marker('Report')
+
+
+class LazyTests(TestCase):
+
+    def setUp(self):
+        self.m = m = Mock()
+
+        @lazy()
+        @requires(Config)
+        @returns(Database)
+        def connect(config):
+            m.connect(config.value)
+            return Database()
+
+        self.connect = connect
+
+    def test_not_needed(self):
+        runner = Runner(Config, self.connect, self.m.job)
+        runner()
+        compare([call.job()], self.m.mock_calls)
+
+    def test_needed(self):
+        runner = Runner(self.connect, Config)
+        runner.add(self.m.job1)
+        runner.add(self.m.job2, Database)
+        runner()
+        compare([call.job1(), call.connect('config'), call.job2(ANY)],
+                self.m.mock_calls)
+
+    def test_needed_twice(self):
+        runner = Runner(Config, self.connect)
+        runner.add(self.m.job1, Database)
+        runner.add(self.m.job2, Database)
+        runner()
+        compare(['connect', 'job1', 'job2'],
+                [c[0] for c in self.m.mock_calls])
+
+    def test_needed_with_how(self):
+        @lazy()
+        class Settings(object):
+            value = 'settings'
+        runner = Runner(Settings)
+        runner.add(self.m.job, attr(Settings, 'value'))
+        runner()
+        compare([call.job('settings')], self.m.mock_calls)
+
+    def test_explicit_type(self):
+        runner = Runner()
+        runner.add(lazy(DB)(self.m.make))
+        runner.add(self.m.job, DB)
+        runner()
+        compare([call.make(), call.job(self.m.make.return_value)],
+                self.m.mock_calls)
+
+    def test_add_returning(self):
+        runner = Runner()
+        runner.add_returning(lazy()(self.m.make), DB)
+        runner.add(self.m.job, DB)
+        runner()
+        compare([call.make(), call.job(self.m.make.return_value)],
+                self.m.mock_calls)
+
+    def test_no_type(self):
+        def provider():
+            pass # pragma: no cover
+        runner = Runner(lazy()(provider))
+        with ShouldRaise(TypeError(
+            'No type specified for lazy provider %r' % provider
+        )):
+            runner()
+
+    def test_missing_requirement(self):
+        runner = Runner(self.connect)
+        runner.add(self.m.job, Database)
+        with ShouldRaise(KeyError):
+            runner()
+
+    def test_seeded(self):
+        runner = Runner(self.connect)
+        runner.add(self.m.job, Database)
+        database = Database()
+        runner(Context(database))
+        compare([call.job(database)], self.m.mock_calls)
+
+    def test_context_manager(self):
+        m = self.m
+        @lazy()
+        class Transaction(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit()
+        runner = Runner(Transaction)
+        runner.add(m.job1)
+        runner.add(m.job2, Transaction)
+        runner.add(m.job3, after(Transaction))
+        runner()
+        compare(['job1', 'enter', 'job2', 'job3', 'exit'],
+                [c[0] for c in m.mock_calls])
+
+    def test_explicit_type_context_manager(self):
+        m = self.m
+        class Connection(object):
+            def __enter__(self):
+                m.enter()
+                return self
+            def __exit__(self, type, obj, tb):
+                m.exit()
+        @lazy(Connection)
+        def connect():
+            m.connect()
+            return Connection()
+        runner = Runner(connect)
+        runner.add(m.job1)
+        runner.add(m.use, Connection)
+        runner()
+        compare(['job1', 'connect', 'enter', 'use', 'exit'],
+                [c[0] for c in m.mock_calls])
+
+    def test_executor(self):
+        runner = Runner(Config, self.connect)
+        runner.add(self.m.job, Database)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            runner(executor=executor)
+        compare(['connect', 'job'], [c[0] for c in self.m.mock_calls])
+
+    def test_run_for(self):
+        @returns(Config)
+        def load():
+            self.m.load()
+            return Config()
+        @requires(Database)
+        @returns(Report)
+        def report(database):
+            self.m.report()
+            return 'report'
+        runner = Runner(load, self.connect, report)
+        runner.add(self.m.unrelated)
+        compare(runner.run_for(Report), expected='report')
+        compare(['load', 'connect', 'report'],
+                [c[0] for c in self.m.mock_calls])
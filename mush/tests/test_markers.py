@@ -1,3 +1,4 @@
+from pickle import dumps, loads
 from unittest import TestCase
 from testfixtures import compare
 from mush import marker
@@ -12,3 +13,7 @@ class TestMarkers(TestCase):
         m1 = marker('SetupComplete')
         m2 = marker('SetupComplete')
         self.assertTrue(m1 is m2)
+
+    def test_pickle(self):
+        m = marker('SetupComplete')
+        self.assertTrue(loads(dumps(m)) is m)
@@ -0,0 +1,226 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier, Lock
+from time import sleep
+from unittest import TestCase
+
+from mock import Mock, call
+from testfixtures import ShouldRaise, compare
+
+from mush import Runner, requires, first, last, after, attr, nothing
+
+
+class T1(object): pass
+class T2(object): pass
+
+
+class ParallelTests(TestCase):
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.calls = []
+        self.lock = Lock()
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def record(self, name):
+        with self.lock:
+            self.calls.append(name)
+
+    def test_independent_overlap(self):
+        # these would deadlock if called one after another
+        barrier = Barrier(2, timeout=5)
+        def job1():
+            barrier.wait()
+            return T1()
+        def job2():
+            barrier.wait()
+            return T2()
+        m = Mock()
+        runner = Runner(job1, job2)
+        runner.add(m.job3, T1, T2)
+        runner(executor=self.executor)
+        compare(1, len(m.job3.mock_calls))
+
+    def test_produced_before_required(self):
+        t1 = T1()
+        def make():
+            sleep(0.05)
+            self.record('make')
+            return t1
+        @requires(T1)
+        def use(obj):
+            self.record(obj)
+        runner = Runner(make, use)
+        runner(executor=self.executor)
+        compare(['make', t1], self.calls)
+
+    def test_periods(self):
+        def make():
+            return T1()
+        def job(name, delay):
+            def job(obj=None):
+                sleep(delay)
+                self.record(name)
+            return job
+        runner = Runner(make)
+        runner.add(job('last', 0), last(T1))
+        runner.add(job('normal', 0.05), T1)
+        runner.add(job('first', 0.1), first(T1))
+        runner.add(job('after', 0), after(T1))
+        runner(executor=self.executor)
+        compare(['first', 'normal', 'last', 'after'], self.calls)
+
+    def test_first_and_last_without_type(self):
+        def job(name, delay):
+            def job():
+                sleep(delay)
+                self.record(name)
+            return job
+        runner = Runner()
+        runner.add(job('last', 0), last())
+        runner.add(job('normal', 0.05))
+        runner.add(job('first', 0.05), first())
+        runner(executor=self.executor)
+        compare(['first', 'normal', 'last'], self.calls)
+
+    def test_dependencies(self):
+        def job(*args): pass
+        runner = Runner()
+        runner.add(job)
+        runner.add(job, first(T1))
+        runner.add(job, T1)
+        runner.add(job, T1, T2)
+        runner.add(job, last(T1))
+        runner.add(job, after(T2))
+        runner.add(job, last())
+        runner.ordered = False
+        # steps are in the order they will be called, which puts the
+        # last() one second:
+        compare(((), (0, ), (1, ), (1, 2), (1, 2, 3), (1, 2, 4), (1, 5)),
+                runner.compile().dependencies)
+
+    def test_dependencies_ordered(self):
+        def job(*args): pass
+        runner = Runner()
+        runner.add(job)
+        runner.add(job, T1)
+        runner.add(job, T1)
+        runner.add(job, T2)
+        runner.add(job, T1, T2)
+        # the last step also has to wait for the first one using T1,
+        # but only through the second one:
+        compare(((), (), (1, ), (), (2, 3)),
+                runner.compile().dependencies)
+        runner.ordered = False
+        compare(((), (), (), (), ()), runner.compile().dependencies)
+
+    def test_ordered_shared_resource(self):
+        def make():
+            return T1()
+        def job(name, delay):
+            def job(obj):
+                sleep(delay)
+                self.record(name)
+            return job
+        runner = Runner(make)
+        runner.add(job('one', 0.1), T1)
+        runner.add(job('two', 0), T1)
+        runner.clone()(executor=self.executor)
+        compare(['one', 'two'], self.calls)
+
+    def test_unordered_kept(self):
+        unordered = Runner()
+        unordered.ordered = False
+        self.assertFalse(unordered.clone().ordered)
+        self.assertFalse((unordered + Runner()).ordered)
+        self.assertFalse((Runner() + unordered).ordered)
+        self.assertFalse(Runner(unordered).ordered)
+        self.assertTrue((Runner() + Runner()).ordered)
+
+    def test_fail_fast(self):
+        m = Mock()
+        e = Exception('boom')
+        def bad():
+            raise e
+        @requires(after(T1))
+        def not_called():
+            m.not_called() # pragma: no cover
+        runner = Runner(bad, T1, not_called)
+        with ShouldRaise(e):
+            runner(executor=self.executor)
+        compare([], m.mock_calls)
+
+    def test_missing(self):
+        @requires(T1)
+        def job(obj):
+            pass # pragma: no cover
+        with ShouldRaise(KeyError):
+            Runner(job)(executor=self.executor)
+
+    def test_marker(self):
+        m = Mock()
+        runner = Runner(lambda: {T1: nothing})
+        runner.add(m.job, T1)
+        runner(executor=self.executor)
+        compare([call.job()], m.mock_calls)
+
+    def test_context_manager(self):
+        m = Mock()
+        class CM(object):
+            value = 'value'
+            def __enter__(self):
+                m.enter()
+                return self
+            def __exit__(self, type, obj, tb):
+                m.exit(type)
+        runner = Runner(CM)
+        runner.add(m.job, attr(CM, 'value'))
+        runner(executor=self.executor)
+        compare([call.enter(), call.job('value'), call.exit(None)],
+                m.mock_calls)
+
+    def test_context_manager_wraps_later_callables(self):
+        class Transaction(object):
+            def __enter__(s):
+                sleep(0.05)
+                self.record('begin')
+            def __exit__(s, type, obj, tb):
+                self.record('commit')
+        def write():
+            self.record('write')
+        Runner(Transaction, write)(executor=self.executor)
+        compare(['begin', 'write', 'commit'], self.calls)
+
+    def test_context_manager_exception(self):
+        m = Mock()
+        e = Exception('boom')
+        class CM(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit(type, obj)
+        @requires(CM)
+        def job(obj):
+            raise e
+        runner = Runner(CM, job)
+        with ShouldRaise(e):
+            runner(executor=self.executor)
+        compare([call.enter(), call.exit(Exception, e)], m.mock_calls)
+
+    def test_suppressed_exception_continues(self):
+        m = Mock()
+        class CM(object):
+            def __enter__(self):
+                pass
+            def __exit__(self, type, obj, tb):
+                m.exit(type)
+                return True
+        @requires(CM)
+        def bad(obj):
+            m.bad()
+            raise Exception()
+        runner = Runner(CM, bad)
+        runner.add(m.job, after(CM))
+        runner(executor=self.executor)
+        compare([call.bad(), call.exit(Exception), call.job()], m.mock_calls)
@@ -0,0 +1,98 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+from unittest import TestCase
+
+from testfixtures import Replacer, ShouldRaise, compare
+
+from mush import Runner, requires, returns, marker
+from mush.processes import ProcessPool, in_process, default_pool
+
+Parent = marker('Parent')
+Child = marker('Child')
+
+
+class Work(object):
+    def __init__(self, value):
+        self.value = value
+
+
+@returns(Parent)
+def parent():
+    return os.getpid()
+
+
+@in_process()
+@requires(Work)
+def square(work):
+    return {int: work.value * work.value, Child: os.getpid()}
+
+
+def child():
+    return os.getpid()
+
+
+def fail():
+    raise ValueError('boom')
+
+
+class ProcessTests(TestCase):
+
+    def setUp(self):
+        self.pool = ProcessPool(max_workers=1)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def check(self, runner, executor=None):
+        results = {}
+        @requires(Parent, int, Child)
+        def collect(parent, value, child):
+            results.update(parent=parent, value=value, child=child)
+        runner.add(collect)
+        runner(executor=executor)
+        return results
+
+    def test_default_pool(self):
+        self.addCleanup(default_pool.shutdown)
+        runner = Runner(parent, lambda: Work(3), square)
+        results = self.check(runner)
+        compare(results['value'], 9)
+        self.assertNotEqual(results['parent'], results['child'])
+
+    def test_explicit_pool(self):
+        runner = Runner(parent)
+        runner.add_returning(in_process(self.pool)(child), Child)
+        runner.add(lambda: 1)
+        results = self.check(runner)
+        self.assertNotEqual(results['parent'], results['child'])
+
+    def test_with_executor(self):
+        runner = Runner(parent)
+        runner.add_returning(in_process(self.pool)(child), Child)
+        runner.add(lambda: 1)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = self.check(runner, executor)
+        self.assertNotEqual(results['parent'], results['child'])
+
+    def test_exception(self):
+        runner = Runner(in_process(self.pool)(fail))
+        with ShouldRaise(ValueError('boom')):
+            runner()
+
+    def test_recycle(self):
+        pool = ProcessPool(max_workers=1, max_tasks_per_child=1)
+        self.addCleanup(pool.shutdown)
+        compare(2, len(set(pool(child) for _ in range(2))))
+
+    def test_recycle_emulated(self):
+        pool = ProcessPool(max_workers=1, max_tasks_per_child=2)
+        self.addCleanup(pool.shutdown)
+        with Replacer() as r:
+            r.replace('mush.processes.native_recycling', False)
+            pids = [pool(child) for _ in range(4)]
+        compare(pids[0], pids[1])
+        compare(pids[2], pids[3])
+        self.assertNotEqual(pids[1], pids[2])
+
+    def test_shutdown_not_started(self):
+        ProcessPool().shutdown()
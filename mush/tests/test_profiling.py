@@ -0,0 +1,128 @@
+from io import StringIO
+import json
+import sys
+import tracemalloc
+from unittest import TestCase
+
+from testfixtures import Replacer, ShouldRaise, compare
+
+from mush import Runner, requires, returns
+from mush.profiling import MemoryProfiler, sizeof
+
+SIZE = 1000000
+
+
+class Big(object):
+
+    def __init__(self):
+        self.data = bytearray(SIZE)
+
+
+def make():
+    return Big()
+
+
+@requires(Big)
+@returns('total')
+def total(big):
+    temporary = bytes(SIZE)
+    return len(big.data) + len(temporary)
+
+
+class TheError(Exception):
+    pass
+
+
+def bad():
+    raise TheError()
+
+
+class MemoryProfilerTests(TestCase):
+
+    def setUp(self):
+        self.profiler = MemoryProfiler(sites=3)
+        self.runner = Runner(make, total)
+        self.runner.hooks.append(self.profiler)
+
+    def test_report(self):
+        self.runner()
+        report = self.profiler.report()
+        compare([c['callable'] for c in report['callables']],
+                expected=['make', 'total'])
+        make_report, total_report = report['callables']
+        compare(make_report['calls'], expected=1)
+        self.assertTrue(SIZE <= make_report['net'] < SIZE * 1.1)
+        self.assertTrue(make_report['peak'] >= make_report['net'])
+        self.assertTrue(SIZE <= make_report['resources']['Big'] < SIZE * 1.1)
+        self.assertTrue(total_report['net'] < SIZE / 10)
+        self.assertTrue(total_report['peak'] >= SIZE)
+        compare(list(total_report['resources']), expected=['total'])
+        site = make_report['sites'][0]
+        self.assertTrue(site['file'].endswith('test_profiling.py'))
+        self.assertTrue(site['size'] >= SIZE)
+        self.assertTrue(len(make_report['sites']) <= 3)
+
+    def test_report_without_reset_peak(self):
+        # as on Python 3.8:
+        with Replacer() as r:
+            r.replace('mush.profiling.reset_peak', None)
+            self.test_report()
+
+    def test_calls_aggregated(self):
+        self.runner()
+        self.runner()
+        profile = self.profiler.callables[make]
+        compare(profile.calls, expected=2)
+        compare(repr(profile), expected='<CallableProfile make: 2 calls>')
+
+    def test_tracemalloc_stopped(self):
+        self.runner()
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_tracemalloc_left_running(self):
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        self.runner()
+        self.assertTrue(tracemalloc.is_tracing())
+
+    def test_error(self):
+        runner = Runner(bad)
+        runner.hooks.append(self.profiler)
+        with ShouldRaise(TheError):
+            runner()
+        compare(self.profiler.callables[bad].calls, expected=1)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_no_sites(self):
+        profiler = MemoryProfiler(sites=0)
+        runner = Runner(make)
+        runner.hooks.append(profiler)
+        runner()
+        compare(profiler.report()['callables'][0]['sites'], expected=[])
+
+    def test_write(self):
+        self.runner()
+        output = StringIO()
+        self.profiler.write(output)
+        compare(json.loads(output.getvalue()), expected=self.profiler.report())
+
+    def test_reset(self):
+        self.runner()
+        self.profiler.reset()
+        compare(self.profiler.report(), expected=dict(callables=[]))
+
+
+class SizeofTests(TestCase):
+
+    def test_nested(self):
+        obj = [bytes(1000), dict(x=bytes(1000))]
+        self.assertTrue(sizeof(obj) > 2000)
+
+    def test_shared_not_counted(self):
+        obj = [make]
+        compare(sizeof(obj), expected=sys.getsizeof(obj))
+
+    def test_cycle(self):
+        obj = []
+        obj.append(obj)
+        compare(sizeof(obj), expected=sys.getsizeof(obj))
@@ -0,0 +1,154 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from mock import Mock, call
+from testfixtures import compare
+
+from mush import Runner, Context, after, lazy, marker
+
+Big = marker('Big')
+Bigger = marker('Bigger')
+Result = marker('Result')
+
+
+class ReleaseTests(TestCase):
+
+    generate = True
+
+    def setUp(self):
+        self.context = Context()
+        self.m = Mock()
+
+    def make_runner(self, *objs):
+        runner = Runner(*objs)
+        runner.release = True
+        runner.generate = self.generate
+        return runner
+
+    def call(self, runner):
+        runner(self.context)
+
+    def keys(self):
+        return sorted(t.__name__ for t in self.context.keys())
+
+    def test_intermediates(self):
+        seen = []
+        runner = self.make_runner()
+        runner.add_returning(lambda: 'big', Big)
+        runner.add_returning(lambda big: big+'ger', Bigger, Big)
+        runner.add_returning(lambda bigger: seen.append(self.keys()),
+                             Result, Bigger)
+        self.call(runner)
+        compare(seen, expected=[['Bigger']])
+        compare(self.keys(), expected=[])
+
+    def test_not_released_by_default(self):
+        runner = Runner()
+        runner.add_returning(lambda: 'big', Big)
+        runner.add(self.m.use, Big)
+        runner(self.context)
+        compare(self.keys(), expected=['Big', 'Mock'])
+
+    def test_unused_but_returned(self):
+        runner = self.make_runner()
+        runner.add_returning(lambda: 'big', Big)
+        self.call(runner)
+        compare(self.keys(), expected=[])
+
+    def test_unused_not_declared(self):
+        class Thing(object): pass
+        runner = self.make_runner(Thing)
+        self.call(runner)
+        compare(self.keys(), expected=['Thing'])
+
+    def test_context_manager_exited_early(self):
+        m = self.m
+        class CM(object):
+            def __enter__(self):
+                m.enter()
+                return 'resource'
+            def __exit__(self, type, obj, tb):
+                m.exit()
+        runner = self.make_runner(CM)
+        runner.add_returning(m.use, Result, str, after(CM))
+        runner.add(m.later, after(Result))
+        self.call(runner)
+        compare([call.enter(), call.use('resource'), call.exit(),
+                 call.later()], m.mock_calls)
+
+    def test_context_manager_never_required(self):
+        m = self.m
+        class CM(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit()
+        runner = self.make_runner(CM, m.later)
+        self.call(runner)
+        compare([call.enter(), call.later(), call.exit()], m.mock_calls)
+
+    def make_managers(self):
+        m = self.m
+        def cm(name):
+            class CM(object):
+                def __enter__(self):
+                    m.enter(name)
+                def __exit__(self, type, obj, tb):
+                    m.exit(name)
+            return CM
+        Outer, Inner = cm('outer'), cm('inner')
+        runner = self.make_runner(Outer, Inner)
+        runner.add(m.use_outer, after(Outer))
+        runner.add_returning(m.use_inner, Result, after(Inner))
+        runner.add(m.final, after(Result))
+        return runner
+
+    def test_context_manager_not_innermost(self):
+        self.call(self.make_managers())
+        # outer is no longer needed first, but can't be exited until
+        # inner has been:
+        compare([call.enter('outer'), call.enter('inner'),
+                 call.use_outer(), call.use_inner(), call.exit('inner'),
+                 call.exit('outer'), call.final()], self.m.mock_calls)
+
+    def test_lazy_requirements(self):
+        seen = []
+        runner = self.make_runner()
+        runner.add_returning(lambda: 'big', Big)
+        runner.add_returning(lazy()(lambda big: big+'ger'), Bigger, Big)
+        runner.add_returning(lambda bigger: seen.append(self.keys()),
+                             Result, Bigger)
+        self.call(runner)
+        # Big is used by the lazy provider of Bigger, so is kept until
+        # the last callable requiring Bigger has finished:
+        compare(seen, expected=[['Big', 'Bigger']])
+        compare(self.keys(), expected=[])
+
+    def test_toggle(self):
+        runner = Runner()
+        plan = runner.compile()
+        runner.release = True
+        self.assertFalse(runner.compile() is plan)
+        self.assertTrue(runner.compile().releasing)
+
+
+class InterpretedReleaseTests(ReleaseTests):
+
+    generate = False
+
+
+class ExecutorReleaseTests(ReleaseTests):
+
+    def call(self, runner):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            runner(self.context, executor=executor)
+
+    def test_context_manager_not_innermost(self):
+        self.call(self.make_managers())
+        # the callables using each manager may be called in any order:
+        calls = self.m.mock_calls
+        self.assertTrue(calls.index(call.exit('inner')) >
+                        calls.index(call.use_inner()))
+        self.assertTrue(calls.index(call.exit('outer')) >
+                        calls.index(call.use_outer()))
+        compare(calls[-1], expected=call.final())
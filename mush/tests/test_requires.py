@@ -116,6 +116,40 @@ class RequiresTests(TestCase):
         compare(h.names, ())
         self.assertTrue(isinstance(h, how))
     
+    def test_equality(self):
+        self.assertTrue(first(Type1) == first(Type1))
+        self.assertFalse(first(Type1) != first(Type1))
+        self.assertFalse(first(Type1) == last(Type1))
+        self.assertFalse(first(Type1) == first(Type2))
+        self.assertTrue(attr(first(Type1), 'x') == attr(first(Type1), 'x'))
+        self.assertFalse(attr(Type1, 'x') == attr(Type1, 'y'))
+        self.assertFalse(attr(Type1, 'x') == item(Type1, 'x'))
+        compare(len({first(Type1), first(Type1), item(Type1, 'x'),
+                     item(Type1, 'x')}), expected=2)
+
+    def test_equality_subclass_state(self):
+        class default(how):
+            def __init__(self, type, name, value):
+                super(default, self).__init__(type, name)
+                self.default = value
+        self.assertTrue(default(Type1, 'x', 1) == default(Type1, 'x', 1))
+        self.assertFalse(default(Type1, 'x', 1) == default(Type1, 'x', 2))
+        compare(len({default(Type1, 'x', 1), default(Type1, 'x', 2)}),
+                expected=2)
+
+    def test_equality_subclass_slots(self):
+        class default(attr):
+            __slots__ = ('default', )
+            def __init__(self, type, name, value):
+                super(default, self).__init__(type, name)
+                self.default = value
+        self.assertTrue(default(Type1, 'x', 1) == default(Type1, 'x', 1))
+        self.assertFalse(default(Type1, 'x', 1) == default(Type1, 'x', 2))
+
+    def test_slots(self):
+        for obj in first(Type1), last(Type1), attr(Type1, 'x'), after(Type1):
+            self.assertFalse(hasattr(obj, '__dict__'), obj)
+
 class RequirementsTests(TestCase):
 
     def test_repr_empty(self):
@@ -153,3 +187,6 @@ class RequirementsTests(TestCase):
     def test_iter_both(self):
         compare(((None, Type1), ('x', Type2)),
                 tuple(Requirements(Type1, x=Type2)))
+
+    def test_slots(self):
+        self.assertFalse(hasattr(Requirements(), '__dict__'))
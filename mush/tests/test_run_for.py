@@ -0,0 +1,178 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from mock import Mock, call
+from testfixtures import ShouldRaise, compare
+
+from mush import (
+    Runner, Context, PartialPlan, requires, returns, first, last, after,
+    attr, lazy, marker
+)
+
+
+class Config(object):
+    value = 'config'
+
+
+class Connection(object):
+    pass
+
+
+class Report(object):
+    pass
+
+
+class RunForTests(TestCase):
+
+    def setUp(self):
+        self.m = m = Mock()
+        self.config = config = Config()
+
+        @returns(Config)
+        def load():
+            m.load()
+            return config
+
+        @requires(Config)
+        @returns(Connection)
+        def connect(config):
+            m.connect(config.value)
+            return Connection()
+
+        @requires(Connection)
+        @returns(Report)
+        def report(connection):
+            m.report()
+            return Report()
+
+        self.runner = Runner(load, connect, report)
+
+    def test_single(self):
+        compare(self.runner.run_for(Config), expected=self.config, strict=True)
+        compare([call.load()], self.m.mock_calls)
+
+    def test_chain(self):
+        self.assertTrue(isinstance(self.runner.run_for(Report), Report))
+        compare([call.load(), call.connect('config'), call.report()],
+                self.m.mock_calls)
+
+    def test_multiple(self):
+        config, connection = self.runner.run_for(Config, Connection)
+        self.assertTrue(config is self.config)
+        self.assertTrue(isinstance(connection, Connection))
+        compare([call.load(), call.connect('config')], self.m.mock_calls)
+
+    def test_seeded(self):
+        other = Config()
+        other.value = 'other'
+        self.runner.run_for(Connection, context=Context(other))
+        compare([call.connect('other')], self.m.mock_calls)
+
+    def test_plan_cached(self):
+        plan = self.runner.compile_for((Config, ))
+        self.assertTrue(isinstance(plan, PartialPlan))
+        self.assertTrue(self.runner.compile_for((Config, )) is plan)
+        self.assertFalse(self.runner.compile_for((Report, )) is plan)
+        self.runner.add(lambda: None)
+        self.assertFalse(self.runner.compile_for((Config, )) is plan)
+
+    def test_first_period(self):
+        @requires(first(Config))
+        def configure(config):
+            self.m.configure()
+        @requires(last(Config))
+        def finish(config):
+            self.m.finish() # pragma: no cover
+        self.runner.add(configure)
+        self.runner.add(finish)
+        self.runner.run_for(Config)
+        compare([call.load(), call.configure()], self.m.mock_calls)
+
+    def test_after(self):
+        runner = Runner()
+        runner.add_returning(self.m.setup, 'setup')
+        runner.add_returning(lambda: Config(), Config, after('setup'))
+        runner.run_for(Config)
+        compare([call.setup()], self.m.mock_calls)
+
+    def test_how(self):
+        runner = Runner()
+        runner.add_returning(lambda: Config(), Config)
+        runner.add_returning(lambda value: value + '!', 'value',
+                             attr(Config, 'value'))
+        compare(runner.run_for('value'), expected='config!')
+
+    def test_class(self):
+        runner = Runner(Config)
+        runner.add(self.m.unrelated)
+        self.assertTrue(isinstance(runner.run_for(Config), Config))
+        compare([], self.m.mock_calls)
+
+    def test_learn_unknown(self):
+        runner = Runner()
+        def make_config():
+            self.m.make_config()
+            return Config()
+        def side_effect():
+            self.m.noop()
+        runner.add(side_effect)
+        runner.add(make_config)
+        runner.add_returning(self.m.other, 'other')
+        # first time, everything that might produce a Config is called:
+        runner.run_for(Config)
+        compare([call.noop(), call.make_config()], self.m.mock_calls)
+        compare(runner.produced, expected={side_effect: (),
+                                           make_config: (Config, )})
+        # after that, only what's needed:
+        runner.run_for(Config)
+        compare([call.noop(), call.make_config(), call.make_config()],
+                self.m.mock_calls)
+
+    def test_learn_ignores_lazy(self):
+        DB = marker('DB')
+        runner = Runner()
+        @lazy()
+        @returns(DB)
+        def connect():
+            self.m.connect()
+            return 'db'
+        @requires(DB)
+        def job(db):
+            self.m.job()
+        def make_config():
+            return Config()
+        runner.add(connect)
+        runner.add(job)
+        runner.add(make_config)
+        runner.run_for(Config)
+        # the lazy DB was created while job was called, but not by it:
+        compare(runner.produced, expected={job: (),
+                                           make_config: (Config, )})
+        self.m.reset_mock()
+        compare(runner.run_for(DB), expected='db')
+        compare([call.connect()], self.m.mock_calls)
+
+    def test_missing(self):
+        runner = Runner(self.m.other)
+        with ShouldRaise(KeyError('No Config in context')):
+            runner.run_for(Config)
+
+    def test_context_manager(self):
+        class CM(object):
+            def __enter__(s):
+                self.m.enter()
+                return Config()
+            def __exit__(s, type, obj, tb):
+                self.m.exit()
+        runner = Runner(CM, self.m.unrelated)
+        self.assertTrue(isinstance(runner.run_for(Config), Config))
+        compare([call.enter(), call.unrelated(), call.exit()],
+                self.m.mock_calls)
+        self.m.reset_mock()
+        runner.run_for(Config)
+        compare([call.enter(), call.exit()], self.m.mock_calls)
+
+    def test_executor(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            self.runner.run_for(Connection, executor=executor)
+        compare([call.load(), call.connect('config')], self.m.mock_calls)
@@ -1,3 +1,8 @@
+import gc
+import linecache
+from logging import getLogger
+import sys
+from traceback import format_exc
 from unittest import TestCase
 
 from .compat import PY3
@@ -7,15 +12,19 @@ if PY3:
 else:
     from StringIO import StringIO
 
-from mock import Mock, call
+from mock import ANY, Mock, call
 from testfixtures import (
-    OutputCapture,
+    LogCapture,
+    Replacer,
     ShouldRaise,
     StringComparison as S,
     compare
     )
 
-from mush import Periods, Runner, requires, first, last, attr, item, nothing, returns
+from mush import (
+    Periods, Runner, requires, first, last, attr, item, nothing, returns,
+    how, after, Plan, GeneratedPlan, Builder, plan_sources
+    )
 
 
 class RunnerTests(TestCase):
@@ -423,6 +432,74 @@ class RunnerTests(TestCase):
                 call.cm1.exit(Exception, e)
                 ], m.mock_calls)
         
+    def test_context_manager_suppresses(self):
+        # callables after the one that raised are still called, but
+        # outside the context manager that suppressed the exception
+        m = Mock()
+        class CM1(object):
+            def __enter__(self):
+                m.cm1.enter()
+            def __exit__(self, type, obj, tb):
+                m.cm1.exit(type)
+                return True
+        class CM2(object):
+            def __enter__(self):
+                m.cm2.enter()
+            def __exit__(self, type, obj, tb):
+                m.cm2.exit(type)
+        def bad():
+            m.bad()
+            raise ValueError()
+        runner = Runner(CM1, CM2, bad, m.after)
+        runner()
+        compare([
+                call.cm1.enter(),
+                call.cm2.enter(),
+                call.bad(),
+                call.cm2.exit(ValueError),
+                call.cm1.exit(ValueError),
+                call.after(),
+                ], m.mock_calls)
+
+    def test_context_manager_exit_raises(self):
+        m = Mock()
+        class CM1(object):
+            def __enter__(self):
+                pass
+            def __exit__(self, type, obj, tb):
+                m.cm1.exit(type, obj)
+        e = Exception('exit')
+        class CM2(object):
+            def __enter__(self):
+                pass
+            def __exit__(self, type, obj, tb):
+                m.cm2.exit(type, obj)
+                raise e
+        runner = Runner(CM1, CM2, m.job)
+        with ShouldRaise(e):
+            runner()
+        compare([
+                call.job(),
+                call.cm2.exit(None, None),
+                call.cm1.exit(Exception, e),
+                ], m.mock_calls)
+
+    def test_context_manager_deeply_nested(self):
+        m = Mock()
+        class CM(object):
+            def __enter__(self):
+                pass
+            def __exit__(self, type, obj, tb):
+                m.exit(self.i)
+        runner = Runner()
+        depth = sys.getrecursionlimit() * 2
+        for i in range(depth):
+            runner.add(type('CM%i' % i, (CM, ), dict(i=i)))
+        runner.add(m.job)
+        runner()
+        compare([call.job()] + [call.exit(i) for i in reversed(range(depth))],
+                m.mock_calls)
+
     def test_marker_interfaces(self):
         # return {Type:None}
         # don't pass when a requirement is for a type but value is None
@@ -586,6 +663,104 @@ class RunnerTests(TestCase):
                 call.job3(t2),
                 ], m.mock_calls)
 
+    def test_extend_with_runner_keeps_returns(self):
+        m = Mock()
+        class T1(object): pass
+        source = Runner()
+        source.add_returning(lambda: 'foo', T1)
+        source.add(m.job, T1)
+        for runner in Runner(source), Runner(lambda: None, source):
+            m.reset_mock()
+            runner()
+            compare([call.job('foo')], m.mock_calls)
+
+    def test_extend_with_runner_shares(self):
+        m = Mock()
+        class T1(object): pass
+        source = Runner(m.job1)
+        source.add(m.job2, T1)
+        runner = Runner(source)
+        self.assertTrue(runner.callables is source.callables)
+        runner.add(m.job3, T1)
+        compare([m.job1, m.job2], [o for _, _, o in source])
+        compare([m.job1, m.job2, m.job3], [o for _, _, o in runner])
+
+    def test_extend_with_runner_same_order(self):
+        m = Mock()
+        class T1(object): pass
+        class T2(object): pass
+        class T3(object): pass
+        runner = Runner()
+        runner.add(m.job1, T1)
+        runner.add(m.job2, T2)
+        source = Runner()
+        source.add(m.job3, T1)
+        source.add(m.job4, T2)
+        source.add(m.job5, T3, T1)
+        runner.extend(source)
+        compare([type(None), T1, T2, T3], runner.types)
+        compare([m.job1, m.job3, m.job2, m.job4, m.job5],
+                [o for _, _, o in runner])
+
+    def test_extend_with_runner_different_order(self):
+        m = Mock()
+        class T1(object): pass
+        class T2(object): pass
+        runner = Runner()
+        runner.add(m.job1, T1)
+        runner.add(m.job2, T2)
+        source = Runner()
+        source.add(m.job3, T2)
+        source.add(m.job4, T1, T2)
+        compare([m.job3, m.job4], [o for _, _, o in source])
+        runner.extend(source)
+        # job4 now requires T2 after T1:
+        compare([type(None), T1, T2], runner.types)
+        compare([m.job1, m.job2, m.job3, m.job4],
+                [o for _, _, o in runner])
+        compare(runner.callables[T2].normal[-1][2], m.job4)
+
+    def test_extend_with_runner_different_locations(self):
+        m = Mock()
+        class T1(object): pass
+        class T4(object): pass
+        source = Runner()
+        source.add(m.f, first(T1), after(T4))
+        source.add(m.g, T4)
+        compare([m.g, m.f], [o for _, _, o in source])
+        for runner in Runner(), Runner(debug=Mock()):
+            runner.extend(source)
+            runner.add(m.h, after(T4))
+            # f now goes under T1, which comes after T4:
+            compare([type(None), T4, T1], runner.types)
+            compare([m.g, m.h, m.f], [o for _, _, o in runner])
+
+    def test_requirements_shared(self):
+        class T1(object): pass
+        def job1(obj): pass
+        def job2(obj): pass
+        runner = Runner()
+        runner.add(job1, first(T1))
+        runner.add(job2, first(T1))
+        (clean1, reqs1, _), (clean2, reqs2, _) = runner
+        self.assertTrue(clean1 is clean2)
+        self.assertTrue(reqs1 is reqs2)
+        self.assertTrue(clean1 is reqs1)
+        runner.add_returning(job1, T1, first(T1))
+        clean3, reqs3, _ = runner.callables[T1].first[-1]
+        self.assertTrue(reqs3 is reqs1)
+        self.assertFalse(clean3 is clean1)
+        compare(clean3.returns, T1)
+
+    def test_requirements_unhashable(self):
+        class T1(object): pass
+        def job(obj): pass
+        runner = Runner()
+        runner.add(job, item(T1, ['x']))
+        runner.add(job, item(T1, ['x']))
+        (clean1, _, _), (clean2, _, _) = runner
+        self.assertFalse(clean1 is clean2)
+
     def test_replace_for_testing(self):
         m = Mock()        
         class T1(object): pass
@@ -619,6 +794,258 @@ class RunnerTests(TestCase):
                 call.job3(t2),
                 ], m.mock_calls)
 
+    def test_replace_repeated(self):
+        m = Mock()
+        class T1(object): pass
+        runner = Runner(m.job1)
+        runner.add(m.job2, T1)
+        runner.add(m.job1, first(T1))
+        runner.replace(m.job1, m.job3)
+        runner.add(m.job3, T1)
+        runner.replace(m.job3, m.job4)
+        runner.replace(m.job5, m.job6)
+        compare([m.job4, m.job4, m.job2, m.job4], [o for _, _, o in runner])
+
+    def test_replace_many(self):
+        m = Mock()
+        class T1(object): pass
+        runner = Runner(m.job1)
+        runner.add(m.job2, T1)
+        runner.add(m.job3, T1)
+        plan = runner.compile()
+        runner.replace_many({m.job1: m.job2, m.job2: m.job1, m.job3: m.job4})
+        compare([m.job2, m.job1, m.job4], [o for _, _, o in runner])
+        self.assertFalse(runner.compile() is plan)
+        runner.replace(m.job1, m.job5)
+        compare([m.job2, m.job5, m.job4], [o for _, _, o in runner])
+
+    def test_replace_after_merge(self):
+        m = Mock()
+        runner = Runner(m.job1)
+        runner.replace(m.job1, m.job2)
+        runner.extend(Runner(m.job1))
+        runner.replace(m.job1, m.job3)
+        compare([m.job2, m.job3], [o for _, _, o in runner])
+
+
+    def test_compile_cached(self):
+        def job(): pass
+        runner = Runner(job)
+        plan = runner.compile()
+        self.assertTrue(runner.compile() is plan)
+        compare([job], [step.obj for step in plan.steps])
+
+    def test_compile_dropped_on_change(self):
+        m = Mock()
+        def job1(): m.job1()
+        def job2(): m.job2()
+        def job3(): m.job3()
+        runner = Runner(job1)
+        runner()
+        plan1 = runner.compile()
+        runner.add(job2)
+        runner()
+        plan2 = runner.compile()
+        self.assertFalse(plan2 is plan1)
+        runner.replace(job2, job3)
+        runner()
+        plan3 = runner.compile()
+        self.assertFalse(plan3 is plan2)
+        runner.extend(job1)
+        self.assertFalse(runner.compile() is plan3)
+        compare([
+                call.job1(),
+                call.job1(), call.job2(),
+                call.job1(), call.job3(),
+                ], m.mock_calls)
+
+    def test_compile_resolves_sources(self):
+        class T(object): pass
+        def job(obj1, obj2): pass
+        runner = Runner()
+        runner.add(job, item(attr(T, 'foo'), 'bar'), obj2=last(T))
+        step, = runner.compile().steps
+        compare(((None, T, (attr, item)), ('obj2', T, ())),
+                tuple((n, t, tuple(type(o.__self__) for o in ops))
+                      for n, t, ops in step.sources))
+
+    def test_compile_generated(self):
+        runner = Runner()
+        runner.generate = True
+        self.assertTrue(isinstance(runner.compile(), GeneratedPlan))
+        runner.generate = False
+        plan = runner.compile()
+        self.assertTrue(type(plan) is Plan)
+        self.assertTrue(runner.compile() is plan)
+
+    def test_attr_not_identifier(self):
+        class T(object): pass
+        t = T()
+        setattr(t, 'not valid', 'bar')
+        m = Mock()
+        runner = Runner()
+        runner.add(lambda: t)
+        runner.add(m.job, attr(T, 'not valid'))
+        runner()
+        compare([call.job('bar')], m.mock_calls)
+
+    def test_attr_trailing_newline(self):
+        class T(object):
+            x = 'plain'
+        t = T()
+        setattr(t, 'x\n', 'weird')
+        m = Mock()
+        runner = Runner()
+        runner.add(lambda: t)
+        runner.add(m.job, attr(T, 'x\n'))
+        runner()
+        compare([call.job('weird')], m.mock_calls)
+
+    def test_item_not_string(self):
+        class MyDict(dict): pass
+        m = Mock()
+        runner = Runner()
+        runner.add(lambda: MyDict({(1, 2): 'bar'}))
+        runner.add(m.job, item(MyDict, (1, 2)))
+        runner()
+        compare([call.job('bar')], m.mock_calls)
+
+    def test_custom_how(self):
+        class upper(how):
+            def op(self, o):
+                return o.upper()
+        m = Mock()
+        runner = Runner()
+        runner.add(lambda: 'foo')
+        runner.add(m.job, upper(str))
+        runner()
+        compare([call.job('FOO')], m.mock_calls)
+
+    def test_custom_how_with_state(self):
+        class default(how):
+            def __init__(self, type, name, value):
+                super(default, self).__init__(type, name)
+                self.default = value
+            def op(self, o):
+                return getattr(o, self.names[0], self.default)
+        class T(object): pass
+        m = Mock()
+        runner = Runner()
+        runner.add(T)
+        runner.add(m.f, default(T, 'x', 1))
+        runner.add(m.g, default(T, 'x', 2))
+        runner()
+        compare([call.f(1), call.g(2)], m.mock_calls)
+
+    def test_after_and_nothing_keyword(self):
+        class T1(object): pass
+        class T2(object): pass
+        m = Mock()
+        runner = Runner()
+        runner.add(lambda: {T1: nothing})
+        runner.add(lambda: T2())
+        runner.add(m.job, after(T2), **{'not valid': T1})
+        runner()
+        compare([call.job()], m.mock_calls)
+
+    def test_exception_traceback(self):
+        def job():
+            raise Exception('boom')
+        runner = Runner(job)
+        runner.generate = True
+        try:
+            runner()
+        except Exception:
+            text = format_exc()
+        else:  # pragma: no cover
+            self.fail('no exception')
+        # the line from the generated source is shown:
+        self.assertTrue('result = call' in text, text)
+
+    def test_type_index(self):
+        class T1(object): pass
+        class T2(object): pass
+        def job(obj1, obj2): pass
+        runner = Runner()
+        runner.add(job, T2, T1)
+        runner.add(job, T1, last(T2))
+        compare([type(None), T2, T1], runner.types)
+        compare({type(None): 0, T2: 1, T1: 2}, runner.type_index)
+        clone = runner.clone()
+        compare(runner.types, clone.types)
+        compare(runner.type_index, clone.type_index)
+        class T3(object): pass
+        clone.add(job, T3)
+        compare([type(None), T2, T1], runner.types)
+        compare({type(None): 0, T2: 1, T1: 2}, runner.type_index)
+        compare([type(None), T2, T1, T3], clone.types)
+
+    def test_clone_shares_until_changed(self):
+        m = Mock()
+        class T1(object): pass
+        runner = Runner(m.job1)
+        runner.add(m.job2, T1)
+        clone = runner.clone()
+        self.assertTrue(clone.callables is runner.callables)
+        clone.add(m.job3, T1)
+        runner.add(m.job4, T1)
+        compare([m.job1, m.job2, m.job4], [o for _, _, o in runner])
+        compare([m.job1, m.job2, m.job3], [o for _, _, o in clone])
+        clone.replace(m.job1, m.job5)
+        compare([m.job1, m.job2, m.job4], [o for _, _, o in runner])
+        compare([m.job5, m.job2, m.job3], [o for _, _, o in clone])
+
+    def test_addition_shares_until_changed(self):
+        m = Mock()
+        class T1(object): pass
+        class T2(object): pass
+        runner1 = Runner(m.job1)
+        runner1.add(m.job2, T1)
+        runner2 = Runner()
+        runner2.add(m.job3, T1)
+        runner2.add(m.job4, T2)
+        runner = runner1 + runner2
+        compare([m.job1, m.job2, m.job3, m.job4], [o for _, _, o in runner])
+        runner1.add(m.job5, T1)
+        runner2.add(m.job6, T2)
+        runner.add(m.job7, T2)
+        compare([m.job1, m.job2, m.job5], [o for _, _, o in runner1])
+        compare([m.job3, m.job4, m.job6], [o for _, _, o in runner2])
+        compare([m.job1, m.job2, m.job3, m.job4, m.job7],
+                [o for _, _, o in runner])
+
+    def test_concat(self):
+        m = Mock()
+        class T1(object): pass
+        runners = []
+        for i in range(3):
+            runner = Runner(getattr(m, 'job%i' % i))
+            runner.add(getattr(m, 'use%i' % i), T1)
+            runner.hooks.append(i)
+            runners.append(runner)
+        runner = Runner.concat(*runners)
+        expected = runners[0] + runners[1] + runners[2]
+        compare([o for _, _, o in expected], [o for _, _, o in runner])
+        compare(expected.types, runner.types)
+        compare([0, 1, 2], runner.hooks)
+        runner.add(m.job3)
+        compare([m.job0, m.use0], [o for _, _, o in runners[0]])
+
+    def test_concat_none(self):
+        compare([], list(Runner.concat()))
+
+    def test_addition_keeps_types(self):
+        m = Mock()
+        class T1(object): pass
+        class T2(object): pass
+        runner1 = Runner(lambda: T1())
+        runner1.add(m.job1, T1)
+        runner2 = Runner(lambda: T2())
+        runner2.add(m.job2, T2)
+        runner = runner1 + runner2
+        compare([type(None), T1, T2], runner.types)
+        runner()
+        compare([call.job1(ANY), call.job2(ANY)], m.mock_calls)
 
     def test_debug_clone(self):
         runner1 = Runner(debug=object())
@@ -640,62 +1067,200 @@ class RunnerTests(TestCase):
         
         def user(obj1, obj2): pass
 
-        expected = '''\
-Added {makes_t1} to 'normal' period for {nonetype} with Requirements()
-Current call order:
-For {nonetype}:
-  normal: {makes_t1} requires Requirements()
+        expected = [
+            ('Added %r to %r period for %r with %r', (
+                makes_t1, 'normal', type(None), 'Requirements()'
+            )),
+            ('Added %r to %r period for %r with %r', (
+                makes_t2, 'normal', T1, 'Requirements(T1)'
+            )),
+            ('Added %r to %r period for %r with %r', (
+                makes_t3, 'normal', T2, 'Requirements(T2)'
+            )),
+            ('Added %r to %r period for %r with %r', (
+                user, 'normal', T3, 'Requirements(T3, T1)'
+            )),
+        ]
+
+        def check(records):
+            compare(expected, [(r.msg, r.args[:3] + (repr(r.args[3]), ))
+                               for r in records])
+            record = records[-1]
+            compare(record.levelname, 'DEBUG')
+            compare(record.callable, user)
+            compare(record.period, 'normal')
+            compare(record.type, T3)
+            compare(repr(record.requirements), 'Requirements(T3, T1)')
+
+        with LogCapture() as log:
+            runner1 = Runner(makes_t1, debug=True)
+            runner1.extend(makes_t2, makes_t3)
+            runner1.add(user, T3, T1)
+        compare(set(r.name for r in log.records), {'mush'})
+        check(log.records)
 
-Added {makes_t2} to 'normal' period for {T1} with Requirements(T1)
-Current call order:
-For {nonetype}:
-  normal: {makes_t1} requires Requirements()
-For {T1}:
-  normal: {makes_t2} requires Requirements(T1)
+        other = getLogger('other')
+        with LogCapture('other') as log:
+            runner2 = Runner(makes_t1, debug=other)
+            runner2.extend(makes_t2, makes_t3)
+            runner2.add(user, T3, T1)
+        check(log.records)
 
-Added {makes_t3} to 'normal' period for {T2} with Requirements(T2)
-Current call order:
+        actual = StringIO()
+        runner3 = Runner(makes_t1, debug=actual)
+        runner3.extend(makes_t2, makes_t3)
+        runner3.add(user, T3, T1)
+        compare(actual.getvalue(), '\n'.join(
+            message.replace('with %r', 'with %s') % args
+            for message, args in expected
+        ) + '\n')
+
+        with LogCapture() as log:
+            Runner(makes_t1)
+        log.check()
+
+    def test_explain(self):
+        class T1(object): pass
+        class T2(object): pass
+        def makes_t1(): pass
+        def user(obj): pass
+        def cleanup(obj): pass
+        runner = Runner(makes_t1)
+        runner.add(cleanup, last(T1))
+        runner.add(user, T1)
+        compare(runner.explain(), """\
 For {nonetype}:
   normal: {makes_t1} requires Requirements()
 For {T1}:
-  normal: {makes_t2} requires Requirements(T1)
-For {T2}:
-  normal: {makes_t3} requires Requirements(T2)
+  normal: {user} requires Requirements(T1)
+    last: {cleanup} requires Requirements(last(T1))""".format(
+            nonetype=repr(type(None)), T1=repr(T1),
+            makes_t1=repr(makes_t1), user=repr(user), cleanup=repr(cleanup)
+        ))
 
-Added {user} to 'normal' period for {T3} with Requirements(T3, T1)
-Current call order:
-For {nonetype}:
-  normal: {makes_t1} requires Requirements()
-For {T1}:
-  normal: {makes_t2} requires Requirements(T1)
-For {T2}:
-  normal: {makes_t3} requires Requirements(T2)
-For {T3}:
-  normal: {user} requires Requirements(T3, T1)
-
-'''.format(nonetype=repr(None.__class__),
-           makes_t1=repr(makes_t1),
-           makes_t2=repr(makes_t2),
-           makes_t3=repr(makes_t3),
-           user=repr(user),
-           T1=repr(T1),
-           T2=repr(T2),
-           T3=repr(T3))
-                           
-        with OutputCapture() as output:
-            runner1 = Runner(makes_t1, debug=True)
-            runner1.extend(makes_t2, makes_t3)
-            runner1.add(user, T3, T1)
+class BuilderTests(TestCase):
 
-        compare(expected, output.captured)
+    def test_same_order_as_add(self):
+        class T1(object): pass
+        class T2(object): pass
+        def parser(): pass
+        def base(obj): pass
+        def parse(obj): pass
+        def job(obj1, obj2): pass
+        def lastly(): pass
 
-        actual = StringIO()
-        runner2 = Runner(makes_t1, debug=actual)
-        runner2.extend(makes_t2, makes_t3)
-        runner2.add(user, T3, T1)
+        runner = Runner()
+        runner.add(parser)
+        runner.add(job, T2, T1)
+        runner.add(parse, last(T1))
+        runner.add(base, T1)
+        runner.add(lastly, last())
+
+        builder = Builder()
+        builder.add(parser)
+        builder.add(job, T2, T1)
+        builder.add(parse, last(T1))
+        builder.add(base, T1)
+        builder.add(lastly, last())
+        built = builder.finalize()
+
+        compare(runner.types, built.types)
+        compare([(r.args, r.kw, o) for r, _, o in runner],
+                [(r.args, r.kw, o) for r, _, o in built])
+
+    def test_types_registered_once(self):
+        class T1(object): pass
+        class T2(object): pass
+        def job(*args): pass
+        builder = Builder()
+        builder.add(job, T1)
+        builder.add(job, T1, T2)
+        builder.add(job, last(T2))
+        registered = []
+        original = Runner._register
+        def register(runner, type):
+            registered.append(type)
+            return original(runner, type)
+        with Replacer() as r:
+            r.replace('mush.Runner._register', register)
+            runner = builder.finalize()
+        compare([T1, T1, T2, T2], registered)
+        compare([type(None), T1, T2], runner.types)
+
+    def test_existing_runner(self):
+        m = Mock()
+        class T(object): pass
+        runner = Runner(m.job1)
+        runner()
+        builder = Builder(runner)
+        builder.add_returning(m.job2, T)
+        builder.extend(Runner(m.job3))
+        # nothing is placed until finalized
+        compare(1, len(list(runner)))
+        self.assertTrue(builder.finalize() is runner)
+        m.reset_mock()
+        runner()
+        compare([call.job1(), call.job2(), call.job3()], m.mock_calls)
+        compare(T, list(runner)[1][0].returns)
+
+    def test_debug(self):
+        class T(object): pass
+        def makes_t(): pass
+        def user(obj): pass
+        output = StringIO()
+        builder = Builder(Runner(debug=output))
+        builder.add_returning(makes_t, T)
+        builder.add(user, T)
+        builder.finalize()
+        compare(output.getvalue(), """\
+Added {makes_t} to 'normal' period for {nonetype} with Requirements() -> T
+Added {user} to 'normal' period for {T} with Requirements(T)
+""".format(nonetype=repr(type(None)), T=repr(T),
+           makes_t=repr(makes_t), user=repr(user)))
+
+class GeneratedRunnerTests(RunnerTests):
+    "Repeat the runner tests generating source for plans."
+
+    def setUp(self):
+        self.r = Replacer()
+        self.r.replace('mush.Runner.generate', True)
+
+    def tearDown(self):
+        self.r.restore()
+
+class CompileTests(TestCase):
+
+    def test_interpreted_by_default(self):
+        self.assertTrue(type(Runner().compile()) is Plan)
+
+    def test_generated_source_forgotten(self):
+        runner = Runner(lambda: None)
+        runner.generate = True
+        plan = runner.compile()
+        filename = plan.function.__code__.co_filename
+        self.assertTrue(filename in linecache.cache)
+        del plan
+        runner.generate = False
+        runner.compile()
+        gc.collect()
+        self.assertFalse(filename in linecache.cache)
+        self.assertFalse(filename in plan_sources)
+
+    def test_settings_kept(self):
+        runner = Runner(lambda: None)
+        runner.generate = True
+        runner.release = True
+        for combined in (runner.clone(), runner + Runner(),
+                         Runner() + runner, Runner.concat(Runner(), runner)):
+            self.assertTrue(combined.generate)
+            self.assertTrue(combined.release)
+            self.assertTrue(isinstance(combined.compile(), GeneratedPlan))
+
+    def test_settings_default(self):
+        runner = Runner().clone()
+        self.assertFalse(runner.generate)
+        self.assertFalse(runner.release)
 
-        compare(expected, actual.getvalue())
-            
 class PeriodsTests(TestCase):
 
     def test_repr(self):
@@ -0,0 +1,331 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from mock import ANY, Mock, call
+from testfixtures import Replacer, ShouldRaise, compare
+
+from mush import (
+    Runner, Context, Cache, CacheInfo, scope, memoize, requires, returns,
+    item, ignore, not_specified
+)
+
+
+class Config(object):
+    def __init__(self, value):
+        self.value = value
+
+
+class Connection(object):
+    pass
+
+
+class CacheTests(TestCase):
+
+    def setUp(self):
+        self.now = 0
+        r = Replacer()
+        r.replace('mush.Cache.clock', lambda: self.now)
+        self.addCleanup(r.restore)
+
+    def test_get_set(self):
+        cache = Cache()
+        key = cache.key((1, ), {'x': 2})
+        compare(cache.get(key), expected=not_specified)
+        cache.set(key, 'result')
+        compare(cache.get(key), expected='result')
+        compare(len(cache), expected=1)
+
+    def test_key_unhashable(self):
+        cache = Cache()
+        obj = []
+        cache.set(cache.key((obj, ), {}), 'result')
+        compare(cache.get(cache.key((obj, ), {})), expected='result')
+        compare(cache.get(cache.key(([], ), {})), expected=not_specified)
+
+    def test_key_keyword_order(self):
+        obj = []
+        compare(Cache.key((), dict(a=1, b=obj)),
+                expected=Cache.key((), dict(b=obj, a=1)))
+
+    def test_max_size(self):
+        cache = Cache(max_size=2)
+        cache.set(1, 'one')
+        cache.set(2, 'two')
+        cache.get(1)
+        cache.set(3, 'three')
+        compare(cache.get(2), expected=not_specified)
+        compare(cache.get(1), expected='one')
+        compare(cache.get(3), expected='three')
+
+    def test_ttl(self):
+        cache = Cache(ttl=10)
+        cache.set(1, 'one')
+        self.now = 10
+        compare(cache.get(1), expected='one')
+        self.now = 11
+        compare(cache.get(1), expected=not_specified)
+        compare(len(cache), expected=0)
+
+    def test_clear(self):
+        cache = Cache()
+        cache.set(1, 'one')
+        cache.clear()
+        compare(len(cache), expected=0)
+
+    def test_info(self):
+        cache = Cache(max_size=10)
+        cache.get(1)
+        cache.set(1, 'one')
+        cache.get(1)
+        cache.get(1)
+        compare(cache.info(), expected=CacheInfo(
+            hits=2, misses=1, max_size=10, size=1
+        ))
+
+
+class ScopeTests(TestCase):
+
+    def test_invalid(self):
+        with ShouldRaise(ValueError("'thread' is not a valid scope")):
+            scope('thread')
+
+    def test_call(self):
+        m = Mock()
+        @scope('call')
+        def make():
+            m.make()
+            return Connection()
+        runner = Runner(make)
+        runner()
+        runner()
+        compare([call.make(), call.make()], m.mock_calls)
+
+    def test_runner(self):
+        m = Mock()
+        @scope('runner')
+        def make():
+            m.make()
+            return Connection()
+        connections = []
+        runner = Runner(make)
+        runner.add(connections.append, Connection)
+        runner()
+        runner()
+        compare([call.make()], m.mock_calls)
+        compare(connections[0], expected=connections[1], strict=True)
+        # a different runner has its own results:
+        other = runner.clone()
+        other()
+        compare([call.make(), call.make()], m.mock_calls)
+        self.assertFalse(connections[2] is connections[0])
+
+    def test_runner_survives_changes(self):
+        m = Mock()
+        @scope('runner')
+        def make():
+            m.make()
+            return Connection()
+        runner = Runner(make)
+        runner()
+        runner.add(lambda: None)
+        runner()
+        compare([call.make()], m.mock_calls)
+
+    def test_process(self):
+        m = Mock()
+        @scope('process')
+        def make():
+            m.make()
+            return Connection()
+        Runner(make)()
+        Runner(make)()
+        compare([call.make()], m.mock_calls)
+
+    def test_process_shared_decorator(self):
+        per_process = scope('process')
+        @per_process
+        def a():
+            return 'a'
+        @per_process
+        def b():
+            return 'b'
+        results = []
+        runner = Runner(a)
+        runner.add(results.append, str)
+        runner()
+        runner = Runner(b)
+        runner.add(results.append, str)
+        runner()
+        compare(results, expected=['a', 'b'])
+        runner.invalidate(a)
+        compare(runner.cache_info()[b].size, expected=1)
+
+    def test_keyed_by_resources(self):
+        m = Mock()
+        @scope('runner', max_size=1)
+        @requires(Config)
+        def connect(config):
+            m.connect(config.value)
+            return Connection()
+        runner = Runner(connect)
+        config1 = Config(1)
+        config2 = Config(2)
+        runner(Context(config1))
+        runner(Context(config1))
+        runner(Context(config2))
+        runner(Context(config1))
+        compare([call.connect(1), call.connect(2), call.connect(1)],
+                m.mock_calls)
+
+    def test_ttl(self):
+        m = Mock()
+        now = [0]
+        @scope('runner', ttl=60)
+        def make():
+            m.make()
+            return Connection()
+        runner = Runner(make)
+        with Replacer() as r:
+            r.replace('mush.Cache.clock', lambda: now[0])
+            runner()
+            now[0] = 61
+            runner()
+        compare([call.make(), call.make()], m.mock_calls)
+
+    def test_returns_and_special_handling(self):
+        m = Mock()
+        @scope('runner')
+        @returns('config')
+        def load():
+            m.load()
+            return {'value': 1}
+        @scope('runner')
+        def both():
+            m.both()
+            return Config(1), Connection()
+        runner = Runner(load, both)
+        runner.add(m.use, item('config', 'value'), Config, ignore(Connection))
+        runner()
+        runner()
+        compare([call.load(), call.both(), call.use(1, ANY),
+                 call.use(1, ANY)], m.mock_calls)
+
+    def test_executor(self):
+        m = Mock()
+        @scope('runner')
+        def make():
+            m.make()
+            return Connection()
+        runner = Runner(make)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            runner(executor=executor)
+            runner(executor=executor)
+        compare([call.make()], m.mock_calls)
+
+
+class MemoizeTests(TestCase):
+
+    def make(self):
+        m = Mock()
+        @memoize(max_size=2)
+        @requires(Config)
+        def parse(config):
+            m.parse(config.value)
+            return config.value * 2
+        return m, parse
+
+    def test_memoize(self):
+        m, parse = self.make()
+        compare(parse.__scope__.name, expected='runner')
+        runner = Runner(parse)
+        config = Config(1)
+        runner(Context(config))
+        runner(Context(config))
+        compare([call.parse(1)], m.mock_calls)
+
+    def test_default_max_size(self):
+        @memoize()
+        @requires(Config)
+        def parse(config):
+            return config.value
+        runner = Runner(parse)
+        # configs without __eq__ and __hash__ never give a hit:
+        for i in range(200):
+            runner(Context(Config(1)))
+        compare(runner.cache_info()[parse],
+                expected=CacheInfo(hits=0, misses=200, max_size=128,
+                                   size=128))
+
+    def test_context_managers_not_kept(self):
+        m = Mock()
+        class Managed(object):
+            def __enter__(self):
+                m.enter()
+            def __exit__(self, type, obj, tb):
+                m.exit()
+        @memoize()
+        def make():
+            m.make()
+            return Managed()
+        runner = Runner(make)
+        runner()
+        runner()
+        compare([call.make(), call.enter(), call.exit(),
+                 call.make(), call.enter(), call.exit()], m.mock_calls)
+        compare(runner.cache_info()[make].size, expected=0)
+
+    def test_cache_info(self):
+        m, parse = self.make()
+        runner = Runner(parse, m.other)
+        config = Config(1)
+        runner(Context(config))
+        runner(Context(config))
+        runner(Context(Config(2)))
+        compare(runner.cache_info(), expected={
+            parse: CacheInfo(hits=1, misses=2, max_size=2, size=2)
+        })
+
+    def test_invalidate(self):
+        m, parse = self.make()
+        runner = Runner(parse)
+        config = Config(1)
+        runner(Context(config))
+        runner.invalidate(parse)
+        runner(Context(config))
+        runner.invalidate()
+        runner(Context(config))
+        compare([call.parse(1)] * 3, m.mock_calls)
+
+    def test_invalidate_process(self):
+        m = Mock()
+        @scope('process')
+        def make():
+            m.make()
+            return Connection()
+        runner = Runner(make)
+        runner()
+        runner.invalidate()
+        Runner(make)()
+        compare([call.make(), call.make()], m.mock_calls)
+
+    def test_invalidate_not_kept(self):
+        m = Mock()
+        runner = Runner(m.job)
+        runner.invalidate(m.job)
+        compare(runner.cache_info(), expected={})
+
+
+class SeedingTests(TestCase):
+
+    def test_seeded(self):
+        m = Mock()
+        config = Config(42)
+        runner = Runner()
+        runner.add(m.job, Config)
+        runner(Context(config))
+        compare([call.job(config)], m.mock_calls)
+
+    def test_seeded_clash(self):
+        runner = Runner(lambda: Config(1))
+        with ShouldRaise(ValueError('Context already contains Config')):
+            runner(Context(Config(2)))
@@ -0,0 +1,243 @@
+from unittest import TestCase
+
+from mock import Mock, call
+from testfixtures import ShouldRaise, compare
+
+from mush import Context, Hook, Runner, Session, lazy, requires, returns
+
+
+class Config(dict):
+    pass
+
+
+class Other(dict):
+    pass
+
+
+class Connection(object):
+    pass
+
+
+class Report(object):
+    pass
+
+
+class SessionTests(TestCase):
+
+    def setUp(self):
+        self.m = m = Mock()
+
+        @requires(Config)
+        @returns(Connection)
+        def connect(config):
+            m.connect(config['db'])
+            return Connection()
+
+        @requires(Other)
+        def other(other):
+            m.other(other['x'])
+
+        @requires(Connection)
+        @returns(Report)
+        def report(connection):
+            m.report()
+            return Report()
+
+        self.runner = Runner(connect, other, report)
+
+    def make_session(self):
+        return self.runner.session(Context(Config(db='a'), Other(x=1)))
+
+    def test_initial_call(self):
+        session = self.make_session()
+        self.assertTrue(isinstance(session, Session))
+        compare([call.connect('a'), call.other(1), call.report()],
+                self.m.mock_calls)
+        self.assertTrue(isinstance(session.context[Report], Report))
+
+    def test_update(self):
+        session = self.make_session()
+        connection = session.context[Connection]
+        self.m.reset_mock()
+        compare(session.update(Config(db='b')), expected=2)
+        compare([call.connect('b'), call.report()], self.m.mock_calls)
+        self.assertFalse(session.context[Connection] is connection)
+
+    def test_update_unaffected(self):
+        session = self.make_session()
+        report = session.context[Report]
+        self.m.reset_mock()
+        compare(session.update(Other(x=2)), expected=1)
+        compare([call.other(2)], self.m.mock_calls)
+        self.assertTrue(session.context[Report] is report)
+
+    def test_update_explicit_type(self):
+        session = self.make_session()
+        self.m.reset_mock()
+        session.update(dict(db='c'), Config)
+        compare([call.connect('c'), call.report()], self.m.mock_calls)
+
+    def test_refresh_unknown_type(self):
+        session = self.make_session()
+        self.m.reset_mock()
+        compare(session.refresh(str), expected=0)
+        compare([], self.m.mock_calls)
+
+    def test_products_learnt(self):
+        m = self.m
+        def connect(config):
+            m.connect()
+            return Connection()
+        def report(connection):
+            m.report()
+        runner = Runner()
+        runner.add(connect, Config)
+        runner.add(report, Connection)
+        session = runner.session(Context(Config()))
+        compare(session.products, expected=[(Connection, ), ()])
+        session.update(Config())
+        compare([call.connect(), call.report()] * 2, m.mock_calls)
+
+    def test_context_managers(self):
+        m = self.m
+
+        class Transaction(object):
+            def __init__(self, name):
+                self.name = name
+            def __enter__(self):
+                m.enter(self.name)
+            def __exit__(self, type, obj, tb):
+                m.exit(self.name)
+
+        class Pool(Transaction):
+            pass
+
+        def pool():
+            return Pool('pool')
+
+        @requires(Config)
+        def transaction(config):
+            return Transaction(config['db'])
+
+        @requires(Transaction)
+        def use(transaction):
+            m.use(transaction.name)
+
+        runner = Runner(pool, transaction, use)
+        with runner.session(Context(Config(db='a'))) as session:
+            session.update(Config(db='b'))
+            compare(session.context.managers,
+                    expected=[session.context[Pool],
+                              session.context[Transaction]])
+        compare([
+            call.enter('pool'),
+            call.enter('a'),
+            call.use('a'),
+            call.exit('a'),
+            call.enter('b'),
+            call.use('b'),
+            call.exit('b'),
+            call.exit('pool'),
+        ], m.mock_calls)
+
+    def test_lazy(self):
+        m = self.m
+
+        @lazy()
+        @requires(Config)
+        class Database(object):
+            def __init__(self, config):
+                m.database(config['db'])
+
+        @requires(Database)
+        def query(db):
+            m.query()
+
+        def unrelated():
+            m.unrelated()
+
+        runner = Runner(Database, unrelated, query)
+        session = runner.session(Context(Config(db='a')))
+        session.update(Config(db='b'))
+        compare([
+            call.unrelated(),
+            call.database('a'),
+            call.query(),
+            call.database('b'),
+            call.query(),
+        ], m.mock_calls)
+
+    def test_exception_on_refresh(self):
+        m = self.m
+        @requires(Config)
+        def check(config):
+            m.check()
+            if config.get('bad'):
+                raise ValueError('bad')
+        session = Runner(check).session(Context(Config()))
+        with ShouldRaise(ValueError('bad')):
+            session.update(Config(bad=True))
+        session.update(Config())
+        compare([call.check()] * 3, m.mock_calls)
+
+    def test_exception_then_update(self):
+        m = self.m
+        m.connect.side_effect = [None, ValueError('bad'), None]
+        session = self.make_session()
+        with ShouldRaise(ValueError('bad')):
+            session.update(Config(db='b'))
+        # what connect produced when last called is still known:
+        compare(session.products[0], expected=(Connection, ))
+        compare(session.dirty, expected={0, 2})
+        m.reset_mock()
+        # the steps that were not called last time are called now:
+        compare(session.update(Other(x=2)), expected=3)
+        compare([call.connect('b'), call.other(2), call.report()],
+                m.mock_calls)
+        compare(session.dirty, expected=set())
+        self.assertTrue(isinstance(session.context[Report], Report))
+
+    def test_exception_on_start(self):
+        m = self.m
+
+        class Manager(object):
+            def __enter__(self):
+                pass
+            def __exit__(self, type, obj, tb):
+                m.exit(type)
+
+        def fail(manager):
+            raise ValueError('bad')
+
+        runner = Runner(Manager)
+        runner.add(fail, Manager)
+        with ShouldRaise(ValueError('bad')):
+            runner.session()
+        compare([call.exit(ValueError)], m.mock_calls)
+
+    def test_exception_suppressed_on_close(self):
+        class Manager(object):
+            def __enter__(self):
+                pass
+            def __exit__(self, type, obj, tb):
+                return True
+
+        with Runner(Manager).session():
+            raise ValueError('bad')
+
+    def test_closed(self):
+        session = self.make_session()
+        session.close()
+        session.close()
+        with ShouldRaise(RuntimeError('Session has been closed')):
+            session.refresh(Config)
+
+    def test_hooks(self):
+        hook = Mock(spec=Hook)
+        self.runner.hooks.append(hook)
+        session = self.make_session()
+        hook.reset_mock()
+        session.update(Other(x=2))
+        session.close()
+        compare(['before', 'after', 'finish'],
+                [c[0] for c in hook.method_calls])
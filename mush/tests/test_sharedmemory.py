@@ -0,0 +1,137 @@
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+import pickle
+from unittest import TestCase
+
+from testfixtures import ShouldRaise, compare
+
+from mush import Runner, requires, returns
+from mush.processes import ProcessPool, in_process
+from mush.sharedmemory import SharedMemoryTransport, attach
+
+pool = ProcessPool(max_workers=2, transport=SharedMemoryTransport(1024))
+
+
+class Small(bytes): pass
+class Numbers(array): pass
+
+
+def describe(obj):
+    return type(obj).__name__, obj.readonly, obj.format, obj.shape, obj[0]
+
+
+@in_process(pool)
+@requires(bytes)
+@returns('big')
+def big(obj):
+    return describe(obj)
+
+
+@in_process(pool)
+@requires(Small)
+@returns('small')
+def small(obj):
+    return type(obj).__name__, len(obj)
+
+
+@in_process(pool)
+@requires(Numbers)
+@returns('numbers')
+def numbers(obj):
+    return describe(obj), sum(obj)
+
+
+def fail(obj):
+    raise ValueError('boom')
+
+
+class SharedMemoryTests(TestCase):
+
+    def setUp(self):
+        self.transport = pool.transport
+        self.addCleanup(pool.shutdown)
+
+    def check_unlinked(self, handle):
+        with ShouldRaise(FileNotFoundError):
+            shared_memory.SharedMemory(handle.name)
+
+    def test_runner(self):
+        results = {}
+        @requires('big', 'small', 'numbers')
+        def collect(big, small, numbers):
+            results.update(big=big, small=small, numbers=numbers)
+        runner = Runner(
+            lambda: b'x' * 4096,
+            lambda: Small(b'y'),
+            lambda: Numbers('d', range(1000)),
+            big, small, numbers, collect
+        )
+        runner()
+        compare(results, expected=dict(
+            big=('memoryview', True, 'B', (4096, ), ord('x')),
+            small=('Small', 1),
+            numbers=(('memoryview', True, 'd', (1000, ), 0.0), 499500.0),
+        ))
+        compare(self.transport.segments, expected={})
+
+    def test_shared_between_concurrent_calls(self):
+        obj = b'x' * 4096
+        handle1 = self.transport.export(obj)
+        handle2 = self.transport.export(obj)
+        self.assertTrue(handle1 is handle2)
+        self.transport.release(handle1)
+        # still in use by the second call:
+        attach(handle1.name).close()
+        self.transport.release(handle2)
+        self.check_unlinked(handle1)
+        compare(self.transport.segments, expected={})
+
+    def test_executor(self):
+        obj = b'x' * 4096
+        handles = []
+        export = self.transport.export
+        def record(obj):
+            handle = export(obj)
+            handles.append(handle)
+            return handle
+        self.transport.export = record
+        self.addCleanup(delattr, self.transport, 'export')
+        runner = Runner(lambda: obj, big)
+        runner.add_returning(in_process(pool)(describe), 'other', bytes)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            runner(executor=executor)
+        compare(len(handles), expected=2)
+        self.check_unlinked(handles[0])
+        compare(self.transport.segments, expected={})
+
+    def test_exception(self):
+        obj = b'x' * 4096
+        with ShouldRaise(ValueError('boom')):
+            pool(fail, obj)
+        compare(self.transport.segments, expected={})
+
+    def test_not_buffers(self):
+        compare(self.transport.export('x' * 4096), expected=None)
+        compare(self.transport.export(object()), expected=None)
+        compare(self.transport.export(memoryview(b'x' * 4096)[::2]),
+                expected=None)
+
+    def test_close(self):
+        handle = self.transport.export(b'x' * 4096)
+        self.transport.close()
+        self.check_unlinked(handle)
+        compare(self.transport.segments, expected={})
+
+    def test_handle_pickles_without_segment(self):
+        handle = self.transport.export(b'x' * 4096)
+        self.addCleanup(self.transport.release, handle)
+        view = handle.open()
+        compare(bytes(view[:2]), expected=b'xx')
+        copy = pickle.loads(pickle.dumps(handle))
+        compare(copy.segment, expected=None)
+        compare(copy.nbytes, expected=4096)
+        del view
+        handle.close()
+        compare(repr(copy),
+                expected='<SharedBuffer %s: 4096 bytes>' % copy.name)
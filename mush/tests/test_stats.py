@@ -0,0 +1,101 @@
+from unittest import TestCase
+
+from testfixtures import ShouldRaise, compare
+
+from mush import Runner, Step, Requirements, Timed
+from mush.stats import Stats, CallableStats
+
+
+def job():
+    return 1
+
+
+class TheError(Exception):
+    pass
+
+
+def bad():
+    raise TheError()
+
+
+def step(obj):
+    return Step(Requirements(), Requirements(), obj)
+
+
+def timed(elapsed):
+    call = Timed(None)
+    call.elapsed = elapsed
+    return call
+
+
+class StatsTests(TestCase):
+
+    def test_runner(self):
+        stats = Stats()
+        runner = Runner(job)
+        runner.hooks.append(stats)
+        for _ in range(3):
+            runner()
+        compare(stats.runs, expected=3)
+        job_stats = stats.callables[job]
+        compare(job_stats.count, expected=3)
+        compare(job_stats.errors, expected=0)
+        compare(dict(job_stats.results), expected={int: 3})
+        compare(repr(job_stats), expected='<CallableStats job: 3 calls>')
+
+    def test_error(self):
+        stats = Stats()
+        runner = Runner(bad)
+        runner.hooks.append(stats)
+        with ShouldRaise(TheError):
+            runner()
+        compare(stats.callables[bad].errors, expected=1)
+        compare(stats.callables[bad].count, expected=1)
+
+    def test_percentiles(self):
+        stats = Stats()
+        s = step(job)
+        for elapsed in range(1, 101):
+            stats.after(None, s, None, timed(elapsed / 1000.0))
+        job_stats = stats.callables[job]
+        compare(job_stats.p50, expected=0.05)
+        compare(job_stats.p95, expected=0.095)
+        compare(job_stats.p99, expected=0.099)
+        compare(job_stats.max, expected=0.1)
+        compare(round(job_stats.mean, 6), expected=0.0505)
+
+    def test_no_calls(self):
+        stats = CallableStats(job, 10, None)
+        compare(stats.p50, expected=None)
+        compare(stats.mean, expected=None)
+
+    def test_sample_bounded(self):
+        stats = Stats(size=10, seed=42)
+        s = step(job)
+        for elapsed in range(1000):
+            stats.after(None, s, None, timed(float(elapsed)))
+        job_stats = stats.callables[job]
+        compare(len(job_stats.samples), expected=10)
+        compare(job_stats.count, expected=1000)
+        compare(job_stats.max, expected=999.0)
+        # a uniform sample should mostly come from the later calls:
+        self.assertTrue(job_stats.p50 > 100)
+
+    def test_report(self):
+        stats = Stats()
+        stats.after(None, step(job), None, timed(0.002))
+        stats.after(None, step(job), None, timed(0.004))
+        stats.error(None, step(bad), TheError(), timed(0.001))
+        compare(stats.report(), expected='\n'.join((
+            'callable  count  errors  total    p50    p95    p99    max',
+            'job           2       0  6.000  2.000  4.000  4.000  4.000',
+            'bad           1       1  1.000  1.000  1.000  1.000  1.000',
+        )))
+
+    def test_reset(self):
+        stats = Stats()
+        stats.start(None)
+        stats.after(None, step(job), None, timed(0.002))
+        stats.reset()
+        compare(stats.callables, expected={})
+        compare(stats.runs, expected=0)
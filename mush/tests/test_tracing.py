@@ -0,0 +1,166 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+import json
+import os
+from tempfile import mkdtemp
+from shutil import rmtree
+from unittest import TestCase
+
+from testfixtures import ShouldRaise, compare
+
+from mush import Runner
+from mush.asynchronous import AsyncRunner
+from mush.tracing import Tracer
+
+
+class Resource(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, obj, tb):
+        pass
+
+
+def make():
+    return Resource()
+
+
+def use(resource):
+    return 1
+
+
+class TheError(Exception):
+    pass
+
+
+def bad():
+    raise TheError()
+
+
+class TracerTests(TestCase):
+
+    def call(self, runner):
+        runner()
+
+    def make_runner(self, *objs):
+        runner = Runner(*objs)
+        tracer = Tracer()
+        runner.hooks.append(tracer)
+        return runner, tracer
+
+    def test_events(self):
+        runner, tracer = self.make_runner()
+        runner.add(make)
+        runner.add(use, Resource)
+        self.call(runner)
+        events = list(tracer.events)
+        compare([(e['name'], e['cat'], e['ph']) for e in events], expected=[
+            ('make', 'callable', 'X'),
+            ('use', 'callable', 'X'),
+            ('Resource', 'context manager', 'X'),
+            ('run', 'run', 'X'),
+        ])
+        for event in events:
+            compare(event['pid'], expected=os.getpid())
+            self.assertTrue(event['dur'] >= 0)
+        callable, _, manager, run = events
+        self.assertTrue(run['ts'] <= callable['ts'] <= manager['ts'])
+        self.assertTrue(manager['ts'] + manager['dur'] <=
+                        run['ts'] + run['dur'])
+
+    def test_error(self):
+        runner, tracer = self.make_runner(bad)
+        with ShouldRaise(TheError):
+            self.call(runner)
+        compare([(e['name'], e['args']) for e in tracer.events], expected=[
+            ('bad', dict(error='TheError()')),
+            ('run', dict(error='TheError()')),
+        ])
+
+
+class ExecutorTracerTests(TracerTests):
+
+    def call(self, runner):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            runner(executor=executor)
+
+
+class AsyncTracerTests(TracerTests):
+
+    def call(self, runner):
+        async_runner = AsyncRunner()
+        async_runner._merge(runner)
+        asyncio.run(async_runner())
+
+
+class SamplingTests(TestCase):
+
+    def test_sample(self):
+        tracer = Tracer(sample=0.5, seed=42)
+        runner = Runner(make)
+        runner.hooks.append(tracer)
+        for _ in range(100):
+            runner()
+        runs = [e for e in tracer.events if e['cat'] == 'run']
+        self.assertTrue(20 < len(runs) < 80, len(runs))
+        compare(len(tracer.events), expected=len(runs) * 3)
+        compare(tracer.runs, expected={})
+
+    def test_none(self):
+        tracer = Tracer(sample=0)
+        runner = Runner(make)
+        runner.hooks.append(tracer)
+        runner()
+        compare(list(tracer.events), expected=[])
+
+    def test_max_events(self):
+        tracer = Tracer(max_events=2)
+        runner = Runner(make)
+        runner.add(use, Resource)
+        runner.hooks.append(tracer)
+        runner()
+        compare([e['name'] for e in tracer.events],
+                expected=['Resource', 'run'])
+
+    def test_clear(self):
+        tracer = Tracer()
+        runner = Runner(make)
+        runner.hooks.append(tracer)
+        runner()
+        tracer.clear()
+        compare(list(tracer.events), expected=[])
+
+
+class WriteTests(TestCase):
+
+    def setUp(self):
+        self.tracer = Tracer()
+        runner = Runner(make)
+        runner.hooks.append(self.tracer)
+        runner()
+
+    def test_chrome(self):
+        output = StringIO()
+        self.tracer.write(output)
+        compare(json.loads(output.getvalue()),
+                expected=dict(traceEvents=list(self.tracer.events)))
+
+    def test_jsonl(self):
+        output = StringIO()
+        self.tracer.write(output, format='jsonl')
+        compare([json.loads(line) for line in output.getvalue().splitlines()],
+                expected=list(self.tracer.events))
+
+    def test_path(self):
+        dir = mkdtemp()
+        self.addCleanup(rmtree, dir)
+        path = os.path.join(dir, 'trace.json')
+        self.tracer.write(path)
+        with open(path) as file:
+            compare(len(json.load(file)['traceEvents']), expected=3)
+
+    def test_bad_format(self):
+        with ShouldRaise(ValueError("'xml' is not a valid format")):
+            self.tracer.write(StringIO(), format='xml')
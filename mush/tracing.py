@@ -0,0 +1,105 @@
+"""
+A :class:`~mush.Hook` for recording a timeline of the calls made by a
+:class:`~mush.Runner` that can be viewed in the trace viewers of
+Chrome and Perfetto.
+"""
+from collections import deque
+import json
+from random import Random
+from threading import Lock
+
+from . import Hook, clock, get_ident, getpid
+from .stats import name
+
+
+class Tracer(Hook):
+    """
+    A :class:`~mush.Hook` that records a span for each run of the
+    runners it is added to, for each callable called and for the time
+    each context manager is entered for, as Chrome trace events.
+
+    :param sample:
+      The fraction of runs to record, between ``0`` and ``1``.
+    :param seed:
+      An optional seed for the random choice of runs to record.
+    :param max_events:
+      If supplied, only this number of the most recent events are kept.
+    """
+
+    def __init__(self, sample=1.0, seed=None, max_events=None):
+        self.sample = sample
+        self.random = Random(seed)
+        #: The events recorded so far, as dictionaries.
+        self.events = deque(maxlen=max_events)
+        self.runs = {}
+        self.lock = Lock()
+
+    def _event(self, name, category, start, elapsed, process, thread,
+               **args):
+        event = dict(name=name, cat=category, ph='X',
+                     ts=start * 1e6, dur=elapsed * 1e6,
+                     pid=process, tid=thread)
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def _call(self, context, step, call, **args):
+        if id(context) in self.runs:
+            self._event(name(step.obj), 'callable', call.start, call.elapsed,
+                        call.process, call.thread, **args)
+
+    def start(self, context):
+        with self.lock:
+            if self.random.random() < self.sample:
+                self.runs[id(context)] = (clock(), get_ident(), {})
+
+    def after(self, context, step, result, call):
+        self._call(context, step, call)
+
+    def error(self, context, step, exception, call):
+        self._call(context, step, call, error=repr(exception))
+
+    def enter(self, context, manager):
+        run = self.runs.get(id(context))
+        if run is not None:
+            run[2][id(manager)] = clock(), get_ident()
+
+    def exit(self, context, manager):
+        run = self.runs.get(id(context))
+        if run is not None:
+            start, thread = run[2].pop(id(manager))
+            self._event(name(type(manager)), 'context manager',
+                        start, clock() - start, getpid(), thread)
+
+    def finish(self, context, exception):
+        with self.lock:
+            run = self.runs.pop(id(context), None)
+        if run is not None:
+            args = {} if exception is None else dict(error=repr(exception))
+            self._event('run', 'run', run[0], clock() - run[0],
+                        getpid(), run[1], **args)
+
+    def clear(self):
+        "Discard all the events recorded so far."
+        self.events.clear()
+
+    def write(self, target, format='chrome'):
+        """
+        Write the events recorded so far to the supplied path or
+        file-like object.
+
+        :param format:
+          ``'chrome'`` for a JSON document that can be loaded into a
+          trace viewer or ``'jsonl'`` for one JSON event per line.
+        """
+        if format not in ('chrome', 'jsonl'):
+            raise ValueError('%r is not a valid format' % format)
+        if isinstance(target, str):
+            with open(target, 'w') as file:
+                return self.write(file, format)
+        events = list(self.events)
+        if format == 'chrome':
+            json.dump(dict(traceEvents=events), target)
+        else:
+            for event in events:
+                target.write(json.dumps(event) + '\n')